@@ -14,4 +14,4 @@ login = LoginManager(app)
 login.login_view = 'login'
 
 
-import CBPlumbing.views, CBPlumbing.models, CBPlumbing.errors
\ No newline at end of file
+import CBPlumbing.database, CBPlumbing.views, CBPlumbing.models, CBPlumbing.errors, CBPlumbing.instrumentation, CBPlumbing.assets, CBPlumbing.tasks, CBPlumbing.reports, CBPlumbing.overdue, CBPlumbing.sync, CBPlumbing.transitions
\ No newline at end of file
@@ -0,0 +1,138 @@
+"""
+Static asset bundles with fingerprinted URLs.
+
+At startup the files in BUNDLES are joined, lightly minified and gzipped in
+memory, and named after a hash of their contents. Templates link them with
+asset_url('site.js'); any other file under static/ can be linked the same way
+by its path and gets a fingerprinted URL too. Because the URL changes whenever
+the contents do, /assets/ responses are marked immutable for a year.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import abort, request, url_for
+from werkzeug.security import safe_join
+
+from CBPlumbing import app
+
+
+BUNDLES = {
+    # Vendor files use their shipped .min builds
+    'site.css': ['content/bootstrap.min.css', 'content/site.css'],
+    'head.js': ['scripts/modernizr-2.6.2.js'],
+    'site.js': ['scripts/jquery-1.10.2.min.js', 'scripts/bootstrap.min.js', 'scripts/respond.min.js'],
+}
+COMPRESSIBLE = {'.css', '.js', '.svg'}
+MAX_AGE = 365 * 24 * 60 * 60
+
+_CSS_URL = re.compile(r"""url\((['"]?)(?!data:|https?:|/)([^'")?#]+)([^'")]*)\1\)""")
+_CSS_COMMENT = re.compile(r'/\*(?!!).*?\*/', re.S)
+_SOURCE_MAP = re.compile(r'^\s*//[#@] sourceMappingURL=.*$', re.M)
+
+
+class Asset(object):
+    def __init__(self, name, data):
+        self.digest = hashlib.sha256(data).hexdigest()[:12]
+        root, extension = posixpath.splitext(name)
+        self.filename = '{}.{}{}'.format(root, self.digest, extension)
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.data = data
+        self.gzipped = None
+        if extension in COMPRESSIBLE:
+            compressed = gzip.compress(data, 9, mtime=0)
+            if len(compressed) < len(data):
+                self.gzipped = compressed
+
+
+def _read(path):
+    with open(os.path.join(app.static_folder, path), 'rb') as static_file:
+        return static_file.read()
+
+
+def _css(path):
+    # The bundle is served from /assets/, so relative font and image URLs are
+    # rewritten to point back into /static/.
+    text = _read(path).decode('utf-8')
+    folder = posixpath.dirname(path)
+
+    def absolute(match):
+        target = posixpath.normpath(posixpath.join(folder, match.group(2)))
+        return "url('{}/{}{}')".format(app.static_url_path, target, match.group(3))
+    text = _CSS_URL.sub(absolute, _CSS_COMMENT.sub('', text))
+    return re.sub(r'\s*\n\s*', '\n', text).strip()
+
+
+def _js(path):
+    return _SOURCE_MAP.sub('', _read(path).decode('utf-8')).strip()
+
+
+def build():
+    """Returns {bundle name: Asset} for every bundle."""
+    assets = {}
+    for name, sources in BUNDLES.items():
+        if name.endswith('.css'):
+            data = '\n'.join(_css(source) for source in sources)
+        else:
+            data = ';\n'.join(_js(source) for source in sources)
+        assets[name] = Asset(name, data.encode('utf-8'))
+    return assets
+
+
+_bundles = build()
+_files = {}
+_by_filename = {asset.filename: asset for asset in _bundles.values()}
+
+
+def bundle_digests():
+    """The bundles' content hashes, which change whenever their URLs do."""
+    return tuple(sorted((name, asset.digest) for name, asset in _bundles.items()))
+
+
+def _static_file(path):
+    if path not in _files:
+        asset = Asset(path, _read(path))
+        _files[path] = asset
+        _by_filename[asset.filename] = asset
+    return _files[path]
+
+
+@app.template_global()
+def asset_url(name):
+    """URL of a bundle, or of a file under static/, that can be cached forever."""
+    asset = _bundles.get(name) or _static_file(name)
+    return url_for('asset', filename=asset.filename)
+
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    asset = _by_filename.get(filename)
+    if asset is None:
+        # Another worker may have handed out this URL before this one saw
+        # the file, so work back from the name to the file on disk.
+        root, extension = posixpath.splitext(filename)
+        path = posixpath.splitext(root)[0] + extension
+        full_path = safe_join(app.static_folder, path)
+        if full_path is None or not os.path.isfile(full_path):
+            abort(404)
+        asset = _static_file(path)
+        if asset.filename != filename:
+            abort(404)
+
+    body = asset.data
+    gzipped = asset.gzipped is not None and 'gzip' in request.accept_encodings
+    if gzipped:
+        body = asset.gzipped
+    response = app.response_class(body, mimetype=asset.mimetype)
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.set_etag(asset.digest)
+    response.cache_control.public = True
+    response.cache_control.max_age = MAX_AGE
+    response.cache_control.immutable = True
+    return response
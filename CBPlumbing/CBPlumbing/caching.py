@@ -0,0 +1,103 @@
+"""
+Rendered fragment cache for the detail and list templates.
+
+Templates wrap a fragment in a call block naming what it shows:
+
+    {% call cached_fragment('invoice_detail', [('invoice', invoice.id)]) %}
+        ...
+    {% endcall %}
+
+A dependency is either one entity, ``(kind, id)``, or a whole kind such as
+``'job'`` for a list. The cache key holds the current version of every
+dependency as read from the database (see conditional.py): the rows'
+updated_at and the table counts. A write from any worker process or the task
+workers, including bulk UPDATEs, moves the key on. Stale fragments are never
+looked up again and age out of the LRU. The body of the call block, including
+any lazy loads it triggers, only runs on a miss.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class VersionFile(object):
+    """
+    A stamp file rewritten on every change so that caches in other worker
+    processes can tell they need clearing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.seen = self.read()
+
+    def read(self):
+        try:
+            with open(self.path) as version_file:
+                return version_file.read()
+        except FileNotFoundError:
+            return ''
+
+    def changed(self):
+        """True once after another process has bumped the stamp."""
+        current = self.read()
+        if current == self.seen:
+            return False
+        self.seen = current
+        return True
+
+    def bump(self):
+        self.seen = '{}-{}'.format(os.getpid(), time.time_ns())
+        with open(self.path, 'w') as version_file:
+            version_file.write(self.seen)
+
+
+class FragmentCache(object):
+    def __init__(self, max_bytes=32 * 1024 * 1024, versions=None):
+        self.max_bytes = max_bytes
+        # function(deps) -> the current versions of deps, read from the database
+        self.versions = versions
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self.size, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def fragment(self, name, deps, extra=None, caller=None):
+        """Jinja call block target: returns the cached body or renders it."""
+        if self.max_bytes <= 0:
+            return caller()
+        deps = tuple(tuple(dep) if isinstance(dep, list) else dep for dep in deps)
+        # The versions are read before the body renders, so a fragment is
+        # never stored under a version newer than the rows it shows
+        key = (name, deps, self.versions(deps), extra)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        html = caller()
+        size = sys.getsizeof(html)
+        with self._lock:
+            if size <= self.max_bytes and key not in self._entries:
+                self._entries[key] = (html, size)
+                self.size += size
+                while self.size > self.max_bytes:
+                    self.size -= self._entries.popitem(last=False)[1][1]
+                    self.evictions += 1
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
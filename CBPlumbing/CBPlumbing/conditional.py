@@ -0,0 +1,170 @@
+"""
+Conditional GET for the detail and list pages.
+
+Each page gets a validator query that reads only version columns: the
+updated_at timestamps of the row it shows and its children, with counts so
+that deleted children change the ETag too, or for a list the newest change
+log seq of each table it shows. When the browser's ETag or Last-Modified is
+still current the view answers 304 without loading relationships or
+rendering.
+The same versions key the fragment cache, and are read once per request.
+"""
+
+import functools
+import hashlib
+import inspect
+import os
+from datetime import timezone
+
+import sqlalchemy as sa
+from flask import g, make_response, request, session
+from flask_login import current_user
+
+from CBPlumbing import app, db
+from CBPlumbing.assets import bundle_digests
+from CBPlumbing.models import Customer, Job, JobItems, Invoice, ChangeLog, fragment_cache
+
+
+def _deploy_salt():
+    # Deploying new templates or assets has to change every ETag, or a page
+    # kept by the browser would go on linking fingerprinted asset URLs that
+    # no longer exist. The file mtimes and bundle hashes are the same in
+    # every worker process.
+    newest = 0
+    for root in (app.jinja_loader.searchpath[0], app.static_folder):
+        for folder, _, files in os.walk(root):
+            for name in files:
+                newest = max(newest, os.stat(os.path.join(folder, name)).st_mtime_ns)
+    return repr((newest, bundle_digests()))
+
+
+DEPLOY_SALT = _deploy_salt()
+
+
+# Change log kind of each table a list page shows; see CBPlumbing/sync.py
+_KINDS = {Customer: 'customer', Job: 'job', Invoice: 'invoice'}
+
+
+def conditional(validator):
+    """
+    Decorates a GET view with validator(**view_args), which returns a tuple of
+    version values and the last modified time, or None when the row is missing
+    so that the view handles it as before.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # Pending flash messages have to reach the page, so never 304 then
+            if request.method != 'GET' or '_flashes' in session:
+                return view(*args, **kwargs)
+            state = validator(*args, **kwargs)
+            if state is None:
+                return view(*args, **kwargs)
+            versions, last_modified = state
+            etag = hashlib.sha1(repr((DEPLOY_SALT, current_user.get_id(), request.full_path, versions))
+                                .encode()).hexdigest()
+            if last_modified is not None:
+                last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+
+            if request.if_none_match:
+                current = request.if_none_match.contains(etag)
+            else:
+                current = (last_modified is not None and request.if_modified_since is not None
+                           and last_modified <= request.if_modified_since)
+            response = app.response_class(status=304) if current else make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+                # Keep the copy in the browser only, and check back every time
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+def _per_request(function):
+    # The validator and then the fragment cache ask for the same versions,
+    # one with the view's keyword arguments and one positionally
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        versions = g.setdefault('versions', {})
+        key = (function.__name__,) + tuple(signature.bind(*args, **kwargs).arguments.values())
+        if key not in versions:
+            versions[key] = function(*args, **kwargs)
+        return versions[key]
+    return wrapper
+
+
+@_per_request
+def table_version(model):
+    # The table's newest change log seq. Seqs are handed out under SQLite's
+    # write lock, so unlike updated_at, which is stamped before a writer waits
+    # for the lock, they only move forward in commit order. Deletes leave a
+    # tombstone with a new seq too.
+    return db.session.scalar(sa.select(sa.func.max(ChangeLog.seq)).where(ChangeLog.kind == _KINDS[model]))
+
+
+def _newest(*timestamps):
+    timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+    return max(timestamps) if timestamps else None
+
+
+def list_version(*models):
+    # No Last-Modified: the lists are versioned by seq, and no timestamp moves
+    # in commit order
+    def validator(*args, **kwargs):
+        return tuple(table_version(model) for model in models), None
+    return validator
+
+
+@_per_request
+def customer_version(customer_id):
+    updated_at = db.session.scalar(sa.select(Customer.updated_at).where(Customer.id == customer_id))
+    if updated_at is None:
+        return None
+    return (updated_at,), updated_at
+
+
+@_per_request
+def job_version(job_id):
+    def newest(model):
+        return sa.select(sa.func.max(model.updated_at)).where(model.job_id == Job.id).scalar_subquery()
+
+    def count(model):
+        return sa.select(sa.func.count()).where(model.job_id == Job.id).scalar_subquery()
+
+    row = db.session.execute(
+        sa.select(Job.updated_at, Customer.updated_at, newest(JobItems), count(JobItems),
+                  newest(Invoice), count(Invoice))
+        .outerjoin(Customer, Customer.id == Job.customer_id)
+        .where(Job.id == job_id)).first()
+    if row is None:
+        return None
+    return tuple(row), _newest(row[0], row[1], row[2], row[4])
+
+
+@_per_request
+def invoice_version(invoice_id):
+    updated_at = db.session.scalar(sa.select(Invoice.updated_at).where(Invoice.id == invoice_id))
+    if updated_at is None:
+        return None
+    return (updated_at,), updated_at
+
+
+# What each fragment dependency kind reads: one row's versions, or its
+# table's. A job's versions cover its customer, items and invoices too.
+_ROW_VERSIONS = {'customer': customer_version, 'job': job_version, 'invoice': invoice_version}
+_TABLES = {'customer': Customer, 'job': Job, 'invoice': Invoice}
+
+
+def fragment_versions(deps):
+    """The current versions of fragment dependencies, (kind, id) or kind."""
+    return tuple(_ROW_VERSIONS[dep[0]](dep[1]) if isinstance(dep, tuple) else table_version(_TABLES[dep])
+                 for dep in deps)
+
+
+fragment_cache.versions = fragment_versions
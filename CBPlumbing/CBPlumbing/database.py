@@ -0,0 +1,94 @@
+"""
+SQLite engine profile for running several workers against one database file:
+connection pragmas, retrying requests that hit a lock, and periodic WAL
+checkpoints.
+"""
+
+import functools
+import random
+import sqlite3
+import time
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+from CBPlumbing import app, db
+
+
+JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+SYNCHRONOUS_MODES = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+
+@sa.event.listens_for(Engine, 'connect')
+def apply_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    journal_mode = app.config['SQLITE_JOURNAL_MODE'].upper()
+    synchronous = app.config['SQLITE_SYNCHRONOUS'].upper()
+    if journal_mode not in JOURNAL_MODES or synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError('Unsupported SQLite journal or synchronous mode')
+    cursor = dbapi_connection.cursor()
+    # busy_timeout first so the journal mode switch itself waits for locks
+    cursor.execute('PRAGMA busy_timeout = {:d}'.format(app.config['SQLITE_BUSY_TIMEOUT']))
+    cursor.execute('PRAGMA journal_mode = {}'.format(journal_mode))
+    cursor.execute('PRAGMA synchronous = {}'.format(synchronous))
+    cursor.execute('PRAGMA cache_size = {:d}'.format(app.config['SQLITE_CACHE_SIZE']))
+    cursor.execute('PRAGMA mmap_size = {:d}'.format(app.config['SQLITE_MMAP_SIZE']))
+    cursor.close()
+
+
+def is_lock_error(error):
+    message = str(error.orig).lower()
+    return isinstance(error.orig, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+def retry_on_lock(view):
+    """
+    Re-runs a view with exponential backoff when SQLite reports the database
+    is locked. busy_timeout covers most waits, but a deferred transaction
+    that has to upgrade from a read to a write lock fails straight away and
+    can only be retried from the start.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        retries = app.config['SQLITE_LOCK_RETRIES']
+        for attempt in range(retries + 1):
+            try:
+                return view(*args, **kwargs)
+            except OperationalError as error:
+                if attempt == retries or not is_lock_error(error):
+                    raise
+                db.session.rollback()
+                time.sleep(0.02 * 2 ** attempt * random.uniform(0.5, 1.5))
+    return wrapper
+
+
+def write_lock(connection):
+    """
+    Takes SQLite's write lock for the connection's transaction now, before
+    anything is read. The driver only opens a transaction ahead of an INSERT,
+    UPDATE or DELETE, so without this a DROP or CREATE run after plain reads
+    would be committed on its own, and ids read before the first write could
+    be taken by another writer in between.
+    """
+    if connection.dialect.name == 'sqlite' and not connection.connection.driver_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+_last_checkpoint = time.monotonic()
+
+
+@app.after_request
+def checkpoint_wal(response):
+    # SQLite's auto-checkpoint only runs on commit and gives up while readers
+    # are active, so busy sites also get a passive checkpoint every interval.
+    global _last_checkpoint
+    interval = app.config['SQLITE_CHECKPOINT_INTERVAL']
+    if (interval and app.config['SQLITE_JOURNAL_MODE'].upper() == 'WAL'
+            and db.engine.dialect.name == 'sqlite'
+            and time.monotonic() - _last_checkpoint >= interval):
+        _last_checkpoint = time.monotonic()
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql('PRAGMA wal_checkpoint(PASSIVE)')
+    return response
@@ -0,0 +1,195 @@
+"""
+Streaming CSV and XLSX exports of jobs, job items and invoices.
+
+Rows come from a single joined SELECT read in batches with yield_per and are
+written out as they arrive, so memory use does not depend on how many rows
+are exported. Job totals are the stored Job.total_cost and item totals are
+computed in the query, so there are no per-row lookups.
+
+XLSX files are written with zipfile and inline strings rather than a
+spreadsheet library, which would build the whole workbook in memory.
+"""
+
+import csv
+import io
+import re
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+import sqlalchemy as sa
+
+from CBPlumbing import db
+from CBPlumbing.models import Customer, Job, JobItems, Invoice
+
+
+BATCH = 1000
+FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+# The same filters as the view_all_jobs page
+FILTERS = {
+    'job_type': Job.job_type,
+    'job_status': Job.job_status,
+    'invoice_status': Job.invoice_status,
+}
+
+_customer_name = sa.func.coalesce(Customer.first_name, '') + ' ' + sa.func.coalesce(Customer.last_name, '')
+
+EXPORTS = {
+    'jobs': sa.select(
+        Job.id.label('Job ID'), Job.customer_id.label('Customer ID'), _customer_name.label('Customer Name'),
+        Job.job_type.label('Job Type'), Job.job_status.label('Job Status'),
+        Job.invoice_status.label('Invoice Status'), Job.job_created_date.label('Created Date'),
+        Job.job_planned_date.label('Planned Date'), Job.job_completed_date.label('Completed Date'),
+        Job.total_cost.label('Total Cost'), Job.job_notes.label('Job Notes'))
+        .outerjoin(Customer, Customer.id == Job.customer_id)
+        .order_by(Job.id),
+    'job_items': sa.select(
+        JobItems.id.label('Item ID'), JobItems.job_id.label('Job ID'), _customer_name.label('Customer Name'),
+        Job.job_type.label('Job Type'), Job.job_status.label('Job Status'),
+        JobItems.item_name.label('Item Name'), JobItems.item_description.label('Item Description'),
+        JobItems.item_quantity.label('Item Quantity'), JobItems.item_cost.label('Item Cost'),
+        (JobItems.item_quantity * JobItems.item_cost).label('Item Total'), Job.total_cost.label('Job Total'))
+        .join(Job, Job.id == JobItems.job_id)
+        .outerjoin(Customer, Customer.id == Job.customer_id)
+        .order_by(JobItems.id),
+    'invoices': sa.select(
+        Invoice.id.label('Invoice ID'), Invoice.job_id.label('Job ID'), _customer_name.label('Customer Name'),
+        Invoice.invoice_date.label('Invoice Date'), Invoice.due_date.label('Due Date'),
+        Invoice.status.label('Status'), Invoice.total_amount.label('Total Amount'))
+        .join(Job, Job.id == Invoice.job_id)
+        .outerjoin(Customer, Customer.id == Job.customer_id)
+        .order_by(Invoice.id),
+}
+
+
+def query(kind, filters):
+    """The export SELECT for kind with any FILTERS given in filters applied."""
+    statement = EXPORTS[kind]
+    for name, column in FILTERS.items():
+        if filters.get(name):
+            statement = statement.where(column == filters[name])
+    return statement
+
+
+def rows(kind, filters):
+    """Yields the header and then every row, reading BATCH rows at a time."""
+    statement = query(kind, filters)
+    yield [column.name for column in statement.selected_columns]
+    result = db.session.execute(statement.execution_options(yield_per=BATCH))
+    for partition in result.partitions():
+        yield from partition
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M')
+    if isinstance(value, float):
+        return str(round(value, 2))
+    return str(value)
+
+
+def csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for number, row in enumerate(rows, 1):
+        writer.writerow([_text(value) for value in row])
+        if number % BATCH == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _Sink(io.RawIOBase):
+    """Write-only stream that hands back whatever zipfile has written so far."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_XLSX_PARTS = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>',
+    'xl/workbook.xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="{sheet}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>',
+}
+
+
+def _cell(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return '<c><v>{}</v></c>'.format(value)
+    text = escape(_XML_ILLEGAL.sub('', _text(value)))
+    return '<c t="inlineStr"><is><t xml:space="preserve">{}</t></is></c>'.format(text)
+
+
+def xlsx_chunks(rows, sheet='Export'):
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        for name, xml in _XLSX_PARTS.items():
+            workbook.writestr(name, xml.format(sheet=escape(sheet)))
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as worksheet:
+            worksheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                            b'<sheetData>')
+            for number, row in enumerate(rows, 1):
+                worksheet.write(('<row>' + ''.join(_cell(value) for value in row) + '</row>').encode('utf-8'))
+                if number % BATCH == 0:
+                    yield sink.drain()
+            worksheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()
+
+
+def chunks(kind, fmt, filters):
+    """The export as an iterable of bytes chunks."""
+    if fmt == 'xlsx':
+        return xlsx_chunks(rows(kind, filters), sheet=kind.replace('_', ' ').title())
+    return csv_chunks(rows(kind, filters))
+
+
+def filename(kind, fmt):
+    return '{}-{}.{}'.format(kind, datetime.now().strftime('%Y%m%d'), fmt)
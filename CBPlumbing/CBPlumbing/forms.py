@@ -1,10 +1,12 @@
 
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, BooleanField, SubmitField, SelectField, TextAreaField, IntegerField, FloatField, DateField, DateTimeField
-from wtforms.validators import ValidationError, DataRequired, Email, EqualTo, Length
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import Form, FieldList, FormField, StringField, PasswordField, BooleanField, SubmitField, SelectField, SelectMultipleField, HiddenField, TextAreaField, IntegerField, FloatField, DateField, DateTimeField
+from wtforms.widgets import HiddenInput
+from wtforms.validators import ValidationError, DataRequired, Email, EqualTo, Length, Optional
 import sqlalchemy as sa
 from CBPlumbing import db
-from CBPlumbing.models import User
+from CBPlumbing.models import User, Customer
 from config import QueryConfig
 
 class LoginForm(FlaskForm):
@@ -34,7 +36,7 @@ class RegistrationForm(FlaskForm):
         if user is not None:
             raise ValidationError('Please use a different email address.')
         
-class AddCustomerForm(FlaskForm):
+class CustomerFields(Form):
     first_name = StringField('First Name', validators=[DataRequired()])
     last_name = StringField('Last Name', validators=[DataRequired()])
     phone = StringField('Phone', validators=[DataRequired()])
@@ -45,35 +47,94 @@ class AddCustomerForm(FlaskForm):
     county = StringField('County', validators=[DataRequired()])
     postal_code = StringField('Postal Code', validators=[DataRequired()])
     referal = StringField('Referal')
+
+
+class AddCustomerForm(FlaskForm, CustomerFields):
     submit = SubmitField('Save')
     
 
+def active_customer(form, field):
+    customer_id = db.session.scalar(sa.select(Customer.id).where(
+        Customer.id == field.data, Customer.customer_active == True))
+    if customer_id is None:
+        raise ValidationError('Please choose an active customer.')
+
+
 class AddJobForm(FlaskForm):
-    customer_id = SelectField('Customer', coerce=int)
+    customer_id = IntegerField('Customer', validators=[DataRequired(), active_customer])
     job_type = SelectField('Job Type', validators=[DataRequired()])  
     job_planned_date = DateField('Job Planned Date')
     job_notes = TextAreaField('Job Notes', validators=[Length(min=0, max=140)])
     submit = SubmitField('Save')
     
 class EditJobForm(FlaskForm):
-    customer_id = SelectField('Customer', coerce=int)
+    customer_id = IntegerField('Customer', validators=[DataRequired(), active_customer])
     job_status = SelectField('Job Status', validators=[DataRequired()])
     job_type = SelectField('Job Type', validators=[DataRequired()])
     job_notes = TextAreaField('Job Notes', validators=[Length(min=0, max=140)])
     invoice_status = SelectField('Invoice Status', validators=[DataRequired()])
     job_planned_date = DateField('Job Planned Date')
     job_completed_date = DateField('Job Completed Date')
+    # The version the page was loaded at, so a save over someone else's is caught
+    version_id = IntegerField(widget=HiddenInput(), validators=[Optional()])
     submit = SubmitField('Save')
     
-class JobItemForm(FlaskForm):
+class JobItemFields(Form):
     item_name = StringField('Item Name', validators=[DataRequired()])
     item_description = TextAreaField('Item Description', validators=[Length(min=0, max=140)])
     item_quantity = IntegerField('Item Quantity', validators=[DataRequired()])
     item_cost = FloatField('Item Cost', validators=[DataRequired()])
+
+class JobItemForm(FlaskForm, JobItemFields):
+    version_id = IntegerField(widget=HiddenInput(), validators=[Optional()])
     submit = SubmitField('Save')
+
+class JobItemBatchForm(FlaskForm):
+    items = FieldList(FormField(JobItemFields), min_entries=5, max_entries=200)
+    submit = SubmitField('Save All')
+
+    def validate(self, extra_validators=None):
+        # Rows left completely blank are dropped rather than failing DataRequired
+        self.items.entries = [entry for entry in self.items.entries
+                              if any(field.data not in (None, '') for field in entry.form)]
+        if not self.items.entries:
+            super().validate(extra_validators)
+            self.items.errors.append('Enter at least one item.')
+            return False
+        return super().validate(extra_validators)
     
+class JobHistoryFields(JobItemFields):
+    # One row of a job history import: an item plus the fields of its job,
+    # with the EditJobForm rules. The importer checks customers are active
+    # for a whole batch at once, as active_customer would run a query per
+    # row. Rows sharing a job_ref make up one job.
+    job_ref = StringField('Job Ref', validators=[DataRequired()])
+    customer_id = IntegerField('Customer', validators=[DataRequired()])
+    job_type = SelectField('Job Type', validators=[DataRequired()], choices=[(type, type) for type in QueryConfig.JOB_TYPE_LIST])
+    job_status = SelectField('Job Status', default='Open', choices=[(status, status) for status in QueryConfig.JOB_STATUS_LIST])
+    invoice_status = SelectField('Invoice Status', default='None', choices=[(status, status) for status in QueryConfig.INVOICE_STATUS_LIST])
+    job_notes = TextAreaField('Job Notes', validators=[Length(min=0, max=140)])
+    job_created_date = DateField('Job Created Date', validators=[Optional()])
+    job_planned_date = DateField('Job Planned Date', validators=[Optional()])
+    job_completed_date = DateField('Job Completed Date', validators=[Optional()])
+
+
+class BulkStatusForm(FlaskForm):
+    # Posted from a list page, with a checkbox named ids on each row
+    ids = SelectMultipleField(coerce=int, validate_choice=False, validators=[DataRequired()])
+    status = SelectField('Set Status', validators=[DataRequired()])
+    next = HiddenField()
+    submit = SubmitField('Apply')
+
+
+class ImportForm(FlaskForm):
+    kind = SelectField('Import', choices=[('customers', 'Customers'), ('jobs', 'Job History')])
+    file = FileField('CSV File', validators=[FileRequired(), FileAllowed(['csv'], 'Please choose a CSV file.')])
+    submit = SubmitField('Import')
+
 
 class InvoiceForm(FlaskForm):
     job_id = IntegerField('Job ID', validators=[DataRequired()])
     due_date = DateField('Due Date', format='%Y-%m-%d', validators=[DataRequired()])
     status = SelectField('Status', choices=[(type, type) for type in QueryConfig.INVOICE_STATUS_LIST])
+    version_id = IntegerField(widget=HiddenInput(), validators=[Optional()])
@@ -0,0 +1,300 @@
+"""
+Bulk CSV import of customers and job history.
+
+The CSV is read one row at a time and each row is checked with the same field
+rules as the forms: CustomerFields for customers, and JobHistoryFields (the
+JobItemFields rules plus the job's own fields) for job history. Good rows are
+inserted BATCH at a time with executemany and committed after every batch, so
+a large file never holds the write lock for long. Bad rows are reported by
+line number and skipped without stopping the import.
+
+Job history has one row per job item. Rows with the same job_ref next to each
+other make up one job, which takes its job fields from its first good row.
+"""
+
+import csv
+import re
+import time
+from datetime import datetime, time as midnight
+
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError, OperationalError
+from wtforms.validators import Email
+
+from CBPlumbing import app, db, reports, search, sync
+from CBPlumbing.database import is_lock_error, write_lock
+from CBPlumbing.forms import CustomerFields, JobItemFields, JobHistoryFields
+from CBPlumbing.models import Customer, Job, JobItems
+
+
+BATCH = 5000
+# Failures kept on the report for the upload page; a report file gets them all
+MAX_FAILURES = 1000
+
+_DOT_ATOM = re.compile(r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*\Z")
+
+
+class _KnownDomainEmail(object):
+    """
+    Wraps an Email validator. Nearly all of its time goes on checking the
+    domain, so once a domain has passed, plain addresses at that domain are
+    accepted without asking it again. Anything unusual still goes through the
+    wrapped validator.
+    """
+
+    def __init__(self, validator):
+        self.validator = validator
+        self.domains = set()
+
+    def __call__(self, form, field):
+        address = field.data or ''
+        local, _, domain = address.rpartition('@')
+        if domain in self.domains and len(local) <= 64 and len(address) <= 254 and _DOT_ATOM.match(local):
+            return
+        self.validator(form, field)
+        self.domains.add(domain)
+
+
+def _row_form(form_class):
+    # One form is reused for every row; building a new one per row costs
+    # more than validating it.
+    form = form_class()
+    for field in form:
+        field.validators = [_KnownDomainEmail(validator) if isinstance(validator, Email) else validator
+                            for validator in field.validators]
+    return form
+
+
+class _Row(dict):
+    # The part of the formdata interface forms read, without building a MultiDict
+    def getlist(self, name):
+        return [self[name]] if name in self else []
+
+
+def _rows(stream, form):
+    """Yields (line number, form data) for each CSV row, leaving out blank cells."""
+    reader = csv.DictReader(stream)
+    missing = [field.name for field in form
+               if field.flags.required and field.name not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError('Missing columns: {}'.format(', '.join(missing)))
+    for row in reader:
+        yield reader.line_num, _Row((name, value.strip()) for name, value in row.items()
+                                    if name in form and value and value.strip())
+
+
+def _next_id(model):
+    return (db.session.scalar(sa.select(sa.func.max(model.id))) or 0) + 1
+
+
+def _datetime(value):
+    return datetime.combine(value, midnight()) if value is not None else None
+
+
+def _write(insert):
+    """
+    Runs insert() and commits, starting again if SQLite reports a lock.
+    insert() takes the write lock before it reads MAX(id) for the new ids, so
+    no other writer can take those ids before the commit.
+    """
+    retries = app.config['SQLITE_LOCK_RETRIES']
+    for attempt in range(retries + 1):
+        try:
+            result = insert()
+            db.session.commit()
+            return result
+        except OperationalError as error:
+            db.session.rollback()
+            if attempt == retries or not is_lock_error(error):
+                raise
+            time.sleep(0.05 * 2 ** attempt)
+
+
+class ImportReport(object):
+    """
+    Counts and line numbered failures for one import. With out, every row is
+    also written there as CSV: line, status, the new customer or job id, and
+    the errors.
+    """
+
+    def __init__(self, kind, out=None):
+        self.kind = kind
+        self.imported = 0
+        self.failed = 0
+        self.failures = []
+        self.error = None
+        self.seconds = 0.0
+        self._writer = csv.writer(out) if out is not None else None
+        if self._writer is not None:
+            self._writer.writerow(['line', 'status', 'id', 'errors'])
+
+    @property
+    def rows_per_second(self):
+        return (self.imported + self.failed) / self.seconds if self.seconds else 0.0
+
+    def imported_row(self, line, record_id):
+        self.imported += 1
+        if self._writer is not None:
+            self._writer.writerow([line, 'imported', record_id, ''])
+
+    def failed_row(self, line, errors):
+        self.failed += 1
+        message = '; '.join('{}: {}'.format(name, ' '.join(str(error) for error in field_errors))
+                            for name, field_errors in errors.items())
+        if len(self.failures) < MAX_FAILURES:
+            self.failures.append((line, message))
+        if self._writer is not None:
+            self._writer.writerow([line, 'failed', '', message])
+
+
+def import_customers(stream, report):
+    form = _row_form(CustomerFields)
+    batch = []
+    for line, row in _rows(stream, form):
+        form.process(row)
+        if not form.validate():
+            report.failed_row(line, form.errors)
+            continue
+        batch.append((line, form.data))
+        if len(batch) >= BATCH:
+            _insert_customers(batch, report)
+            batch = []
+    if batch:
+        _insert_customers(batch, report)
+
+
+def _insert_customers(batch, report):
+    # RETURNING with executemany runs row by row on SQLite, so the ids are
+    # chosen here instead
+    def insert():
+        connection = db.session.connection()
+        write_lock(connection)
+        start = _next_id(Customer)
+        last = start + len(batch) - 1
+        with search.bulk_insert(connection, 'customer', start, last), \
+                sync.bulk_insert(connection, 'customer', start, last):
+            db.session.execute(sa.insert(Customer), [dict(values, id=start + number)
+                                                     for number, (_, values) in enumerate(batch)])
+        return start
+
+    start = _write(insert)
+    for number, (line, _) in enumerate(batch):
+        report.imported_row(line, start + number)
+
+
+class _HistoryJob(object):
+    def __init__(self, values):
+        self.values = values
+        self.lines = []
+        self.items = []
+
+    def add(self, line, values):
+        self.lines.append(line)
+        self.items.append({name: values[name] for name in ('item_name', 'item_description', 'item_quantity', 'item_cost')})
+
+
+def import_jobs(stream, report):
+    # The job fields repeat on every row of a job but only its first good row
+    # is used, so the rows after that are checked as items alone
+    job_form, item_form = _row_form(JobHistoryFields), _row_form(JobItemFields)
+    jobs, job, job_ref, items = [], None, None, 0
+    for line, row in _rows(stream, job_form):
+        if row.get('job_ref') != job_ref:
+            # Only break batches between jobs, so a job is never split
+            if items >= BATCH:
+                _insert_jobs(jobs, report)
+                jobs, items = [], 0
+            job, job_ref = None, row.get('job_ref')
+        form = job_form if job is None else item_form
+        form.process(row)
+        if not form.validate():
+            report.failed_row(line, form.errors)
+            continue
+        values = form.data
+        if job is None:
+            job = _HistoryJob(values)
+            jobs.append(job)
+        job.add(line, values)
+        items += 1
+    if jobs:
+        _insert_jobs(jobs, report)
+
+
+def _insert_jobs(jobs, report):
+    # The active_customer rule, checked once per batch rather than per row
+    customer_ids = set(db.session.scalars(sa.select(Customer.id).where(
+        Customer.id.in_({job.values['customer_id'] for job in jobs}), Customer.customer_active == True)))
+    missing = [job for job in jobs if job.values['customer_id'] not in customer_ids]
+    for job in missing:
+        for line in job.lines:
+            report.failed_row(line, {'customer_id': ['No active customer with this id.']})
+    jobs = [job for job in jobs if job.values['customer_id'] in customer_ids]
+    if not jobs:
+        db.session.rollback()
+        return
+
+    now = datetime.utcnow()
+    job_rows = [{
+        'customer_id': job.values['customer_id'],
+        'job_type': job.values['job_type'],
+        'job_status': job.values['job_status'],
+        'invoice_status': job.values['invoice_status'],
+        'job_notes': job.values['job_notes'],
+        'job_created_date': _datetime(job.values['job_created_date']) or now,
+        'job_planned_date': _datetime(job.values['job_planned_date']),
+        'job_completed_date': _datetime(job.values['job_completed_date']),
+        'total_cost': sum(item['item_quantity'] * item['item_cost'] for item in job.items),
+    } for job in jobs]
+
+    item_rows = [(number, item) for number, job in enumerate(jobs) for item in job.items]
+
+    def insert():
+        connection = db.session.connection()
+        write_lock(connection)
+        start, item_start = _next_id(Job), _next_id(JobItems)
+        last, item_last = start + len(job_rows) - 1, item_start + len(item_rows) - 1
+        with search.bulk_insert(connection, 'job', start, last), \
+                search.bulk_insert(connection, 'job_items', item_start, item_last), \
+                sync.bulk_insert(connection, 'job', start, last), \
+                sync.bulk_insert(connection, 'job_items', item_start, item_last):
+            db.session.execute(sa.insert(Job), [dict(row, id=start + number) for number, row in enumerate(job_rows)])
+            db.session.execute(sa.insert(JobItems), [dict(item, id=item_start + index, job_id=start + number)
+                                                     for index, (number, item) in enumerate(item_rows)])
+        reports.add(connection, 'job', 'job.id BETWEEN :first AND :last',
+                    first=start, last=start + len(job_rows) - 1)
+        return start
+
+    start = _write(insert)
+    for number, job in enumerate(jobs):
+        for line in job.lines:
+            report.imported_row(line, start + number)
+
+
+IMPORTS = {
+    'customers': import_customers,
+    'jobs': import_jobs,
+}
+COLUMNS = {
+    'customers': [field.name for field in CustomerFields()],
+    'jobs': [field.name for field in JobHistoryFields()],
+}
+
+
+def run(kind, stream, out=None):
+    """
+    Imports the CSV text stream as kind and returns its ImportReport. A file
+    that cannot be read as CSV, or a batch the database refuses, stops the
+    import with report.error set; the batches committed before that stay in.
+    """
+    report = ImportReport(kind, out)
+    start = time.perf_counter()
+    try:
+        IMPORTS[kind](stream, report)
+    except (ValueError, csv.Error) as error:
+        db.session.rollback()
+        report.error = str(error)
+    except IntegrityError as error:
+        db.session.rollback()
+        report.error = 'A batch could not be saved, so the import stopped there: {}'.format(error.orig)
+    report.seconds = time.perf_counter() - start
+    return report
@@ -0,0 +1,130 @@
+"""
+Per-request SQL instrumentation.
+
+Cursor events count the statements each request runs and time them. The
+totals go out in a Server-Timing header, statements repeated often enough to
+look like an N+1 loop are logged, and per-endpoint aggregates are kept in
+memory for the admin report at /admin/sql_report (POST to read and reset
+it). /admin/cache_report shows the user and fragment cache counters. With
+SQL_INSTRUMENTATION=0 the cursor events return straight away.
+"""
+
+import functools
+import re
+import threading
+import time
+from collections import Counter
+
+import sqlalchemy as sa
+from flask import abort, g, has_request_context, jsonify, request
+from flask_login import current_user, login_required
+from sqlalchemy.engine import Engine
+
+from CBPlumbing import app
+from CBPlumbing.models import fragment_cache, user_cache
+
+
+_lock = threading.Lock()
+_endpoints = {}
+
+
+class EndpointStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.sql_time = 0.0
+        self.n_plus_one = Counter()
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'queries': self.queries,
+            'avg_queries': round(self.queries / self.requests, 1) if self.requests else 0,
+            'max_queries': self.max_queries,
+            'sql_ms': round(self.sql_time * 1000, 1),
+            'avg_sql_ms': round(self.sql_time * 1000 / self.requests, 2) if self.requests else 0,
+            'n_plus_one': [{'statement': statement, 'requests': count}
+                           for statement, count in self.n_plus_one.most_common(10)],
+        }
+
+
+@functools.lru_cache(maxsize=1024)
+def _shape(statement):
+    return re.sub(r'\s+', ' ', statement).strip()
+
+
+@sa.event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # The start goes on the statement's own execution context, so a statement
+    # that fails (a lock error retried by retry_on_lock, say) leaves nothing
+    # behind on the pooled connection
+    if context is not None and app.config['SQL_INSTRUMENTATION'] and has_request_context():
+        context._sql_started = time.perf_counter()
+
+
+@sa.event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_sql_started', None)
+    if started is None or not has_request_context():
+        return
+    elapsed = time.perf_counter() - started
+    if 'sql_shapes' not in g:
+        g.sql_shapes = Counter()
+        g.sql_time = 0.0
+    g.sql_shapes[_shape(statement)] += 1
+    g.sql_time += elapsed
+
+
+@app.after_request
+def record_sql_stats(response):
+    if not app.config['SQL_INSTRUMENTATION']:
+        return response
+    shapes = g.get('sql_shapes', Counter())
+    sql_time = g.get('sql_time', 0.0)
+    queries = sum(shapes.values())
+    threshold = app.config['SQL_N_PLUS_ONE_THRESHOLD']
+    repeated = [statement for statement, count in shapes.items() if count >= threshold]
+    for statement in repeated:
+        app.logger.warning('Probable N+1 on %s: %d x %s', request.endpoint, shapes[statement], statement)
+
+    response.headers['Server-Timing'] = 'db;dur={:.1f};desc="{} queries"'.format(sql_time * 1000, queries)
+    response.headers['X-Query-Count'] = str(queries)
+
+    with _lock:
+        stats = _endpoints.setdefault(request.endpoint, EndpointStats())
+        stats.requests += 1
+        stats.queries += queries
+        stats.max_queries = max(stats.max_queries, queries)
+        stats.sql_time += sql_time
+        stats.n_plus_one.update(repeated)
+    return response
+
+
+def admin_required(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not getattr(current_user, 'is_admin', False):
+            abort(403)
+        return view(*args, **kwargs)
+    return login_required(wrapper)
+
+
+@app.route('/admin/sql_report', methods=['GET', 'POST'])
+@admin_required
+def sql_report():
+    # A POST returns the report and then starts the counts again
+    with _lock:
+        report = {endpoint: stats.as_dict() for endpoint, stats in _endpoints.items()}
+        if request.method == 'POST':
+            _endpoints.clear()
+    return jsonify(report)
+
+
+@app.route('/admin/cache_report', methods=['GET'])
+@admin_required
+def cache_report():
+    return jsonify({
+        'user_cache': {'hits': user_cache.hits, 'misses': user_cache.misses},
+        'fragment_cache': fragment_cache.stats(),
+    })
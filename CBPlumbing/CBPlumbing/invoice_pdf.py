@@ -0,0 +1,323 @@
+"""
+Printable PDF invoices.
+
+An invoice is loaded into a plain dict (invoice, customer address and lines)
+and drawn as a PDF by a small writer using the standard Helvetica fonts, so
+no PDF library is needed. Files are cached on disk under a hash of that dict,
+so an invoice is only drawn again when something printed on it changes. Each
+invoice has its own folder, and drawing a new file deletes the ones it
+replaces once they are a minute old. Batches load their invoices with a few set-based queries and fan
+the uncached ones out over a process pool; the workers never touch the
+database.
+
+Caches written before per-invoice folders are in two-character folders
+directly under INVOICE_PDF_DIR, which are no longer read and can be deleted.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from CBPlumbing import app, db, tasks
+from CBPlumbing.models import Customer, Job, Invoice, InvoiceLine
+
+
+# Bump when the layout changes so every cached file is drawn again
+LAYOUT_VERSION = 1
+# Invoices loaded per query in a batch
+LOAD_CHUNK = 500
+# Below this many uncached invoices a pool costs more than it saves. Each
+# spawned worker imports the app before it draws anything.
+POOL_THRESHOLD = 2000
+# Replaced files are only deleted once they are this many seconds old, so a
+# slower writer drawing an older copy of an invoice does not delete a newer
+# file that a request is about to send
+REPLACED_MAX_AGE = 60
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 50
+ROW_HEIGHT = 16
+COLUMNS = [
+    # (heading, x, right aligned, characters that fit)
+    ('Item', MARGIN, False, 24),
+    ('Description', MARGIN + 150, False, 38),
+    ('Qty', 390, True, 6),
+    ('Unit Cost', 465, True, 12),
+    ('Total', PAGE_WIDTH - MARGIN, True, 12),
+]
+
+# Helvetica advance widths (per 1000 units) for right aligning figures;
+# other characters are taken as a digit's width
+_WIDTHS = dict.fromkeys('0123456789\xa3', 556)
+_WIDTHS.update({'.': 278, ',': 278, ' ': 278, '-': 333})
+
+
+# Loading
+
+def _date(value):
+    return value.strftime('%d-%m-%Y') if value is not None else ''
+
+
+def load(invoice_ids):
+    """Returns {invoice id: printable dict} for the invoices that exist."""
+    documents = {}
+    for start in range(0, len(invoice_ids), LOAD_CHUNK):
+        chunk = invoice_ids[start:start + LOAD_CHUNK]
+        rows = db.session.execute(
+            sa.select(Invoice.id, Invoice.job_id, Invoice.invoice_date, Invoice.due_date, Invoice.status,
+                      Invoice.total_amount, Job.job_type, Customer.first_name, Customer.last_name,
+                      Customer.first_line_address, Customer.second_line_address, Customer.city,
+                      Customer.county, Customer.postal_code)
+            .outerjoin(Job, Job.id == Invoice.job_id)
+            .outerjoin(Customer, Customer.id == Job.customer_id)
+            .where(Invoice.id.in_(chunk)))
+        for row in rows:
+            name = ' '.join(part for part in (row.first_name, row.last_name) if part)
+            address = [part for part in (row.first_line_address, row.second_line_address, row.city,
+                                         row.county, row.postal_code) if part]
+            documents[row.id] = {
+                'id': row.id, 'job_id': row.job_id, 'job_type': row.job_type or '',
+                'invoice_date': _date(row.invoice_date), 'due_date': _date(row.due_date),
+                'status': row.status or '', 'total': round(row.total_amount or 0.0, 2),
+                'customer': [name] + address, 'lines': [],
+            }
+        lines = db.session.execute(
+            sa.select(InvoiceLine.invoice_id, InvoiceLine.item_name, InvoiceLine.item_description,
+                      InvoiceLine.item_quantity, InvoiceLine.item_cost, InvoiceLine.line_total)
+            .where(InvoiceLine.invoice_id.in_(chunk))
+            .order_by(InvoiceLine.invoice_id, InvoiceLine.id))
+        for line in lines:
+            documents[line.invoice_id]['lines'].append([
+                line.item_name or '', line.item_description or '', line.item_quantity or 0,
+                round(line.item_cost or 0.0, 2), round(line.line_total or 0.0, 2)])
+    return documents
+
+
+def content_hash(document):
+    return hashlib.sha256(json.dumps([LAYOUT_VERSION, document], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def cache_path(directory, invoice_id, digest):
+    # Invoices are grouped a thousand to a folder, then a folder each
+    return os.path.join(directory, '{:04d}'.format(invoice_id // 1000), str(invoice_id), digest + '.pdf')
+
+
+# Drawing
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _fit(text, characters):
+    text = ' '.join(str(text).split())
+    return text if len(text) <= characters else text[:characters - 3] + '...'
+
+
+def _width(text, size):
+    return sum(_WIDTHS.get(character, 556) for character in text) * size / 1000.0
+
+
+def _money(value):
+    return '\xa3{:,.2f}'.format(value)
+
+
+class _Page(object):
+    def __init__(self):
+        self.operations = []
+
+    def text(self, x, y, text, size=10, bold=False, right=False):
+        if right:
+            x -= _width(text, size)
+        self.operations.append('BT /{} {} Tf {:.2f} {} Td ({}) Tj ET'.format(
+            'F2' if bold else 'F1', size, x, y, _escape(text)))
+
+    def line(self, x1, y1, x2, y2):
+        self.operations.append('{} {} m {} {} l S'.format(x1, y1, x2, y2))
+
+    def stream(self):
+        return '\n'.join(self.operations).encode('cp1252', 'replace')
+
+
+def _header(page, document, number):
+    top = PAGE_HEIGHT - MARGIN
+    page.text(MARGIN, top - 20, 'INVOICE', size=22, bold=True)
+    page.text(PAGE_WIDTH - MARGIN, top - 20, 'C B Plumbing', size=14, bold=True, right=True)
+    details = [('Invoice No', str(document['id'])), ('Invoice Date', document['invoice_date']),
+               ('Due Date', document['due_date']), ('Job', '{} {}'.format(document['job_id'] or '', document['job_type'])),
+               ('Status', document['status'])]
+    y = top - 50
+    for label, value in details:
+        page.text(PAGE_WIDTH - 220, y, label, bold=True)
+        page.text(PAGE_WIDTH - 140, y, _fit(value, 18))
+        y -= 14
+    if number == 1:
+        page.text(MARGIN, top - 50, 'Bill To', bold=True)
+        for offset, part in enumerate(document['customer'][:6]):
+            page.text(MARGIN, top - 64 - offset * 14, _fit(part, 40))
+    y = top - 160
+    for heading, x, right, _ in COLUMNS:
+        page.text(x, y, heading, bold=True, right=right)
+    page.line(MARGIN, y - 5, PAGE_WIDTH - MARGIN, y - 5)
+    return y - ROW_HEIGHT - 4
+
+
+def render(document):
+    """The invoice as PDF bytes, over as many pages as its lines need."""
+    pages = [_Page()]
+    y = _header(pages[0], document, 1)
+    for name, description, quantity, cost, total in document['lines']:
+        if y < MARGIN + 60:
+            pages.append(_Page())
+            y = _header(pages[-1], document, len(pages))
+        cells = [name, description, str(quantity), _money(cost), _money(total)]
+        for value, (_, x, right, characters) in zip(cells, COLUMNS):
+            pages[-1].text(x, y, _fit(value, characters), right=right)
+        y -= ROW_HEIGHT
+    pages[-1].line(MARGIN, y + 10, PAGE_WIDTH - MARGIN, y + 10)
+    pages[-1].text(465, y - 6, 'Total Due', size=12, bold=True, right=True)
+    pages[-1].text(PAGE_WIDTH - MARGIN, y - 6, _money(document['total']), size=12, bold=True, right=True)
+    for number, page in enumerate(pages, 1):
+        page.text(PAGE_WIDTH - MARGIN, MARGIN - 20, 'Page {} of {}'.format(number, len(pages)), size=8, right=True)
+
+    # Objects 1-4 are the catalog, page tree and fonts; each page then takes
+    # two objects, the page and its compressed content stream.
+    page_ids = [5 + 2 * index for index in range(len(pages))]
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        '<< /Type /Pages /Kids [{}] /Count {} >>'.format(
+            ' '.join('{} 0 R'.format(page_id) for page_id in page_ids), len(pages)).encode('ascii'),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+    ]
+    for page, page_id in zip(pages, page_ids):
+        content = zlib.compress(page.stream())
+        objects.append('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {} {}] '
+                       '/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {} 0 R >>'.format(
+                           PAGE_WIDTH, PAGE_HEIGHT, page_id + 1).encode('ascii'))
+        objects.append('<< /Length {} /Filter /FlateDecode >>\nstream\n'.format(len(content)).encode('ascii')
+                       + content + b'\nendstream')
+
+    output = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += '{} 0 obj\n'.format(number).encode('ascii') + body + b'\nendobj\n'
+    xref = len(output)
+    output += 'xref\n0 {}\n0000000000 65535 f \n'.format(len(objects) + 1).encode('ascii')
+    output += b''.join('{:010d} 00000 n \n'.format(offset).encode('ascii') for offset in offsets)
+    output += 'trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n'.format(
+        len(objects) + 1, xref).encode('ascii')
+    return bytes(output)
+
+
+def _write(job):
+    # Runs in the pool. Written to a temporary name and renamed so a reader
+    # never sees half a file, then the invoice's older files are deleted.
+    # Whichever writer finishes last may hold the older copy, so files
+    # written recently are left for a later write to clear.
+    document, path = job
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    with os.fdopen(handle, 'wb') as output:
+        output.write(render(document))
+    os.replace(temporary, path)
+    cutoff = time.time() - REPLACED_MAX_AGE
+    for entry in os.scandir(folder):
+        if entry.name.endswith('.pdf') and entry.path != path:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                # Deleted by another writer, or open for sending on Windows
+                pass
+    return path
+
+
+# Entry points
+
+def pdf_path(invoice_id):
+    """Path of the invoice's PDF, drawing it first unless it is cached. None if there is no such invoice."""
+    document = load([invoice_id]).get(invoice_id)
+    if document is None:
+        return None
+    path = cache_path(app.config['INVOICE_PDF_DIR'], invoice_id, content_hash(document))
+    if not os.path.exists(path):
+        _write((document, path))
+    return path
+
+
+def open_pdf(invoice_id):
+    """
+    The invoice's PDF opened for reading, drawn first unless it is cached.
+    None if there is no such invoice. A file deleted between the check and
+    the open is drawn again.
+    """
+    for attempt in range(2):
+        path = pdf_path(invoice_id)
+        if path is None:
+            return None
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            if attempt:
+                raise
+
+
+def render_batch(invoice_ids, processes=None):
+    """
+    Makes sure every invoice in invoice_ids has a current PDF, drawing the
+    uncached ones over a pool of processes (INVOICE_PDF_PROCESSES, or one
+    per CPU). Returns
+    {invoice id: path} and counts of rendered and cached invoices.
+    """
+    start = time.perf_counter()
+    directory = app.config['INVOICE_PDF_DIR']
+    paths, missing = {}, []
+    documents = load(list(invoice_ids))
+    for invoice_id, document in documents.items():
+        path = cache_path(directory, invoice_id, content_hash(document))
+        paths[invoice_id] = path
+        if not os.path.exists(path):
+            missing.append((document, path))
+
+    processes = processes or app.config['INVOICE_PDF_PROCESSES'] or os.cpu_count() or 1
+    if len(missing) < POOL_THRESHOLD or processes == 1:
+        for job in missing:
+            _write(job)
+    else:
+        # spawn rather than fork: this can run on a task worker thread, and a
+        # forked child could inherit locks other threads were holding. spawn
+        # is also the only start method on Windows. The workers import this
+        # module to find _write, which needs no app state.
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+            for _ in pool.map(_write, missing, chunksize=max(1, len(missing) // (processes * 4))):
+                pass
+    return paths, {'rendered': len(missing), 'cached': len(paths) - len(missing),
+                   'missing': len(set(invoice_ids)) - len(paths), 'seconds': round(time.perf_counter() - start, 2)}
+
+
+def invoice_ids(status=None, since=None):
+    """Ids of the invoices for a batch run, filtered by status and invoice date."""
+    query = sa.select(Invoice.id).order_by(Invoice.id)
+    if status:
+        query = query.where(Invoice.status == status)
+    if since:
+        query = query.where(Invoice.invoice_date >= since)
+    return list(db.session.scalars(query))
+
+
+@tasks.task(max_attempts=2)
+def render_invoice_pdfs(status=None, since=None):
+    """Month-end run from the task queue; since is an ISO date."""
+    since = datetime.fromisoformat(since) if since else None
+    _, counts = render_batch(invoice_ids(status, since))
+    return counts
@@ -2,8 +2,11 @@ from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.ext.hybrid import hybrid_property
 from datetime import datetime
+import sqlalchemy as sa
 
-from CBPlumbing import db, login
+from CBPlumbing import app, db, login
+from CBPlumbing.caching import FragmentCache
+from CBPlumbing.user_cache import UserCache
 
 
 class User(UserMixin, db.Model):
@@ -11,6 +14,7 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(64), index=True, unique=True)
     email = db.Column(db.String(120), index=True, unique=True)
     password_hash = db.Column(db.String(256))
+    is_admin = db.Column(db.Boolean, default=False, server_default=sa.false())
 
     def __repr__(self):
         return '<User {}>'.format(self.username)
@@ -24,41 +28,82 @@ class User(UserMixin, db.Model):
 
 class Customer(db.Model): 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    first_name = db.Column(db.String(64), index=True)
-    last_name = db.Column(db.String(64), index=True)
-    phone = db.Column(db.String(64), index=True)
-    email = db.Column(db.String(120), index=True)
-    first_line_address = db.Column(db.String(120), index=True)
-    second_line_address = db.Column(db.String(120), index=True)
-    city = db.Column(db.String(120), index=True)
-    county = db.Column(db.String(120), index=True)
-    postal_code = db.Column(db.String(120), index=True)
-    referal = db.Column(db.String(120), index=True)
+    first_name = db.Column(db.String(64))
+    last_name = db.Column(db.String(64))
+    phone = db.Column(db.String(64))
+    email = db.Column(db.String(120))
+    first_line_address = db.Column(db.String(120))
+    second_line_address = db.Column(db.String(120))
+    city = db.Column(db.String(120))
+    county = db.Column(db.String(120))
+    postal_code = db.Column(db.String(120))
+    referal = db.Column(db.String(120))
     customer_active = db.Column(db.Boolean, default=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     jobs = db.relationship('Job', backref='customer', lazy='dynamic')
+
+
+# Case-insensitive indexes so the customer lookup's prefix LIKE can seek
+# rather than scan the table.
+db.Index('ix_customer_first_name_nocase', Customer.first_name.collate('NOCASE'))
+db.Index('ix_customer_last_name_nocase', Customer.last_name.collate('NOCASE'))
+db.Index('ix_customer_phone_nocase', Customer.phone.collate('NOCASE'))
+db.Index('ix_customer_postal_code_nocase', Customer.postal_code.collate('NOCASE'))
+
+# The customer list only ever shows active customers, so its sort indexes
+# leave out the inactive rows.
+db.Index('ix_customer_active_first_name', Customer.first_name, sqlite_where=Customer.customer_active == True)
+db.Index('ix_customer_active_last_name', Customer.last_name, sqlite_where=Customer.customer_active == True)
+db.Index('ix_customer_active_postal_code', Customer.postal_code, sqlite_where=Customer.customer_active == True)
     
 
 class Job(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'))
-    job_type = db.Column(db.String(120), index=True)
-    job_status = db.Column(db.String(120), index=True, default="Open")
-    job_notes = db.Column(db.Text(240), index=True)
-    invoice_status = db.Column(db.String(120), index=True, default="None")
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), index=True)
+    job_type = db.Column(db.String(120))
+    job_status = db.Column(db.String(120), default="Open")
+    job_notes = db.Column(db.Text(240))
+    invoice_status = db.Column(db.String(120), default="None")
     items = db.relationship('JobItems', backref='job', lazy='dynamic')
     job_created_date = db.Column(db.DateTime, default=datetime.utcnow)
-    job_planned_date = db.Column(db.DateTime, nullable=True)
+    job_planned_date = db.Column(db.DateTime, nullable=True, index=True)
     job_completed_date = db.Column(db.DateTime, nullable=True)
     invoices = db.relationship('Invoice', backref='job', lazy=True)
+    total_cost = db.Column(db.Float, default=0.0, server_default='0')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # Bumped on every ORM update, which only succeeds if the row still has the
+    # version it was loaded with; bulk UPDATEs bump it themselves
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
+
+    def update_total_cost(self):
+        # Keep the stored total in step with the item rows so list and detail
+        # pages can read it without aggregating JobItems on every request.
+        self.total_cost = db.session.scalar(
+            sa.select(sa.func.coalesce(sa.func.sum(JobItems.item_total), 0.0))
+            .where(JobItems.job_id == self.id))
+
+    def latest_invoice(self):
+        return Invoice.query.filter_by(job_id=self.id).order_by(Invoice.invoice_date.desc()).first()
+
+# Composite indexes for the job list filters: status with planned date covers
+# "open jobs by planned date", and each leading column serves its filter alone.
+db.Index('ix_job_status_planned_date', Job.job_status, Job.job_planned_date)
+db.Index('ix_job_type_status', Job.job_type, Job.job_status)
+db.Index('ix_job_invoice_status_status', Job.invoice_status, Job.job_status)
+
 
 class JobItems(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    job_id = db.Column(db.Integer, db.ForeignKey('job.id'))
-    item_name = db.Column(db.String(120), index=True)
-    item_description = db.Column(db.String(240), index=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('job.id'), index=True)
+    item_name = db.Column(db.String(120))
+    item_description = db.Column(db.String(240))
     item_quantity = db.Column(db.Integer)
     item_cost = db.Column(db.Float)
     item_total = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
 
     @hybrid_property
     def item_total(self):
@@ -68,17 +113,120 @@ class JobItems(db.Model):
 class Invoice(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     job_id = db.Column(db.Integer, db.ForeignKey('job.id'))
-    invoice_date = db.Column(db.DateTime, default=datetime.utcnow)
-    due_date = db.Column(db.DateTime)
+    invoice_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    due_date = db.Column(db.DateTime, index=True)
     status = db.Column(db.String(120), index=True, default="Active")
-    total_amount = db.Column(db.Float)
+    total_amount = db.Column(db.Float, index=True, default=0.0, server_default='0')
+    lines = db.relationship('InvoiceLine', backref='invoice', lazy=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
+
+    def copy_job_items(self, job):
+        # Snapshot the job's items at issue time so later item edits do not
+        # change an invoice that has already gone out.
+        self.lines = [
+            InvoiceLine(
+                item_name=item.item_name,
+                item_description=item.item_description,
+                item_quantity=item.item_quantity,
+                item_cost=item.item_cost,
+                line_total=item.item_total
+            ) for item in job.items
+        ]
+        self.total_amount = sum(line.line_total for line in self.lines)
+
+
+# Latest invoice for a job, as looked up by edit_job and view_job
+db.Index('ix_invoice_job_id_invoice_date', Invoice.job_id, Invoice.invoice_date)
+# Issued invoices by due date, for the overdue sweep
+db.Index('ix_invoice_status_due_date', Invoice.status, Invoice.due_date)
+
+
+class InvoiceLine(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), index=True)
+    item_name = db.Column(db.String(120))
+    item_description = db.Column(db.String(240))
+    item_quantity = db.Column(db.Integer)
+    item_cost = db.Column(db.Float)
+    line_total = db.Column(db.Float)
+
+
+class Task(db.Model):
+    # A unit of background work for the worker pool; see CBPlumbing/tasks.py
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name = db.Column(db.String(120))
+    payload = db.Column(db.Text)
+    status = db.Column(db.String(20), default='Queued')
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=3)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True, index=True)
+    worker = db.Column(db.String(120), nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+
+    def __repr__(self):
+        return '<Task {} {}>'.format(self.id, self.name)
+
+# Workers claim the oldest due task with a seek on this index
+db.Index('ix_task_status_run_at', Task.status, Task.run_at)
+
+
+class JobRollup(db.Model):
+    # Job counts and values per month created, kept up to date by
+    # CBPlumbing/reports.py. Missing types and statuses are stored as ''.
+    period = db.Column(db.String(7), primary_key=True)
+    job_type = db.Column(db.String(120), primary_key=True)
+    job_status = db.Column(db.String(120), primary_key=True)
+    job_count = db.Column(db.Integer, default=0, nullable=False)
+    total_value = db.Column(db.Float, default=0.0, nullable=False)
+
+
+class InvoiceRollup(db.Model):
+    # Invoice counts and amounts per month invoiced, by the job's type; see
+    # CBPlumbing/reports.py
+    period = db.Column(db.String(7), primary_key=True)
+    job_type = db.Column(db.String(120), primary_key=True)
+    status = db.Column(db.String(120), primary_key=True)
+    invoice_count = db.Column(db.Integer, default=0, nullable=False)
+    total_amount = db.Column(db.Float, default=0.0, nullable=False)
+
+
+class InvoiceDueRollup(db.Model):
+    # Invoice counts and amounts per day due, for the aging report; see
+    # CBPlumbing/reports.py
+    due_date = db.Column(db.String(10), primary_key=True)
+    status = db.Column(db.String(120), primary_key=True)
+    invoice_count = db.Column(db.Integer, default=0, nullable=False)
+    total_amount = db.Column(db.Float, default=0.0, nullable=False)
+
+
+class ChangeLog(db.Model):
+    # The latest change to each synced record, kept up to date by triggers;
+    # see CBPlumbing/sync.py. AUTOINCREMENT so a seq is never handed out twice.
+    __table_args__ = {'sqlite_autoincrement': True}
+    seq = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    ref_id = db.Column(db.Integer, nullable=False)
+    deleted = db.Column(db.Boolean, default=False, nullable=False)
+
+db.Index('ix_change_log_kind_ref_id', ChangeLog.kind, ChangeLog.ref_id, unique=True)
+# The newest seq of a kind, which versions the list pages
+db.Index('ix_change_log_kind_seq', ChangeLog.kind, ChangeLog.seq)
+
+
+user_cache = UserCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'],
+                       app.config['USER_CACHE_VERSION_FILE'])
+user_cache.track(db.session, User)
+
+# Keyed by the rows' versions in the database; conditional.py supplies them
+fragment_cache = FragmentCache(app.config['FRAGMENT_CACHE_MAX_BYTES'])
 
-    @hybrid_property
-    def total_amount(self):
-        return sum(item.item_total for item in self.job.items)
-    
 
-    
 @login.user_loader
 def load_user(id):
-    return db.session.get(User, int(id))
\ No newline at end of file
+    return user_cache.get(int(id), lambda: db.session.get(User, int(id)))
\ No newline at end of file
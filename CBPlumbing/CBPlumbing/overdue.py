@@ -0,0 +1,56 @@
+"""
+Marking invoices overdue.
+
+mark_overdue() moves every Issued invoice due before today to Overdue, and
+its job's invoice status with it, in one UPDATE per table rather than a load
+and save per invoice. The invoices are found through
+ix_invoice_status_due_date, so a sweep that finds nothing new costs a single
+index seek however many invoices there are. The task workers run it every
+OVERDUE_SWEEP_INTERVAL seconds and `flask mark-overdue` runs it by hand.
+The aging report is in reports.py.
+"""
+
+import json
+
+import sqlalchemy as sa
+
+from CBPlumbing import app, db, reports, tasks
+from CBPlumbing.models import Job, Invoice
+
+
+def mark_overdue(today=None):
+    """
+    Marks Issued invoices due before today (UTC by default) Overdue, with
+    their jobs, and keeps the report rollups in step. Returns the number of
+    invoices marked. The caller commits.
+    """
+    cutoff = reports.start_of(today)
+    connection = db.session.connection()
+    # The rollup statement gets the cutoff as the string SQLite stores dates
+    # in, so it matches exactly the invoices the UPDATE does
+    reports.subtract(connection, 'invoice', "invoice.status = 'Issued' AND invoice.due_date < :cutoff",
+                     cutoff=cutoff.strftime('%Y-%m-%d %H:%M:%S.%f'))
+    marked = db.session.execute(
+        sa.update(Invoice).where(Invoice.status == 'Issued', Invoice.due_date < cutoff)
+        .values(status='Overdue', version_id=Invoice.version_id + 1).returning(Invoice.id, Invoice.job_id)
+        .execution_options(synchronize_session=False)).all()
+    if not marked:
+        return 0
+    reports.add(connection, 'invoice', "invoice.id IN (SELECT value FROM json_each(:invoice_ids))",
+                invoice_ids=json.dumps([invoice_id for invoice_id, job_id in marked]))
+    # job.invoice_status mirrors the job's invoice, as edit_invoice keeps it.
+    # Both UPDATEs bump version_id so an edit form opened before the sweep
+    # cannot save over it. The job ids go in as a JSON array too, so SQLite seeks on the primary
+    # key rather than scanning every job with an Issued invoice.
+    job_ids = sa.func.json_each(json.dumps([job_id for invoice_id, job_id in marked if job_id is not None]))
+    db.session.execute(
+        sa.update(Job).where(Job.id.in_(sa.select(job_ids.table_valued('value').c.value)))
+        .values(invoice_status='Overdue', version_id=Job.version_id + 1).execution_options(synchronize_session=False))
+    return len(marked)
+
+
+@tasks.task(every=app.config['OVERDUE_SWEEP_INTERVAL'])
+def mark_overdue_invoices():
+    count = mark_overdue()
+    db.session.commit()
+    return count
@@ -0,0 +1,269 @@
+"""
+Keyset (cursor) pagination for the list views.
+
+Pages are fetched with a WHERE condition on the last seen (sort value, id) pair
+instead of OFFSET, so every page costs the same to load however deep it is,
+as long as the sort column is indexed.
+
+Pages longer than LIST_MAX_PAGE_SIZE rows are streamed: the rows are read in
+batches of LIST_STREAM_BATCH while the template renders, and render_page
+sends the HTML as it is produced, so the first byte goes out after one batch
+and memory does not grow with the page.
+"""
+
+import base64
+import itertools
+import json
+import sys
+from datetime import datetime
+
+import sqlalchemy as sa
+from flask import abort, current_app, render_template, request, stream_template, stream_with_context
+
+from CBPlumbing.errors import internal_error
+
+# Characters of HTML gathered before a streamed page writes to the socket
+STREAM_BUFFER = 16 * 1024
+
+
+class KeysetPage(object):
+    streamed = False
+
+    def __init__(self, items, sort, direction, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.sort = sort
+        self.direction = direction
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def url_args(self, **cursor):
+        """Current query string (filters, sort) with the cursor swapped out."""
+        args = request.args.to_dict()
+        args.pop('after', None)
+        args.pop('before', None)
+        args.update(cursor)
+        return args
+
+    @property
+    def next_args(self):
+        return self.url_args(after=self.next_cursor)
+
+    @property
+    def prev_args(self):
+        return self.url_args(before=self.prev_cursor)
+
+
+class StreamedPage(KeysetPage):
+    """
+    A page whose rows are fetched a batch at a time as they are iterated.
+    The cursors for the page links are only known once the rows have been
+    iterated, so templates must show the links after the rows.
+    """
+    streamed = True
+
+    def __init__(self, sort, direction, per_page):
+        super(StreamedPage, self).__init__(None, sort, direction, per_page)
+        self.batches = iter(())
+
+    def __iter__(self):
+        for batch in self.batches:
+            for row in batch:
+                yield row
+
+
+def encode_cursor(value, row_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, column):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        value, row_id = json.loads(raw)
+        if value is not None and isinstance(column.type, sa.DateTime):
+            value = datetime.fromisoformat(value)
+        return value, int(row_id)
+    except (ValueError, TypeError):
+        abort(400)
+
+
+def _segment(query, column, id_column, is_null, descending, cursor):
+    # SQLite sorts NULLs first ascending and last descending. Keeping the NULL
+    # and non-NULL rows in separate queries lets each one seek on the index
+    # rather than fall back to an OR scan.
+    if is_null:
+        query = query.filter(column.is_(None))
+        ordering = [id_column.desc() if descending else id_column.asc()]
+        if cursor is not None:
+            row_id = cursor[1]
+            query = query.filter(id_column < row_id if descending else id_column > row_id)
+    else:
+        ordering = [column.desc(), id_column.desc()] if descending else [column.asc(), id_column.asc()]
+        if cursor is None:
+            query = query.filter(column.isnot(None))
+        elif descending:
+            query = query.filter(sa.tuple_(column, id_column) < cursor)
+        else:
+            query = query.filter(sa.tuple_(column, id_column) > cursor)
+    return query.order_by(*ordering)
+
+
+def _fetch(query, column, id_column, descending, cursor, limit):
+    """Up to ``limit`` rows following ``cursor`` in (column, id) order."""
+    segments = [False, True] if descending else [True, False]
+    if cursor is not None:
+        segments = segments[segments.index(cursor[0] is None):]
+    rows = []
+    for is_null in segments:
+        segment = _segment(query, column, id_column, is_null, descending, cursor)
+        rows += segment.limit(limit - len(rows)).all()
+        if len(rows) >= limit:
+            break
+        cursor = None
+    return rows
+
+
+def _rewind(query, column, id_column, descending, cursor, count, batch_size):
+    """
+    The (sort value, id) of the row count rows before cursor, walking back
+    over the keys alone, or None when there are no more than count of them.
+    """
+    keys = query.with_entities(column, id_column)
+    seen = 0
+    while seen <= count:
+        rows = _fetch(keys, column, id_column, not descending, cursor, min(batch_size, count + 1 - seen))
+        if not rows:
+            return None
+        seen += len(rows)
+        cursor = tuple(rows[-1])
+    return cursor
+
+
+def _batches(page, query, column, id_column, descending, cursor, has_prev, batch_size):
+    # Yields the page's rows in lists of at most batch_size and sets the
+    # page's cursors once the last one has been read.
+    def key(row):
+        return getattr(row, column.key), getattr(row, id_column.key)
+
+    first = last = None
+    remaining = page.per_page
+    has_more = False
+    while remaining > 0:
+        # The batch that finishes the page reads one row past it, which
+        # tells whether there is a next page
+        limit = batch_size if remaining > batch_size else remaining + 1
+        rows = _fetch(query, column, id_column, descending, cursor, limit)
+        shown = rows[:remaining]
+        if shown:
+            first = shown[0] if first is None else first
+            last = shown[-1]
+            yield shown
+        remaining -= len(shown)
+        if len(rows) < limit:
+            break
+        has_more = len(rows) > len(shown)
+        cursor = key(rows[-1])
+    if last is not None:
+        if has_more:
+            page.next_cursor = encode_cursor(*key(last))
+        if has_prev:
+            page.prev_cursor = encode_cursor(*key(first))
+
+
+def _stream(page, query, column, id_column, descending, after, before):
+    batch_size = current_app.config['LIST_STREAM_BATCH']
+    if before is not None and after is None:
+        # Find where the page starts, then read it forwards like any other.
+        # Near the start of the list that is the first row, and the page
+        # runs on past the cursor to fill it.
+        cursor = _rewind(query, column, id_column, descending, decode_cursor(before, column), page.per_page,
+                         batch_size)
+        has_prev = cursor is not None
+    else:
+        cursor = decode_cursor(after, column) if after is not None else None
+        has_prev = after is not None
+    batches = _batches(page, query, column, id_column, descending, cursor, has_prev, batch_size)
+    # Read the first batch now, so a failing query is a plain error response
+    # rather than one that breaks off part way through the page
+    page.batches = itertools.chain([next(batches, [])], batches)
+    return page
+
+
+def paginate(query, id_column, sort_columns, default_sort='id'):
+    """
+    Applies the sort, direction, page size and cursor from the request
+    arguments to ``query`` and returns a KeysetPage, or a StreamedPage when
+    more than LIST_MAX_PAGE_SIZE rows are asked for.
+
+    ``sort_columns`` maps the allowed ``sort`` argument values to columns;
+    only indexed columns should be offered.
+    """
+    sort = request.args.get('sort', default_sort)
+    if sort not in sort_columns:
+        sort = default_sort
+    column = sort_columns[sort]
+    direction = 'desc' if request.args.get('direction') == 'desc' else 'asc'
+    descending = direction == 'desc'
+    per_page = request.args.get('per_page', current_app.config['LIST_PAGE_SIZE'], type=int)
+    per_page = max(1, min(per_page, current_app.config['LIST_STREAM_MAX_PAGE_SIZE']))
+
+    after = request.args.get('after')
+    before = request.args.get('before')
+    if per_page > current_app.config['LIST_MAX_PAGE_SIZE']:
+        return _stream(StreamedPage(sort, direction, per_page), query, column, id_column, descending, after, before)
+    backwards = before is not None and after is None
+
+    # Walking backwards is walking forwards through the reversed order.
+    cursor = before if backwards else after
+    if cursor is not None:
+        cursor = decode_cursor(cursor, column)
+    rows = _fetch(query, column, id_column, descending != backwards, cursor, per_page + 1)
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def key(row):
+        return encode_cursor(getattr(row, column.key), getattr(row, id_column.key))
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = key(rows[-1])
+        if (has_more and backwards) or (after is not None):
+            prev_cursor = key(rows[0])
+    return KeysetPage(rows, sort, direction, per_page, next_cursor, prev_cursor)
+
+
+def _buffered(chunks):
+    pending, size = [], 0
+    try:
+        for chunk in chunks:
+            pending.append(chunk)
+            size += len(chunk)
+            if size >= STREAM_BUFFER:
+                yield ''.join(pending)
+                pending, size = [], 0
+    except Exception as error:
+        # The status line has already gone out, so the error page can only be
+        # added to what has been sent
+        current_app.log_exception(sys.exc_info())
+        pending.append(internal_error(error)[0])
+    yield ''.join(pending)
+
+
+def render_page(template_name, page, **context):
+    """
+    render_template for a list page. A StreamedPage is rendered with
+    stream_template and sent in pieces of about STREAM_BUFFER characters.
+    """
+    if not page.streamed:
+        return render_template(template_name, **context)
+    return current_app.response_class(stream_with_context(_buffered(stream_template(template_name, **context))),
+                                      mimetype='text/html')
@@ -0,0 +1,270 @@
+"""
+Reporting rollups and the reports page.
+
+job_rollup and invoice_rollup hold counts and sums per (month, job type,
+status), so the reports read a few hundred rows however many jobs there are.
+They are kept up to date from the session: before a flush that changes a
+column the rollups use, the rows it is about to change are taken out of the
+rollups with one grouped upsert, and after the flush they are added back
+with their new values. Keys left with nothing are deleted as they empty.
+Statements that bypass the session (imports, seeding, bulk UPDATEs) call
+add() and subtract() with a condition matching the rows they write. The
+upserts are plain SQL, as SQLAlchemy does not cache compiled SQLite upserts
+and compiling them would cost more than running them.
+`flask rebuild-reports` recounts everything from the source tables.
+
+Invoices are also rolled up by day due, so the aging report sums a row per
+day rather than every unpaid invoice.
+"""
+
+import json
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from flask import render_template
+from flask_login import login_required
+
+from CBPlumbing import app, db, tasks
+from CBPlumbing.models import Job, Invoice, JobRollup, InvoiceRollup, InvoiceDueRollup
+from config import QueryConfig
+
+
+# Invoice statuses still waiting to be paid, and those that are not revenue
+OUTSTANDING_STATUSES = ['Issued', 'Overdue']
+NOT_REVENUE_STATUSES = ['None', 'Cancelled']
+# Months shown in the revenue table
+REVENUE_MONTHS = 24
+# Aging bands as (label, most days past due); None is open ended
+AGING_BANDS = [('0-30', 30), ('31-60', 60), ('61-90', 90), ('90+', None)]
+
+
+# Upsert and prune statements for each rollup of a table. The upsert returns
+# each key it wrote with its new count, and the prune deletes one key.
+_ROLLUPS = {
+    'job': [(
+        "INSERT INTO job_rollup (period, job_type, job_status, job_count, total_value) "
+        "SELECT COALESCE(strftime('%Y-%m', job.job_created_date), ''), COALESCE(job.job_type, ''), "
+        "COALESCE(job.job_status, ''), :sign * COUNT(*), :sign * COALESCE(SUM(job.total_cost), 0.0) "
+        "FROM job WHERE {where} GROUP BY 1, 2, 3 "
+        "ON CONFLICT (period, job_type, job_status) DO UPDATE SET "
+        "job_count = job_count + excluded.job_count, total_value = total_value + excluded.total_value "
+        "RETURNING period, job_type, job_status, job_count",
+        "DELETE FROM job_rollup WHERE period = :period AND job_type = :job_type AND job_status = :job_status "
+        "AND job_count <= 0",
+    )],
+    'invoice': [(
+        "INSERT INTO invoice_rollup (period, job_type, status, invoice_count, total_amount) "
+        "SELECT COALESCE(strftime('%Y-%m', invoice.invoice_date), ''), COALESCE(job.job_type, ''), "
+        "COALESCE(invoice.status, ''), :sign * COUNT(*), :sign * COALESCE(SUM(invoice.total_amount), 0.0) "
+        "FROM invoice LEFT OUTER JOIN job ON job.id = invoice.job_id WHERE {where} GROUP BY 1, 2, 3 "
+        "ON CONFLICT (period, job_type, status) DO UPDATE SET "
+        "invoice_count = invoice_count + excluded.invoice_count, "
+        "total_amount = total_amount + excluded.total_amount "
+        "RETURNING period, job_type, status, invoice_count",
+        "DELETE FROM invoice_rollup WHERE period = :period AND job_type = :job_type AND status = :status "
+        "AND invoice_count <= 0",
+    ), (
+        "INSERT INTO invoice_due_rollup (due_date, status, invoice_count, total_amount) "
+        "SELECT COALESCE(date(invoice.due_date), ''), COALESCE(invoice.status, ''), "
+        ":sign * COUNT(*), :sign * COALESCE(SUM(invoice.total_amount), 0.0) "
+        "FROM invoice LEFT OUTER JOIN job ON job.id = invoice.job_id WHERE {where} GROUP BY 1, 2 "
+        "ON CONFLICT (due_date, status) DO UPDATE SET "
+        "invoice_count = invoice_count + excluded.invoice_count, "
+        "total_amount = total_amount + excluded.total_amount "
+        "RETURNING due_date, status, invoice_count",
+        "DELETE FROM invoice_due_rollup WHERE due_date = :due_date AND status = :status AND invoice_count <= 0",
+    )],
+}
+
+# Rows touched by a flush, passed as JSON arrays so the statements keep one
+# shape and SQLite can still seek on the primary key and invoice.job_id
+_FLUSH_WHERE = {
+    'job': "job.id IN (SELECT value FROM json_each(:job_ids))",
+    'invoice': "invoice.id IN (SELECT value FROM json_each(:invoice_ids)) "
+               "OR invoice.job_id IN (SELECT value FROM json_each(:job_ids))",
+}
+
+
+def _apply(connection, table, where, sign, params):
+    for upsert, prune in _ROLLUPS[table]:
+        # The WHERE is always there, as SQLite needs it to tell the upsert's
+        # ON CONFLICT from a join's ON
+        written = connection.execute(sa.text(upsert.format(where=where)), dict(params, sign=sign)).all()
+        # Only the keys this statement took down to nothing are deleted, each
+        # by its primary key, rather than scanning the whole rollup
+        emptied = [row._asdict() for row in written if row[-1] <= 0]
+        if emptied:
+            connection.execute(sa.text(prune), emptied)
+
+
+def add(connection, table, where, **params):
+    """
+    Adds the rows of table ('job' or 'invoice') matching the SQL condition
+    where, with its bound params, to that table's rollups.
+    """
+    _apply(connection, table, where, 1, params)
+
+
+def subtract(connection, table, where, **params):
+    """Takes the rows of table matching where out of its rollups."""
+    _apply(connection, table, where, -1, params)
+
+
+# Columns the rollups are grouped or summed on. A flush that changes none of
+# them leaves the rollups as they are.
+_JOB_COLUMNS = ('job_created_date', 'job_type', 'job_status', 'total_cost')
+_INVOICE_COLUMNS = ('job_id', 'invoice_date', 'due_date', 'status', 'total_amount')
+
+
+def _update(connection, touched, change):
+    job_ids, invoice_job_ids, invoice_ids = touched
+    params = {'job_ids': json.dumps(sorted(job_ids)), 'invoice_ids': json.dumps(sorted(invoice_ids))}
+    if job_ids:
+        change(connection, 'job', _FLUSH_WHERE['job'], **params)
+    if invoice_job_ids or invoice_ids:
+        change(connection, 'invoice', _FLUSH_WHERE['invoice'],
+               **dict(params, job_ids=json.dumps(sorted(invoice_job_ids))))
+
+
+def _changed(obj, columns):
+    return any(sa.inspect(obj).attrs[column].history.has_changes() for column in columns)
+
+
+def _touched(session):
+    """
+    (ids of jobs whose rollup rows change, ids of jobs whose invoices' rows
+    change, ids of invoices whose rows change) among the session's stored
+    rows that are about to be flushed.
+    """
+    job_ids, invoice_job_ids, invoice_ids = set(), set(), set()
+    for obj in session.deleted:
+        if isinstance(obj, Job) and obj.id is not None:
+            job_ids.add(obj.id)
+            invoice_job_ids.add(obj.id)
+        elif isinstance(obj, Invoice) and obj.id is not None:
+            invoice_ids.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Job) and obj.id is not None:
+            if _changed(obj, _JOB_COLUMNS):
+                job_ids.add(obj.id)
+            # An invoice's job type comes from its job
+            if _changed(obj, ('job_type',)):
+                invoice_job_ids.add(obj.id)
+        elif isinstance(obj, Invoice) and obj.id is not None and _changed(obj, _INVOICE_COLUMNS):
+            invoice_ids.add(obj.id)
+    return job_ids, invoice_job_ids, invoice_ids
+
+
+@sa.event.listens_for(db.session, 'before_flush')
+def _take_out(session, flush_context, instances):
+    # New rows have no id yet and are not in the tables, so only rows already
+    # stored are taken out
+    touched = _touched(session)
+    if any(touched):
+        _update(session.connection(), touched, subtract)
+    session.info['rollup_rows'] = touched
+
+
+@sa.event.listens_for(db.session, 'after_flush')
+def _put_back(session, flush_context):
+    # The rows taken out go back with their new values, with the new rows
+    job_ids, invoice_job_ids, invoice_ids = session.info.pop('rollup_rows', (set(), set(), set()))
+    for obj in session.new:
+        if isinstance(obj, Job):
+            job_ids.add(obj.id)
+        elif isinstance(obj, Invoice):
+            invoice_ids.add(obj.id)
+    if job_ids or invoice_job_ids or invoice_ids:
+        _update(session.connection(), (job_ids, invoice_job_ids, invoice_ids), add)
+
+
+def rebuild(connection):
+    """Recounts the rollups from the job and invoice tables."""
+    for rollup in (JobRollup, InvoiceRollup, InvoiceDueRollup):
+        connection.execute(sa.delete(rollup))
+    add(connection, 'job', '1')
+    add(connection, 'invoice', '1')
+
+
+@tasks.task()
+def rebuild_report_rollups():
+    rebuild(db.session.connection())
+
+
+def start_of(day=None):
+    """Midnight at the start of day, today (UTC) by default."""
+    return datetime.combine(day or datetime.utcnow().date(), datetime.min.time())
+
+
+def aging(today=None):
+    """
+    Count and total of the unpaid invoices by days past due, as an
+    OrderedDict from 'Not due' and each AGING_BANDS label to (count, total).
+    Invoices without a due date are left out.
+    """
+    cutoff = start_of(today)
+    due = InvoiceDueRollup.due_date
+    bands = [(due >= cutoff.strftime('%Y-%m-%d'), 'Not due')]
+    bands += [(due >= (cutoff - timedelta(days=days)).strftime('%Y-%m-%d'), label)
+              for label, days in AGING_BANDS if days is not None]
+    band = sa.case(*bands, else_=AGING_BANDS[-1][0]).label('band')
+    rows = db.session.execute(
+        sa.select(band, sa.func.sum(InvoiceDueRollup.invoice_count), sa.func.sum(InvoiceDueRollup.total_amount))
+        .where(InvoiceDueRollup.status.in_(OUTSTANDING_STATUSES), due != '')
+        .group_by(band)).all()
+    totals = OrderedDict((label, (0, 0.0)) for label in ['Not due'] + [label for label, days in AGING_BANDS])
+    totals.update((label, (count, total)) for label, count, total in rows)
+    return totals
+
+
+def _totals(rows):
+    count = sum(row[0] for row in rows)
+    total = sum(row[1] for row in rows)
+    return {'count': count, 'total': total, 'average': total / count if count else 0.0}
+
+
+@app.route('/reports', methods=['GET'])
+@login_required
+def reports():
+    revenue = db.session.execute(
+        sa.select(InvoiceRollup.period,
+                  sa.func.sum(InvoiceRollup.invoice_count).label('invoices'),
+                  sa.func.sum(InvoiceRollup.total_amount).label('invoiced'),
+                  sa.func.sum(sa.case((InvoiceRollup.status == 'Paid', InvoiceRollup.total_amount),
+                                      else_=0.0)).label('paid'))
+        .where(InvoiceRollup.status.notin_(NOT_REVENUE_STATUSES))
+        .group_by(InvoiceRollup.period).order_by(InvoiceRollup.period.desc()).limit(REVENUE_MONTHS)).all()
+
+    job_rows = db.session.execute(
+        sa.select(JobRollup.job_type, JobRollup.job_status, sa.func.sum(JobRollup.job_count),
+                  sa.func.sum(JobRollup.total_value))
+        .group_by(JobRollup.job_type, JobRollup.job_status)).all()
+    statuses = QueryConfig.JOB_STATUS_LIST + sorted({row[1] for row in job_rows} - set(QueryConfig.JOB_STATUS_LIST))
+    job_counts = OrderedDict((job_type, {}) for job_type in
+                             QueryConfig.JOB_TYPE_LIST + sorted({row[0] for row in job_rows}
+                                                                - set(QueryConfig.JOB_TYPE_LIST)))
+    status_totals = {}
+    for job_type, job_status, count, value in job_rows:
+        job_counts[job_type][job_status] = (count, value)
+        status_totals[job_status] = status_totals.get(job_status, 0) + count
+    # Cancelled jobs are left out of the averages
+    job_values = OrderedDict((job_type, _totals([value for job_status, value in by_status.items()
+                                                 if job_status != 'Cancelled']))
+                             for job_type, by_status in job_counts.items())
+    all_jobs = _totals([value for by_status in job_counts.values()
+                        for job_status, value in by_status.items() if job_status != 'Cancelled'])
+
+    outstanding = db.session.execute(
+        sa.select(InvoiceRollup.job_type, InvoiceRollup.status, sa.func.sum(InvoiceRollup.invoice_count),
+                  sa.func.sum(InvoiceRollup.total_amount))
+        .where(InvoiceRollup.status.in_(OUTSTANDING_STATUSES))
+        .group_by(InvoiceRollup.job_type, InvoiceRollup.status)
+        .order_by(InvoiceRollup.status, InvoiceRollup.job_type)).all()
+    outstanding_total = _totals([(row[2], row[3]) for row in outstanding])
+    aged = aging()
+
+    return render_template('reports.html', title='Reports', revenue=revenue, statuses=statuses,
+                           job_counts=job_counts, status_totals=status_totals, job_values=job_values,
+                           all_jobs=all_jobs, outstanding=outstanding, outstanding_total=outstanding_total,
+                           aged=aged)
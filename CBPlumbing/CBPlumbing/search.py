@@ -0,0 +1,153 @@
+"""
+Full-text search over customers, job notes and job items.
+
+Everything searchable lives in one FTS5 table, ``search_index``, kept up to
+date by SQLite triggers so bulk inserts and raw SQL writes are indexed the same
+way as ORM writes. Each row's rowid is ``id * 4 + kind code``, which lets the
+triggers replace an entry by rowid instead of scanning for it.
+"""
+
+from collections import namedtuple
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+
+from CBPlumbing import db
+from CBPlumbing.database import write_lock
+
+
+KIND_CODES = {'customer': 1, 'job': 2, 'job_item': 3}
+
+SearchResult = namedtuple('SearchResult', 'kind ref_id name snippet rank')
+
+SOURCES = [
+    # (table, kind, columns feeding the name field, columns feeding the text field)
+    ('customer', 'customer', ['first_name', 'last_name'],
+     ['phone', 'email', 'first_line_address', 'second_line_address', 'city', 'postal_code']),
+    ('job', 'job', ['job_type'], ['job_notes']),
+    ('job_items', 'job_item', ['item_name'], ['item_description']),
+]
+
+
+def _concat(alias, columns):
+    return " || ' ' || ".join("COALESCE({}.{}, '')".format(alias, column) for column in columns)
+
+
+def _ddl():
+    statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+        "kind UNINDEXED, ref_id UNINDEXED, name, text, tokenize = 'unicode61 remove_diacritics 2')"
+    ]
+    for table, kind, name, text in SOURCES:
+        code = KIND_CODES[kind]
+        insert = ("INSERT INTO search_index (rowid, kind, ref_id, name, text) "
+                  "VALUES (new.id * 4 + {code}, '{kind}', new.id, {name}, {text});").format(
+                      code=code, kind=kind, name=_concat('new', name), text=_concat('new', text))
+        delete = "DELETE FROM search_index WHERE rowid = old.id * 4 + {code};".format(code=code)
+        # UPDATE OF only fires when a searchable column is in the SET list, so
+        # status and total updates do not rewrite the index entry.
+        statements += [
+            "CREATE TRIGGER IF NOT EXISTS {0}_search_insert AFTER INSERT ON {0} BEGIN {1} END".format(table, insert),
+            "CREATE TRIGGER IF NOT EXISTS {0}_search_update AFTER UPDATE OF {1} ON {0} BEGIN {2} {3} END".format(
+                table, ', '.join(name + text), delete, insert),
+            "CREATE TRIGGER IF NOT EXISTS {0}_search_delete AFTER DELETE ON {0} BEGIN {1} END".format(table, delete),
+        ]
+    return statements
+
+
+def create(connection):
+    """Creates the search table and its triggers if they are missing."""
+    for statement in _ddl():
+        connection.execute(sa.text(statement))
+
+
+def drop_triggers(connection):
+    """
+    Removes the triggers so a bulk load is not indexed row by row. Call
+    create() and rebuild() afterwards to bring the index back in step.
+    """
+    for table, kind, name, text in SOURCES:
+        for event in ('insert', 'update', 'delete'):
+            connection.execute(sa.text("DROP TRIGGER IF EXISTS {}_search_{}".format(table, event)))
+
+
+def _index_select(table, kind, name, text):
+    return ("INSERT INTO search_index (rowid, kind, ref_id, name, text) "
+            "SELECT id * 4 + {code}, '{kind}', id, {name}, {text} FROM {table}").format(
+                code=KIND_CODES[kind], kind=kind, table=table,
+                name=_concat(table, name), text=_concat(table, text))
+
+
+def rebuild(connection):
+    """Repopulates the search index from the source tables."""
+    connection.execute(sa.text("DELETE FROM search_index"))
+    for source in SOURCES:
+        connection.execute(sa.text(_index_select(*source)))
+
+
+@contextmanager
+def bulk_insert(connection, table, first_id, last_id):
+    """
+    For a block that inserts rows first_id to last_id into table in the
+    current transaction: the insert trigger is dropped for the block and the
+    rows are then indexed with one INSERT ... SELECT, which is several times
+    faster. The write lock is taken before the trigger is dropped, so the DROP
+    is part of the transaction: other connections never see the trigger
+    missing and cannot insert rows while it is. The trigger is created again
+    however the block ends, and a rollback undoes the DROP as well.
+    """
+    source = next(source for source in SOURCES if source[0] == table)
+    write_lock(connection)
+    connection.execute(sa.text("DROP TRIGGER IF EXISTS {}_search_insert".format(table)))
+    try:
+        yield
+        connection.execute(sa.text(_index_select(*source) + " WHERE id BETWEEN :first_id AND :last_id"),
+                           {'first_id': first_id, 'last_id': last_id})
+    finally:
+        create(connection)
+
+
+@sa.event.listens_for(db.metadata, 'after_create')
+def create_search_index(target, connection, **kw):
+    # Covers databases built with db.create_all(); deployed databases get the
+    # same objects from the migration.
+    if connection.dialect.name != 'sqlite':
+        return
+    create(connection)
+
+
+def match_query(term):
+    """Turns free text into an FTS5 query that prefix-matches every word."""
+    words = term.split()
+    return ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+
+def search(term, per_kind=10):
+    """
+    Returns the best matches grouped by entity type as {kind: [SearchResult]},
+    ranked with bm25 so that name matches weigh more than text matches.
+    """
+    results = {kind: [] for kind in KIND_CODES}
+    query = match_query(term)
+    if not query:
+        return results
+    # One ranked top-N query is far cheaper than ranking every hit per kind;
+    # the groups are then filled from that overall ranking. bm25() and
+    # snippet() must run in the query doing the MATCH, and snippets are only
+    # built for the rows that are kept.
+    rows = db.session.execute(sa.text(
+        "SELECT rowid, kind, ref_id, name, bm25(search_index, 0, 0, 5.0, 1.0) AS rank "
+        "FROM search_index WHERE search_index MATCH :query "
+        "ORDER BY bm25(search_index, 0, 0, 5.0, 1.0) LIMIT :limit"),
+        {'query': query, 'limit': per_kind * len(KIND_CODES)}).all()
+    if not rows:
+        return results
+    snippets = dict(db.session.execute(
+        sa.text("SELECT rowid, snippet(search_index, -1, '[', ']', '...', 12) FROM search_index "
+                "WHERE search_index MATCH :query AND rowid IN :rowids")
+        .bindparams(sa.bindparam('rowids', expanding=True)),
+        {'query': query, 'rowids': [row.rowid for row in rows]}).all())
+    for row in rows:
+        if len(results[row.kind]) < per_kind:
+            results[row.kind].append(SearchResult(row.kind, row.ref_id, row.name, snippets.get(row.rowid, ''), row.rank))
+    return results
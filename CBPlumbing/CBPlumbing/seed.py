@@ -0,0 +1,138 @@
+"""
+Synthetic data for load testing, used by the ``flask seed`` command and the
+benchmarks. Rows are generated in chunks and written with executemany inserts
+on the core tables, and the search index is rebuilt once at the end instead of
+being maintained by its triggers row by row. The new jobs and invoices are
+added to the report rollups with one grouped statement each.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+from CBPlumbing import db
+from CBPlumbing import reports
+from CBPlumbing import search
+from CBPlumbing import sync
+from CBPlumbing.models import Customer, Job, JobItems, Invoice, InvoiceLine
+from config import QueryConfig
+
+
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Susan',
+               'Thomas', 'Sarah', 'Daniel', 'Karen', 'Paul', 'Emma', 'Mark', 'Lucy', 'Steven', 'Amy']
+LAST_NAMES = ['Smith', 'Jones', 'Taylor', 'Brown', 'Williams', 'Wilson', 'Johnson', 'Davies', 'Robinson', 'Wright',
+              'Thompson', 'Evans', 'Walker', 'White', 'Roberts', 'Green', 'Hall', 'Wood', 'Jackson', 'Clarke']
+CITIES = [('Leeds', 'West Yorkshire', 'LS'), ('York', 'North Yorkshire', 'YO'), ('Sheffield', 'South Yorkshire', 'S'),
+          ('Hull', 'East Yorkshire', 'HU'), ('Bradford', 'West Yorkshire', 'BD')]
+PARTS = [('Boiler service', 85.0), ('Radiator valve', 12.5), ('Copper pipe 15mm', 4.2), ('Compression fitting', 1.8),
+         ('Thermostat', 45.0), ('Magnetic filter', 110.0), ('Pump', 150.0), ('Labour hour', 55.0),
+         ('Expansion vessel', 65.0), ('Flue kit', 95.0)]
+REFERALS = ['Web', 'Word of mouth', 'Repeat', 'Leaflet']
+START_DATE = datetime(2023, 1, 1)
+CHUNK = 10000
+
+
+def _next_id(connection, model):
+    return (connection.scalar(sa.select(sa.func.max(model.id))) or 0) + 1
+
+
+def _customers(first_id, count):
+    rows = []
+    for customer_id in range(first_id, first_id + count):
+        city, county, area = random.choice(CITIES)
+        first_name, last_name = random.choice(FIRST_NAMES), random.choice(LAST_NAMES)
+        rows.append({
+            'id': customer_id, 'first_name': first_name, 'last_name': last_name,
+            'phone': '07{:09d}'.format(random.randrange(10 ** 9)),
+            'email': '{}.{}{}@example.com'.format(first_name, last_name, customer_id).lower(),
+            'first_line_address': '{} {} Road'.format(random.randint(1, 300), random.choice(LAST_NAMES)),
+            'city': city, 'county': county,
+            'postal_code': '{}{} {}{}'.format(area, random.randint(1, 30), random.randint(1, 9),
+                                             random.choice('ABDEFGHJLNPQRSTUWXYZ') * 2),
+            'referal': random.choice(REFERALS), 'customer_active': random.random() > 0.05,
+        })
+    return rows
+
+
+def seed(customers=1000, jobs=5000, items_per_job=4, invoices=2000):
+    """
+    Appends the given numbers of customers, jobs and invoices to the database,
+    with items_per_job items on each job. Each invoice snapshots its job's
+    items as lines, and job totals are written with the jobs. Returns the
+    number of rows inserted per table.
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        search.drop_triggers(connection)
+        sync.drop_triggers(connection)
+
+    customer_id, job_id = _next_id(connection, Customer), _next_id(connection, Job)
+    item_id, invoice_id = _next_id(connection, JobItems), _next_id(connection, Invoice)
+    first_ids = {'customer': customer_id, 'job': job_id, 'job_items': item_id, 'invoice': invoice_id}
+    first_job_id, first_invoice_id = job_id, invoice_id
+    counts = {'customer': customers, 'job': jobs, 'job_items': 0, 'invoice': 0, 'invoice_line': 0}
+
+    for start in range(0, customers, CHUNK):
+        connection.execute(Customer.__table__.insert(), _customers(customer_id + start, min(CHUNK, customers - start)))
+
+    for start in range(0, jobs, CHUNK):
+        job_rows, item_rows, invoice_rows, line_rows = [], [], [], []
+        for index in range(start, min(start + CHUNK, jobs)):
+            planned = START_DATE + timedelta(days=random.randrange(730), hours=random.choice([8, 10, 13, 15]))
+            # Spread the invoices evenly over the jobs so the count is exact
+            invoiced = (index * invoices) // jobs != ((index + 1) * invoices) // jobs
+            items = []
+            for _ in range(items_per_job):
+                name, cost = random.choice(PARTS)
+                items.append({'id': item_id, 'job_id': job_id, 'item_name': name,
+                              'item_description': 'Supplied and fitted ' + name.lower(),
+                              'item_quantity': random.randint(1, 4), 'item_cost': cost})
+                item_id += 1
+            total = sum(item['item_quantity'] * item['item_cost'] for item in items)
+            job_rows.append({
+                'id': job_id, 'customer_id': random.randrange(customers) + customer_id if customers else None,
+                'job_type': random.choice(QueryConfig.JOB_TYPE_LIST),
+                'job_status': 'Complete' if invoiced else random.choice(QueryConfig.JOB_STATUS_LIST),
+                'job_notes': 'Customer reports {} issue'.format(random.choice(PARTS)[0].lower()),
+                'invoice_status': random.choice(['Issued', 'Paid']) if invoiced else 'None',
+                'job_created_date': planned - timedelta(days=random.randint(1, 21)),
+                'job_planned_date': planned,
+                'job_completed_date': planned if invoiced else None,
+                'total_cost': total,
+            })
+            item_rows += items
+            if invoiced:
+                invoice_rows.append({
+                    'id': invoice_id, 'job_id': job_id, 'invoice_date': planned + timedelta(days=1),
+                    'due_date': planned + timedelta(days=31), 'status': job_rows[-1]['invoice_status'],
+                    'total_amount': total,
+                })
+                line_rows += [{'invoice_id': invoice_id, 'item_name': item['item_name'],
+                               'item_description': item['item_description'], 'item_quantity': item['item_quantity'],
+                               'item_cost': item['item_cost'], 'line_total': item['item_quantity'] * item['item_cost']}
+                              for item in items]
+                invoice_id += 1
+            job_id += 1
+
+        connection.execute(Job.__table__.insert(), job_rows)
+        if item_rows:
+            connection.execute(JobItems.__table__.insert(), item_rows)
+        if invoice_rows:
+            connection.execute(Invoice.__table__.insert(), invoice_rows)
+        if line_rows:
+            connection.execute(InvoiceLine.__table__.insert(), line_rows)
+        counts['job_items'] += len(item_rows)
+        counts['invoice'] += len(invoice_rows)
+        counts['invoice_line'] += len(line_rows)
+
+    reports.add(connection, 'job', 'job.id >= :first', first=first_job_id)
+    reports.add(connection, 'invoice', 'invoice.id >= :first', first=first_invoice_id)
+    if connection.dialect.name == 'sqlite':
+        search.create(connection)
+        search.rebuild(connection)
+        sync.create(connection)
+        for table, first_id in first_ids.items():
+            sync.record(connection, table, 'id >= :first', first=first_id)
+    db.session.commit()
+    return counts
@@ -0,0 +1,312 @@
+"""
+Change feed and job item uploads for offline devices.
+
+change_log holds one row per customer, job, job item and invoice, which moves
+to a new seq every time the record is written or deleted. It is kept up to
+date by SQLite triggers, like the search index, so bulk UPDATEs and raw SQL
+are logged the same way as ORM writes. seq is an AUTOINCREMENT key and SQLite
+runs one write transaction at a time, so seqs are handed out in commit order:
+a device that has everything up to a seq only needs the log rows above it.
+GET /api/sync/changes?since=<token> reads that range of the primary key, then
+each kind's rows by id, and returns the last seq as the next token. Deleted
+records come back as tombstones. A record that changes again while a page is
+read is logged with a higher seq, so the device picks it up next time.
+
+POST /api/sync/job_items applies a batch of job item creates, edits and
+deletes in one transaction. Edits and deletes carry the seq the device last
+saw for the item. If any item has changed or gone since, the whole batch is
+refused with the server's copies, so the device can merge and send it again.
+"""
+
+import json
+from contextlib import contextmanager
+from datetime import datetime
+
+import sqlalchemy as sa
+from flask import jsonify, request
+from flask_login import login_required
+
+from CBPlumbing import app, db, reports
+from CBPlumbing.database import retry_on_lock, write_lock
+from CBPlumbing.forms import JobItemFields
+from CBPlumbing.models import Customer, Job, JobItems, Invoice, ChangeLog
+
+
+SOURCES = [
+    # (table, kind)
+    ('customer', 'customer'),
+    ('job', 'job'),
+    ('job_items', 'job_item'),
+    ('invoice', 'invoice'),
+]
+
+# Model and columns sent for each kind
+KINDS = {
+    'customer': (Customer, list(Customer.__table__.columns)),
+    'job': (Job, list(Job.__table__.columns)),
+    'job_item': (JobItems, [JobItems.id, JobItems.job_id, JobItems.item_name, JobItems.item_description,
+                            JobItems.item_quantity, JobItems.item_cost, JobItems.updated_at]),
+    'invoice': (Invoice, list(Invoice.__table__.columns)),
+}
+
+ITEM_FIELDS = ['item_name', 'item_description', 'item_quantity', 'item_cost']
+
+
+def _log(kind, row, deleted):
+    return ("INSERT OR REPLACE INTO change_log (kind, ref_id, deleted) "
+            "VALUES ('{kind}', {row}.id, {deleted});").format(kind=kind, row=row, deleted=deleted)
+
+
+def _ddl():
+    statements = []
+    for table, kind in SOURCES:
+        # REPLACE deletes the record's old log row, so the log stays one row
+        # per record however often it changes
+        statements += [
+            "CREATE TRIGGER IF NOT EXISTS {0}_sync_insert AFTER INSERT ON {0} BEGIN {1} END".format(
+                table, _log(kind, 'new', 0)),
+            "CREATE TRIGGER IF NOT EXISTS {0}_sync_update AFTER UPDATE ON {0} BEGIN {1} END".format(
+                table, _log(kind, 'new', 0)),
+            "CREATE TRIGGER IF NOT EXISTS {0}_sync_delete AFTER DELETE ON {0} BEGIN {1} END".format(
+                table, _log(kind, 'old', 1)),
+        ]
+    return statements
+
+
+def create(connection):
+    """Creates the change log triggers if they are missing."""
+    for statement in _ddl():
+        connection.execute(sa.text(statement))
+
+
+def drop_triggers(connection):
+    """
+    Removes the triggers so a bulk load is not logged row by row. Call
+    create() and record() afterwards to log the new rows.
+    """
+    for table, kind in SOURCES:
+        for event in ('insert', 'update', 'delete'):
+            connection.execute(sa.text("DROP TRIGGER IF EXISTS {}_sync_{}".format(table, event)))
+
+
+def record(connection, table, where='1', **params):
+    """Logs the rows of table matching the SQL condition where as changed."""
+    kind = dict(SOURCES)[table]
+    connection.execute(sa.text(
+        "INSERT OR REPLACE INTO change_log (kind, ref_id, deleted) "
+        "SELECT '{kind}', id, 0 FROM {table} WHERE {where} ORDER BY id".format(kind=kind, table=table, where=where)),
+        params)
+
+
+def rebuild(connection):
+    """
+    Logs every record as changed, so devices fetch everything again.
+    Tombstones are kept.
+    """
+    for table, kind in SOURCES:
+        record(connection, table)
+
+
+@contextmanager
+def bulk_insert(connection, table, first_id, last_id):
+    """
+    For a block that inserts rows first_id to last_id into table, as
+    search.bulk_insert: the insert trigger is dropped for the block, under
+    the write lock so no other writer's rows go unlogged, and the rows are
+    logged afterwards with one INSERT ... SELECT. The trigger is created
+    again however the block ends.
+    """
+    write_lock(connection)
+    connection.execute(sa.text("DROP TRIGGER IF EXISTS {}_sync_insert".format(table)))
+    try:
+        yield
+        record(connection, table, 'id BETWEEN :first_id AND :last_id', first_id=first_id, last_id=last_id)
+    finally:
+        create(connection)
+
+
+@sa.event.listens_for(db.metadata, 'after_create')
+def create_change_log_triggers(target, connection, **kw):
+    # Covers databases built with db.create_all(); deployed databases get the
+    # same triggers from the migration.
+    if connection.dialect.name != 'sqlite':
+        return
+    create(connection)
+
+
+def _json_ids(ids):
+    # Id lists go in as one JSON array so every statement keeps one shape
+    return sa.select(sa.func.json_each(json.dumps(sorted(ids))).table_valued('value').c.value)
+
+
+def _jsonable(row):
+    return {key: value.isoformat() if isinstance(value, datetime) else value
+            for key, value in row._mapping.items()}
+
+
+def _rows(kind, ids):
+    model, columns = KINDS[kind]
+    if not ids:
+        return {}
+    return {row.id: _jsonable(row) for row in
+            db.session.execute(sa.select(*columns).where(model.id.in_(_json_ids(ids))).order_by(model.id))}
+
+
+def _seqs(kind, ids):
+    """{ref_id: (seq, deleted)} from the change log."""
+    return {ref_id: (seq, deleted) for ref_id, seq, deleted in db.session.execute(
+        sa.select(ChangeLog.ref_id, ChangeLog.seq, ChangeLog.deleted)
+        .where(ChangeLog.kind == kind, ChangeLog.ref_id.in_(_json_ids(ids))))}
+
+
+@app.route('/api/sync/changes', methods=['GET'])
+@login_required
+def sync_changes():
+    since = max(request.args.get('since', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', app.config['SYNC_PAGE_SIZE'], type=int), 1),
+                app.config['SYNC_MAX_PAGE_SIZE'])
+    entries = db.session.execute(
+        sa.select(ChangeLog.seq, ChangeLog.kind, ChangeLog.ref_id, ChangeLog.deleted)
+        .where(ChangeLog.seq > since).order_by(ChangeLog.seq).limit(limit + 1)).all()
+    more = len(entries) > limit
+    entries = entries[:limit]
+
+    seqs = {kind: {} for kind in KINDS}
+    deleted = {kind: [] for kind in KINDS}
+    for seq, kind, ref_id, gone in entries:
+        if gone:
+            deleted[kind].append({'id': ref_id, 'seq': seq})
+        else:
+            seqs[kind][ref_id] = seq
+    changes = {kind: [dict(row, seq=seqs[kind][ref_id]) for ref_id, row in _rows(kind, seqs[kind]).items()]
+               for kind in KINDS}
+    return jsonify({'token': entries[-1].seq if entries else since, 'more': more,
+                    'changes': changes, 'deleted': deleted})
+
+
+def _is_id(value):
+    # JSON true and false arrive as bools, which are ints to isinstance
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _read_edits(edits):
+    """Sorts the uploaded edits into creates, updates and deletes, or returns errors."""
+    creates, updates, deletes, errors = [], [], [], []
+    seen = set()
+    for index, edit in enumerate(edits):
+        if not isinstance(edit, dict):
+            errors.append({'index': index, 'errors': {'edit': ['Expected an object.']}})
+            continue
+        item_id, seq = edit.get('id'), edit.get('seq')
+        if item_id is not None and (not _is_id(item_id) or not _is_id(seq)):
+            errors.append({'index': index, 'errors': {'seq': ['Edits need the item id and the seq it was read at.']}})
+            continue
+        if item_id is not None and item_id in seen:
+            errors.append({'index': index, 'errors': {'id': ['Item edited twice in one batch.']}})
+            continue
+        seen.add(item_id)
+        if item_id is not None and edit.get('deleted'):
+            deletes.append((index, edit))
+            continue
+        # Creates and edits send the whole item, checked with the form's rules
+        form = JobItemFields(data={field: edit.get(field) for field in ITEM_FIELDS})
+        field_errors = {} if form.validate() else dict(form.errors)
+        if item_id is None and not _is_id(edit.get('job_id')):
+            field_errors['job_id'] = ['New items need a job_id.']
+        if field_errors:
+            errors.append({'index': index, 'errors': field_errors})
+            continue
+        values = {field: form[field].data for field in ITEM_FIELDS}
+        if item_id is None:
+            creates.append((index, dict(values, job_id=edit['job_id'])))
+        else:
+            updates.append((index, dict(values, id=item_id, seq=seq)))
+    return creates, updates, deletes, errors
+
+
+@app.route('/api/sync/job_items', methods=['POST'])
+@login_required
+@retry_on_lock
+def sync_job_items():
+    # get_json() refuses anything but an application/json body, which a
+    # cross-site form cannot send
+    body = request.get_json()
+    edits = body.get('edits') if isinstance(body, dict) else None
+    if not isinstance(edits, list) or not edits:
+        return jsonify({'errors': [{'errors': {'edits': ['Send a list of edits.']}}]}), 400
+    if len(edits) > app.config['SYNC_MAX_UPLOAD']:
+        return jsonify({'errors': [{'errors': {'edits': ['At most {} edits per upload.'.format(
+            app.config['SYNC_MAX_UPLOAD'])]}}]}), 400
+    creates, updates, deletes, errors = _read_edits(edits)
+    if errors:
+        return jsonify({'errors': errors}), 400
+
+    item_ids = {edit['id'] for index, edit in updates + deletes}
+    item_jobs = dict(db.session.execute(
+        sa.select(JobItems.id, JobItems.job_id).where(JobItems.id.in_(_json_ids(item_ids)))).all())
+    job_ids = {job_id for job_id in item_jobs.values() if job_id is not None}
+    job_ids |= {values['job_id'] for index, values in creates}
+    job_where = "job.id IN (SELECT value FROM json_each(:job_ids))"
+    connection = db.session.connection()
+
+    # Taking the affected jobs out of the report rollups is the first write,
+    # so from here this transaction holds SQLite's write lock and the seqs
+    # checked below cannot change before the batch is applied
+    reports.subtract(connection, 'job', job_where, job_ids=json.dumps(sorted(job_ids)))
+    current = _seqs('job_item', item_ids)
+    # Versions as they are now, for the UPDATE's version check below
+    existing = dict(db.session.execute(
+        sa.select(JobItems.id, JobItems.version_id).where(JobItems.id.in_(_json_ids(item_ids)))).all())
+    jobs = set(db.session.scalars(sa.select(Job.id).where(Job.id.in_(_json_ids(job_ids)))))
+    conflicts = []
+    for index, edit in updates + deletes:
+        if edit['id'] not in existing:
+            conflicts.append({'index': index, 'id': edit['id'], 'reason': 'deleted'})
+        elif current.get(edit['id'], (None, False))[0] != edit['seq']:
+            conflicts.append({'index': index, 'id': edit['id'], 'reason': 'changed'})
+    for index, values in creates:
+        if values['job_id'] not in jobs:
+            conflicts.append({'index': index, 'job_id': values['job_id'], 'reason': 'job deleted'})
+    if conflicts:
+        conflicts.sort(key=lambda conflict: conflict['index'])
+        server = _rows('job_item', {conflict['id'] for conflict in conflicts if conflict['reason'] == 'changed'})
+        for conflict in conflicts:
+            if conflict.get('id') in server:
+                conflict['current'] = dict(server[conflict['id']], seq=current[conflict['id']][0])
+        db.session.rollback()
+        return jsonify({'conflicts': conflicts}), 409
+
+    # New ids are chosen here, as RETURNING with executemany runs row by row.
+    # The write lock is held, so no other writer can take them first, and
+    # they are counted before the deletes so a deleted id is not handed out
+    # again in the same batch.
+    start = (db.session.scalar(sa.select(sa.func.max(JobItems.id))) or 0) + 1
+    created = {index: start + number for number, (index, values) in enumerate(creates)}
+    if updates:
+        db.session.execute(sa.update(JobItems), [dict({key: value for key, value in edit.items() if key != 'seq'},
+                                                      version_id=existing[edit['id']])
+                                                 for index, edit in updates])
+    deleted_ids = [edit['id'] for index, edit in deletes]
+    if deleted_ids:
+        db.session.execute(sa.delete(JobItems).where(JobItems.id.in_(_json_ids(deleted_ids)))
+                           .execution_options(synchronize_session=False))
+    if creates:
+        db.session.execute(sa.insert(JobItems), [dict(values, id=created[index]) for index, values in creates])
+
+    # Job totals are recounted in one statement, as update_total_cost() does one
+    # job at a time, bumping each job's version as an ORM save would
+    db.session.execute(
+        sa.update(Job).where(Job.id.in_(_json_ids(job_ids)))
+        .values(version_id=Job.version_id + 1, total_cost=sa.select(sa.func.coalesce(sa.func.sum(JobItems.item_total), 0.0))
+                .where(JobItems.job_id == Job.id).scalar_subquery())
+        .execution_options(synchronize_session=False))
+    reports.add(connection, 'job', job_where, job_ids=json.dumps(sorted(job_ids)))
+
+    saved = {index: edit['id'] for index, edit in updates}
+    saved.update(created)
+    seqs = _seqs('job_item', set(saved.values()) | set(deleted_ids))
+    db.session.commit()
+    results = [{'index': index, 'id': item_id, 'seq': seqs[item_id][0]} for index, item_id in saved.items()]
+    results += [{'index': index, 'id': edit['id'], 'seq': seqs[edit['id']][0], 'deleted': True}
+                for index, edit in deletes]
+    return jsonify({'results': sorted(results, key=lambda result: result['index'])})
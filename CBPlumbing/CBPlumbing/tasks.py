@@ -0,0 +1,249 @@
+"""
+Background tasks, queued in the database.
+
+Code queues work with enqueue('name', *args, **kwargs). That adds a Task row
+to the session, so the task is only queued if the caller's transaction
+commits. `flask worker` runs a pool of threads that each claim the oldest due
+task with a single UPDATE ... RETURNING, so no two workers run the same task,
+even from separate processes. A task that raises is retried with exponential
+backoff until it has used max_attempts, and a task whose worker died is put
+back once its lease runs out, so tasks should be safe to run twice.
+Tasks registered with every=seconds are queued again by the worker that
+long after they last finished. /admin/tasks shows the queue.
+"""
+
+import json
+import os
+import signal
+import socket
+import threading
+import traceback
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from flask import flash, redirect, render_template, request, url_for
+
+from CBPlumbing import app, db, search
+from CBPlumbing.instrumentation import admin_required
+from CBPlumbing.models import Task
+
+
+STATUSES = ['Queued', 'Running', 'Done', 'Failed']
+# Longest result or traceback kept on a task row
+MAX_TEXT = 4000
+# Seconds between checks for tasks whose worker stopped
+SWEEP_INTERVAL = 60
+
+Registered = namedtuple('Registered', 'function max_attempts retry_delay every')
+
+_registry = {}
+
+
+def task(name=None, max_attempts=3, retry_delay=30, every=None):
+    """
+    Registers a function as a task under name, its own name by default.
+    Failed attempts are retried after retry_delay seconds, doubling each time.
+    Arguments and the return value must be JSON serialisable. With every, a
+    running worker pool queues the task, without arguments, every seconds.
+    """
+    def decorator(function):
+        _registry[name or function.__name__] = Registered(function, max_attempts, retry_delay, every)
+        return function
+    return decorator
+
+
+def enqueue(name, *args, run_at=None, **kwargs):
+    """
+    Adds a task to the session, due at run_at (UTC) or straight away. It is
+    queued when the session commits.
+    """
+    if name not in _registry:
+        raise ValueError('No task called {}'.format(name))
+    task = Task(name=name, payload=json.dumps({'args': args, 'kwargs': kwargs}), status='Queued',
+                attempts=0, max_attempts=_registry[name].max_attempts, run_at=run_at or datetime.utcnow())
+    db.session.add(task)
+    return task
+
+
+def _claim(worker):
+    now = datetime.utcnow()
+    due = (sa.select(Task.id).where(Task.status == 'Queued', Task.run_at <= now)
+           .order_by(Task.run_at, Task.id).limit(1).scalar_subquery())
+    claimed = db.session.execute(
+        sa.update(Task).where(Task.id == due)
+        .values(status='Running', attempts=Task.attempts + 1, started_at=now, worker=worker)
+        .returning(Task.id, Task.name, Task.payload, Task.attempts, Task.max_attempts)
+        .execution_options(synchronize_session=False)).first()
+    db.session.commit()
+    return claimed
+
+
+def _text(value):
+    return value[-MAX_TEXT:] if value is not None else None
+
+
+def _update(task_id, **values):
+    db.session.execute(sa.update(Task).where(Task.id == task_id).values(**values)
+                       .execution_options(synchronize_session=False))
+    db.session.commit()
+
+
+def run_one(worker):
+    """Claims and runs one due task. Returns False when none was due."""
+    with app.app_context():
+        claimed = _claim(worker)
+        if claimed is None:
+            return False
+        registered = _registry.get(claimed.name)
+        try:
+            if registered is None:
+                raise LookupError('No task called {}'.format(claimed.name))
+            payload = json.loads(claimed.payload or '{}')
+            result = registered.function(*payload.get('args', []), **payload.get('kwargs', {}))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            error = traceback.format_exc()
+            app.logger.warning('Task %s %s failed on attempt %d', claimed.id, claimed.name, claimed.attempts)
+            now = datetime.utcnow()
+            if registered is not None and claimed.attempts < claimed.max_attempts:
+                delay = registered.retry_delay * 2 ** (claimed.attempts - 1)
+                _update(claimed.id, status='Queued', run_at=now + timedelta(seconds=delay), error=_text(error))
+            else:
+                _update(claimed.id, status='Failed', finished_at=now, error=_text(error))
+        else:
+            _update(claimed.id, status='Done', finished_at=datetime.utcnow(), error=None,
+                    result=_text(json.dumps(result, default=str)))
+        return True
+
+
+def sweep(lease, retention_days):
+    """
+    Puts back Running tasks older than lease seconds, whose worker must have
+    stopped, and deletes finished tasks older than retention_days.
+    """
+    now = datetime.utcnow()
+    with app.app_context():
+        stale = sa.and_(Task.status == 'Running', Task.started_at < now - timedelta(seconds=lease))
+        for status, attempts_left in (('Queued', Task.attempts < Task.max_attempts),
+                                      ('Failed', Task.attempts >= Task.max_attempts)):
+            db.session.execute(sa.update(Task).where(stale, attempts_left).values(
+                status=status, run_at=now, finished_at=now if status == 'Failed' else None,
+                error='Worker stopped before the task finished.')
+                .execution_options(synchronize_session=False))
+        if retention_days:
+            db.session.execute(sa.delete(Task).where(
+                Task.status.in_(['Done', 'Failed']), Task.finished_at < now - timedelta(days=retention_days))
+                .execution_options(synchronize_session=False))
+        db.session.commit()
+
+
+def schedule():
+    """
+    Queues each periodic task that is not already queued or running, due its
+    interval after it last finished. The check and the insert are one
+    statement, so pools in several processes cannot queue it twice.
+    """
+    now = datetime.utcnow()
+    with app.app_context():
+        for name, registered in _registry.items():
+            if not registered.every:
+                continue
+            last = db.session.scalar(sa.select(sa.func.max(Task.finished_at)).where(Task.name == name))
+            run_at = max(now, last + timedelta(seconds=registered.every)) if last else now
+            pending = sa.select(Task.id).where(Task.name == name, Task.status.in_(['Queued', 'Running']))
+            db.session.execute(sa.insert(Task).from_select(
+                ['name', 'payload', 'status', 'attempts', 'max_attempts', 'run_at', 'created_at'],
+                sa.select(sa.literal(name), sa.literal(json.dumps({'args': [], 'kwargs': {}})), sa.literal('Queued'),
+                          sa.literal(0), sa.literal(registered.max_attempts), sa.literal(run_at), sa.literal(now))
+                .where(~pending.exists())))
+        db.session.commit()
+
+
+class WorkerPool(object):
+    """Threads that run tasks until stop() is called."""
+
+    def __init__(self, threads, poll_interval):
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.name = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _work(self, number):
+        worker = '{}:{}'.format(self.name, number)
+        while not self._stop.is_set():
+            try:
+                busy = run_one(worker)
+            except Exception:
+                # Usually the database being locked for longer than busy_timeout
+                app.logger.exception('Task worker %s could not claim or record a task', worker)
+                busy = False
+            if not busy:
+                self._stop.wait(self.poll_interval)
+
+    def start(self):
+        for number in range(self.threads):
+            thread = threading.Thread(target=self._work, args=(number,), name='task-worker-{}'.format(number))
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Lets running tasks finish, then waits for the threads to exit."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def run(self, lease, retention_days):
+        """
+        Runs the pool until SIGINT or SIGTERM, sweeping stale tasks and
+        queueing periodic ones meanwhile.
+        """
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda signum, frame: self._stop.set())
+        self.start()
+        while not self._stop.is_set():
+            try:
+                sweep(lease, retention_days)
+                schedule()
+            except Exception:
+                app.logger.exception('Task sweep failed')
+            self._stop.wait(SWEEP_INTERVAL)
+        self.stop()
+
+
+@task()
+def rebuild_search_index():
+    """Repopulates the full-text search index from the source tables."""
+    search.rebuild(db.session.connection())
+
+
+@app.route('/admin/tasks', methods=['GET'])
+@admin_required
+def task_status():
+    counts = dict(db.session.execute(sa.select(Task.status, sa.func.count()).group_by(Task.status)).all())
+    next_due = db.session.scalar(sa.select(sa.func.min(Task.run_at)).where(Task.status == 'Queued'))
+    status = request.args.get('status')
+    query = sa.select(Task).order_by(Task.id.desc()).limit(app.config['LIST_PAGE_SIZE'])
+    if status in STATUSES:
+        query = query.where(Task.status == status)
+    tasks = db.session.scalars(query).all()
+    return render_template('tasks.html', title='Tasks', counts=counts, statuses=STATUSES, status=status,
+                           next_due=next_due, tasks=tasks, registered=sorted(_registry))
+
+
+@app.route('/admin/tasks/<int:task_id>/retry', methods=['POST'])
+@admin_required
+def retry_task(task_id):
+    task = db.session.get(Task, task_id)
+    if task is None or task.status != 'Failed':
+        flash('Only failed tasks can be retried.', 'error')
+    else:
+        task.status = 'Queued'
+        task.attempts = 0
+        task.run_at = datetime.utcnow()
+        task.finished_at = None
+        db.session.commit()
+        flash('Task {} queued again.'.format(task_id))
+    return redirect(url_for('task_status', status=request.args.get('status')))
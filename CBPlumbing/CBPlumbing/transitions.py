@@ -0,0 +1,173 @@
+"""
+Bulk status changes from the job and invoice lists.
+
+The list pages post the ticked ids and a status to /bulk_job_status or
+/bulk_invoice_status, which move them all in one transaction with one UPDATE
+per table. The rules edit_invoice and delete_job apply to one record are
+conditions in that UPDATE's WHERE clause, so they are checked against every
+row at once rather than by loading each: an invoice's status only changes
+once its job is Complete, and a job with an invoice that is not Cancelled
+cannot be Cancelled. If any ticked row is refused, nothing is changed and the
+page lists which rows were refused and why.
+
+Rows already in the status are left alone, so they keep their version and
+are not sent to devices again.
+"""
+
+import json
+from urllib.parse import urlsplit
+
+import sqlalchemy as sa
+from flask import flash, redirect, url_for
+from flask_login import login_required
+
+from CBPlumbing import app, db, reports
+from CBPlumbing.database import retry_on_lock
+from CBPlumbing.forms import BulkStatusForm
+from CBPlumbing.models import Job, Invoice
+from config import QueryConfig
+
+
+# The single-record views' rules, as (status or None for any, condition the
+# row must meet, reason shown when it does not)
+JOB_RULES = [
+    ('Cancelled', "NOT EXISTS (SELECT 1 FROM invoice AS i WHERE i.job_id = job.id AND i.status IS NOT 'Cancelled')",
+     'Active invoice'),
+]
+INVOICE_RULES = [
+    (None, "NOT EXISTS (SELECT 1 FROM job AS j WHERE j.id = invoice.job_id AND j.job_status IS NOT 'Complete')",
+     'Job not Complete'),
+]
+
+# Ids listed per reason when a change is refused
+MAX_LISTED = 20
+
+
+def _transition(model, table, column, ids, status, rules):
+    """
+    Sets column to status on the rows in ids that are not in it already and
+    meet the rules for status, keeping the report rollups in step. Returns
+    (changed ids, refused {id: reason}); when any are refused the transaction
+    is rolled back, so nothing is changed.
+    """
+    ids = sorted(set(ids))
+    conditions = ["{0}.id IN (SELECT value FROM json_each(:ids))".format(table),
+                  "{0}.{1} IS NOT :to_status".format(table, column)]
+    checks = [(condition, reason) for applies_to, condition, reason in rules if applies_to in (None, status)]
+    where = ' AND '.join(conditions + [condition for condition, reason in checks])
+    params = {'ids': json.dumps(ids), 'to_status': status}
+    connection = db.session.connection()
+
+    # Taking the rows out of the rollups is the first write, so from here this
+    # transaction holds SQLite's write lock and the rows cannot change before
+    # the UPDATE, which matches exactly the same rows
+    reports.subtract(connection, table, where, **params)
+    changed = db.session.scalars(
+        sa.update(model).where(sa.text(where).bindparams(**params))
+        .values({column: status, 'version_id': model.version_id + 1}).returning(model.id)
+        .execution_options(synchronize_session=False)).all()
+    changed_ids = "{0}.id IN (SELECT value FROM json_each(:changed))".format(table)
+    reports.add(connection, table, changed_ids, changed=json.dumps(changed))
+
+    # Rows neither changed nor already in the status are missing or failed a
+    # rule. Reasons are only looked up when there are some.
+    found = dict(db.session.execute(
+        sa.select(model.id, getattr(model, column))
+        .where(model.id.in_(sa.select(sa.func.json_each(params['ids']).table_valued('value').c.value)))).all())
+    refused = {row_id: 'Not found' for row_id in ids if row_id not in found}
+    unexplained = [row_id for row_id, value in found.items() if value != status]
+    for condition, reason in checks:
+        if not unexplained:
+            break
+        failed = set(db.session.scalars(
+            sa.text("SELECT {0}.id FROM {0} WHERE {0}.id IN (SELECT value FROM json_each(:ids)) AND NOT ({1})"
+                    .format(table, condition)), {'ids': json.dumps(unexplained)}))
+        refused.update((row_id, reason) for row_id in failed)
+        unexplained = [row_id for row_id in unexplained if row_id not in failed]
+    if refused:
+        db.session.rollback()
+    return changed, refused
+
+
+def set_job_status(job_ids, status):
+    """
+    Moves the jobs to status. Returns (changed ids, refused {id: reason});
+    nothing is changed when any are refused. The caller commits.
+    """
+    return _transition(Job, 'job', 'job_status', job_ids, status, JOB_RULES)
+
+
+def set_invoice_status(invoice_ids, status):
+    """
+    Moves the invoices to status, with their jobs' invoice_status as
+    edit_invoice does. Returns (changed ids, refused {id: reason}); nothing is
+    changed when any are refused. The caller commits.
+    """
+    changed, refused = _transition(Invoice, 'invoice', 'status', invoice_ids, status, INVOICE_RULES)
+    if changed and not refused:
+        db.session.execute(
+            sa.update(Job)
+            .where(Job.id.in_(sa.select(Invoice.job_id).where(
+                Invoice.id.in_(sa.select(sa.func.json_each(json.dumps(changed)).table_valued('value').c.value)))),
+                   Job.invoice_status.is_distinct_from(status))
+            .values(invoice_status=status, version_id=Job.version_id + 1)
+            .execution_options(synchronize_session=False))
+    return changed, refused
+
+
+def _refused_message(noun, refused):
+    by_reason = {}
+    for row_id, reason in sorted(refused.items()):
+        by_reason.setdefault(reason, []).append(row_id)
+    parts = []
+    for reason, row_ids in sorted(by_reason.items()):
+        listed = ', '.join(str(row_id) for row_id in row_ids[:MAX_LISTED])
+        if len(row_ids) > MAX_LISTED:
+            listed += ' and {} more'.format(len(row_ids) - MAX_LISTED)
+        parts.append('{}: {}.'.format(reason, listed))
+    return 'No {}s were changed. {}'.format(noun, ' '.join(parts))
+
+
+def _local_path(url):
+    # Only a path on this site: no scheme or host, and one leading slash, as
+    # browsers read // and /\ as the start of a host
+    parts = urlsplit(url)
+    return url.startswith('/') and url[1:2] not in ('/', '\\') and not parts.scheme and not parts.netloc
+
+
+def _bulk_status(statuses, transition, noun, list_view):
+    form = BulkStatusForm()
+    form.status.choices = [(status, status) for status in statuses]
+    if form.validate_on_submit():
+        changed, refused = transition(form.ids.data, form.status.data)
+        if refused:
+            flash(_refused_message(noun, refused), 'error')
+        else:
+            db.session.commit()
+            message = '{} {}s set to {}.'.format(len(changed), noun, form.status.data)
+            unchanged = len(set(form.ids.data)) - len(changed)
+            if unchanged:
+                message += ' {} already were.'.format(unchanged)
+            flash(message)
+    elif 'csrf_token' in form.errors:
+        flash('The page had expired, please try again.', 'error')
+    else:
+        flash('Tick at least one {} and choose a status.'.format(noun), 'error')
+    next_page = form.next.data
+    if not next_page or not _local_path(next_page):
+        next_page = url_for(list_view)
+    return redirect(next_page)
+
+
+@app.route('/bulk_job_status', methods=['POST'])
+@login_required
+@retry_on_lock
+def bulk_job_status():
+    return _bulk_status(QueryConfig.JOB_STATUS_LIST, set_job_status, 'job', 'view_all_jobs')
+
+
+@app.route('/bulk_invoice_status', methods=['POST'])
+@login_required
+@retry_on_lock
+def bulk_invoice_status():
+    return _bulk_status(QueryConfig.INVOICE_STATUS_LIST, set_invoice_status, 'invoice', 'view_all_invoices')
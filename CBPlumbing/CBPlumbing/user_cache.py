@@ -0,0 +1,113 @@
+"""
+In-process cache for the Flask-Login user loader.
+
+Every authenticated request used to load its User row by primary key. The
+cache keeps a small read-only copy of each recently seen user, dropped after
+a TTL, when the cache is full (least recently used first) or when a commit
+changes the user. With a version file configured, a commit in any worker
+bumps the file and every worker clears its cache on the next lookup.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+
+import sqlalchemy as sa
+from flask_login import UserMixin
+
+from CBPlumbing.caching import VersionFile
+
+
+class CachedUser(UserMixin):
+    """
+    The User columns requests read through current_user. Views that change a
+    user should load the User row itself.
+    """
+
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.email = user.email
+        self.is_admin = bool(user.is_admin)
+
+    def __repr__(self):
+        return '<CachedUser {}>'.format(self.username)
+
+
+class UserCache(object):
+    def __init__(self, maxsize=1024, ttl=300, version_file=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._stamp = VersionFile(version_file) if version_file else None
+
+    def get(self, user_id, load):
+        """Returns the cached user, calling load() for the User row on a miss."""
+        if self.ttl <= 0 or self.maxsize <= 0:
+            user = load()
+            return CachedUser(user) if user is not None else None
+        now = time.monotonic()
+        with self._lock:
+            if self._stamp is not None and self._stamp.changed():
+                self._generation += 1
+                self._entries.clear()
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+
+        user = load()
+        if user is None:
+            return None
+        record = CachedUser(user)
+        with self._lock:
+            # An invalidation while the row was loading may mean it is stale
+            if generation == self._generation:
+                self._entries[user_id] = (record, now + self.ttl)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return record
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+            if self._stamp is not None:
+                self._stamp.bump()
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def track(self, session, model):
+        """
+        Invalidates users changed through session once the change commits.
+        Bulk UPDATE statements bypass the session and are only caught by the
+        TTL.
+        """
+        @sa.event.listens_for(session, 'after_flush')
+        def collect(session, flush_context):
+            changed = [obj.id for obj in chain(session.dirty, session.deleted) if isinstance(obj, model)]
+            if changed:
+                session.info.setdefault('changed_users', set()).update(changed)
+
+        @sa.event.listens_for(session, 'after_commit')
+        def invalidate(session):
+            changed = session.info.pop('changed_users', None)
+            if changed:
+                self.invalidate(changed)
+
+        @sa.event.listens_for(session, 'after_rollback')
+        def discard(session):
+            session.info.pop('changed_users', None)
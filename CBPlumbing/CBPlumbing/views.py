@@ -1,19 +1,64 @@
 from datetime import datetime
+import io
 from email import message
 
-from flask import render_template, flash, redirect, url_for, request, jsonify
+from flask import render_template, flash, redirect, url_for, request, jsonify, abort, stream_with_context, send_file
 from flask_login import login_required, current_user, login_user, logout_user
 from urllib.parse import urlsplit
 import sqlalchemy as sa
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 import logging
 
 from CBPlumbing import app, db
-from CBPlumbing.forms import LoginForm, RegistrationForm, AddCustomerForm, AddJobForm, EditJobForm, JobItemForm, InvoiceForm
-from CBPlumbing.models import User, Customer, Job, JobItems, Invoice
+from CBPlumbing.forms import LoginForm, RegistrationForm, AddCustomerForm, AddJobForm, EditJobForm, JobItemForm, JobItemBatchForm, InvoiceForm, ImportForm, BulkStatusForm
+from CBPlumbing.models import User, Customer, Job, JobItems, Invoice, fragment_cache
+from CBPlumbing.conditional import conditional, list_version, customer_version, job_version, invoice_version
+from CBPlumbing.database import retry_on_lock
+from CBPlumbing.pagination import paginate, render_page
+from CBPlumbing import search as site_search
+from CBPlumbing import export
+from CBPlumbing import importer
+from CBPlumbing import invoice_pdf
 from config import QueryConfig
 
 
+app.add_template_global(fragment_cache.fragment, 'cached_fragment')
+
+
+# Sort options offered on the list pages. Each must be backed by an index so
+# keyset pagination can seek straight to the page.
+CUSTOMER_SORT_COLUMNS = {
+    'id': Customer.id,
+    'first_name': Customer.first_name,
+    'last_name': Customer.last_name,
+    'postal_code': Customer.postal_code,
+}
+JOB_SORT_COLUMNS = {
+    'id': Job.id,
+    'job_planned_date': Job.job_planned_date,
+}
+INVOICE_SORT_COLUMNS = {
+    'id': Invoice.id,
+    'invoice_date': Invoice.invoice_date,
+    'due_date': Invoice.due_date,
+    'status': Invoice.status,
+    'total_amount': Invoice.total_amount,
+}
+
+# Columns fetched for the list pages: what the templates print plus the sort
+# keys the page cursors are built from. The rows are plain named tuples joined
+# to the customer in the same statement, so a page costs one query and builds
+# no ORM objects however many customers it shows.
+CUSTOMER_LIST_COLUMNS = (Customer.id, Customer.first_name, Customer.last_name, Customer.first_line_address,
+                         Customer.city, Customer.referal, Customer.postal_code)
+JOB_LIST_COLUMNS = (Job.id, Job.job_type, Job.job_planned_date, Job.total_cost, Job.job_status, Job.invoice_status,
+                    Customer.first_name.label('customer_first_name'), Customer.last_name.label('customer_last_name'))
+INVOICE_LIST_COLUMNS = (Invoice.id, Invoice.job_id, Invoice.invoice_date, Invoice.due_date, Invoice.status,
+                        Invoice.total_amount, Customer.first_name.label('customer_first_name'),
+                        Customer.last_name.label('customer_last_name'))
+
+
 @app.route('/')
 @app.route('/index')
 def index():
@@ -71,6 +116,7 @@ def logout():
 
 
 @app.route('/register', methods=['GET', 'POST'])
+@retry_on_lock
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -84,6 +130,19 @@ def register():
         return redirect(url_for('login'))
     return render_template('register.html', title='Register', form=form)
 
+@app.route('/search', methods=['GET'])
+@login_required
+def search():
+    term = request.args.get('q', '').strip()
+    results = site_search.search(term, per_kind=app.config['SEARCH_RESULTS_PER_TYPE'])
+    # Job item results link through to their job
+    item_ids = [row.ref_id for row in results['job_item']]
+    item_jobs = {}
+    if item_ids:
+        item_jobs = dict(db.session.execute(
+            sa.select(JobItems.id, JobItems.job_id).where(JobItems.id.in_(item_ids))).all())
+    return render_template('search.html', title='Search', term=term, results=results, item_jobs=item_jobs)
+
 @app.route('/dash', methods=['GET', 'POST'])
 @login_required
 def dash():
@@ -95,6 +154,7 @@ def dash():
 
 @app.route('/add_customer', methods=['GET', 'POST'])
 @login_required
+@retry_on_lock
 def add_customer():
     form = AddCustomerForm()
     if form.validate_on_submit():
@@ -114,6 +174,7 @@ def add_customer():
 
 @app.route('/edit_customer/<int:customer_id>', methods=['GET', 'POST'])
 @login_required
+@retry_on_lock
 def edit_customer(customer_id):
     customer = db.session.query(Customer).get(customer_id)
     if customer is None:
@@ -130,19 +191,16 @@ def edit_customer(customer_id):
 
 @app.route('/view_all_customers', methods=['GET'])
 @login_required
+@conditional(list_version(Customer))
 def view_all_customers():
-    customers = []
-    try:
-        print("Executing view_all_customers function")
-        customers = db.session.query(Customer).filter(Customer.customer_active == True).all()
-    except Exception as e:
-        print("error in view_all_customer", e)
-
-
-    return render_template('view_all_customers.html', title='Customers', customers=customers)
+    query = db.session.query(*CUSTOMER_LIST_COLUMNS).filter(Customer.customer_active == True)
+    customers = paginate(query, Customer.id, CUSTOMER_SORT_COLUMNS)
+    return render_page('view_all_customers.html', customers, title='Customers', customers=customers,
+                           sort_columns=CUSTOMER_SORT_COLUMNS)
 
 @app.route('/delete_customer/<int:customer_id>', methods=['GET', 'POST'])
 @login_required
+@retry_on_lock
 def delete_customer(customer_id):
     customer = db.session.query(Customer).get(customer_id)
     if customer is None:
@@ -153,8 +211,47 @@ def delete_customer(customer_id):
     return redirect(url_for('view_all_customers'))
 
 
+@app.route('/search_customers', methods=['GET'])
+@login_required
+def search_customers():
+    """Prefix lookup on name, phone and postcode for the customer picker."""
+    term = request.args.get('q', '').strip()
+    limit = request.args.get('limit', app.config['CUSTOMER_SEARCH_LIMIT'], type=int)
+    limit = max(1, min(limit, app.config['CUSTOMER_SEARCH_MAX_LIMIT']))
+    if not term:
+        return jsonify([])
+
+    def prefix(column, value):
+        # Escaped pattern bound as a parameter so SQLite can use the NOCASE index
+        value = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return column.like(value + '%', escape='\\')
+
+    conditions = [prefix(Customer.first_name, term), prefix(Customer.last_name, term),
+                  prefix(Customer.phone, term), prefix(Customer.postal_code, term)]
+    first, _, last = term.partition(' ')
+    if last.strip():
+        conditions.append(sa.and_(prefix(Customer.first_name, first), prefix(Customer.last_name, last.strip())))
+
+    customers = db.session.execute(
+        sa.select(Customer.id, Customer.first_name, Customer.last_name, Customer.postal_code)
+        .where(Customer.customer_active == True, sa.or_(*conditions))
+        .order_by(Customer.last_name, Customer.first_name)
+        .limit(limit)).all()
+    return jsonify([{'id': c.id, 'label': customer_label(c)} for c in customers])
+
+
+def customer_label(customer):
+    if customer is None:
+        return ''
+    label = str(customer.id) + ' - ' + customer.first_name + ' ' + customer.last_name
+    if customer.postal_code:
+        label += ' (' + customer.postal_code + ')'
+    return label
+
+
 @app.route('/view_customer/<int:customer_id>', methods=['GET', 'POST'])
 @login_required
+@conditional(customer_version)
 def view_customer(customer_id):
     customer = db.session.query(Customer).get(customer_id)
     if customer is None:
@@ -167,11 +264,10 @@ def view_customer(customer_id):
 
 @app.route('/add_job', methods=['GET', 'POST'])
 @login_required
+@retry_on_lock
 def add_job():
     form = AddJobForm()
 
-    customers = Customer.query.filter(Customer.customer_active == True).all()
-    form.customer_id.choices = [(c.id, str(c.id) + ' - ' + c.first_name + ' ' + c.last_name) for c in customers] if customers else []
     form.job_type.choices = [(type, type) for type in QueryConfig.JOB_TYPE_LIST] if QueryConfig.JOB_TYPE_LIST else []
 
     if form.validate_on_submit():
@@ -187,43 +283,100 @@ def add_job():
         return redirect(url_for('edit_job', job_id=job.id))
     
     # Populate form with submitted data if validation fails
+    customer = db.session.get(Customer, form.customer_id.data) if form.customer_id.data else None
     form.process(obj=request.form)
-    return render_template('add_job.html', form=form, title = 'Add Job')
+    return render_template('add_job.html', form=form, title = 'Add Job', customer_label=customer_label(customer))
 
 
 
+def commit_versioned(before_commit=None):
+    # Job, JobItems and Invoice rows are versioned, so a save over a row that
+    # changed since it was loaded fails rather than overwriting it. Nothing is
+    # locked while the form is open; the check is in the UPDATE itself. A post
+    # without a version (from a page rendered before versions) is checked
+    # against the version loaded for this request only. before_commit runs
+    # inside the check too, as a query in it can autoflush the UPDATE.
+    try:
+        if before_commit is not None:
+            before_commit()
+        db.session.commit()
+        return True
+    except StaleDataError:
+        db.session.rollback()
+        return False
+
+
+def populate_versioned(form, record):
+    # As form.populate_obj, but leaving version_id to the ORM. The posted
+    # version is only read for the check; copying it over, even when empty,
+    # would replace the version the UPDATE is made with.
+    for field in form:
+        if field.name != 'version_id':
+            field.populate_obj(record, field.name)
+
+
+def edit_conflict(template, form, record, **context):
+    # Shows the edit page again with the user's values still in the form and
+    # the fields that differ from what is saved now listed above it. The form
+    # takes the saved version, so saving again keeps the user's values.
+    conflicts = []
+    for field in form:
+        if field.name in ('csrf_token', 'submit', 'version_id'):
+            continue
+        saved = getattr(record, field.name)
+        if isinstance(saved, datetime) and not isinstance(field.data, datetime):
+            saved = saved.date()
+        if field.data != saved:
+            conflicts.append((field.label.text, field.data, saved))
+    form.version_id.data = record.version_id
+    form.version_id.raw_data = None  # or the field renders the posted version
+    flash('This record was changed by someone else while you were editing it. Check the changes and save again to keep yours.', 'error')
+    return render_template(template, form=form, conflicts=conflicts, **context), 409
+
+
 @app.route('/edit_job/<int:job_id>', methods=['GET', 'POST'])
 @login_required
+@retry_on_lock
 def edit_job(job_id):
     job = db.session.query(Job).get(job_id)
-    invoice = Invoice.query.filter_by(job_id=job.id).order_by(Invoice.invoice_date.desc()).first()
-    print(job.invoice_status, "1")
     if job is None:
         flash('Job not found!', 'error')
         return redirect(url_for('view_all_jobs'))
+    invoice = job.latest_invoice()
     form = EditJobForm(obj=job)
-    form.customer_id.choices = [(c.id, str(c.id) + ' - ' + c.first_name + ' ' + c.last_name) for c in Customer.query.filter(Customer.customer_active == True).all()]
     form.job_status.choices = [(status, status) for status in QueryConfig.JOB_STATUS_LIST]
     form.invoice_status.choices = [(status, status) for status in QueryConfig.INVOICE_STATUS_LIST]
     form.job_type.choices = [(type, type) for type in QueryConfig.JOB_TYPE_LIST]
     if form.validate_on_submit():
-        form.populate_obj(job)
-        db.session.commit()
-        flash('Job updated successfully!')
-        return redirect(url_for('view_job', job_id=job_id))
-    total_cost = db.session.query(sa.func.sum(JobItems.item_total)).filter(JobItems.job_id == job_id).scalar()
-    return render_template('edit_job.html', form=form, title = 'Jobs',items=job.items, job=job, total_cost=total_cost, subtitle="Edit Job", invoice=invoice)
+        if form.version_id.data in (None, job.version_id):
+            populate_versioned(form, job)
+            if commit_versioned():
+                flash('Job updated successfully!')
+                return redirect(url_for('view_job', job_id=job_id))
+        return edit_conflict('edit_job.html', form, job, title = 'Jobs', items=job.items, job=job, total_cost=job.total_cost,
+                             subtitle="Edit Job", invoice=job.latest_invoice(), customer_label=customer_label(job.customer))
+    return render_template('edit_job.html', form=form, title = 'Jobs',items=job.items, job=job, total_cost=job.total_cost, subtitle="Edit Job", invoice=invoice,
+                           customer_label=customer_label(job.customer))
+
 
 
+def bulk_status_form(statuses):
+    # The status changes at the top of a list page, which post the ticked rows
+    # to transitions.py and come back to this page
+    form = BulkStatusForm(next=request.full_path)
+    form.status.choices = [(status, status) for status in statuses]
+    return form
+
 
 @app.route('/view_all_jobs', methods=['GET'])
 @login_required
+@conditional(list_version(Job, Customer))
 def view_all_jobs():
     job_type = request.args.get('job_type')
     job_status = request.args.get('job_status')
     invoice_status = request.args.get('invoice_status')
 
-    query = db.session.query(Job)
+    query = db.session.query(*JOB_LIST_COLUMNS).select_from(Job).outerjoin(Customer, Customer.id == Job.customer_id)
     if job_type:
         query = query.filter(Job.job_type == job_type)
     if job_status:
@@ -231,12 +384,9 @@ def view_all_jobs():
     if invoice_status:
         query = query.filter(Job.invoice_status == invoice_status)
 
-    jobs = query.all()
-    job_costs = {}
-    for job in jobs:
-        total_cost = db.session.query(sa.func.sum(JobItems.item_total)).filter(JobItems.job_id == job.id).scalar()
-        job_costs[job.id] = total_cost
-    return render_template('view_all_jobs.html', title='Jobs', jobs=jobs, job_costs=job_costs,
+    jobs = paginate(query, Job.id, JOB_SORT_COLUMNS)
+    return render_page('view_all_jobs.html', jobs, title='Jobs', jobs=jobs, sort_columns=JOB_SORT_COLUMNS,
+                       bulk_form=bulk_status_form(QueryConfig.JOB_STATUS_LIST),
                        job_type=QueryConfig.JOB_TYPE_LIST, job_status=QueryConfig.JOB_STATUS_LIST, invoice_status=QueryConfig.INVOICE_STATUS_LIST,
                        selected_job_type=job_type, selected_job_status=job_status, selected_invoice_status=invoice_status)
 
@@ -244,21 +394,21 @@ def view_all_jobs():
 
 @app.route('/view_job/<int:job_id>', methods=['GET'])
 @login_required
+@conditional(job_version)
 def view_job(job_id):
     job = db.session.query(Job).get(job_id)
-    invoice = Invoice.query.filter_by(job_id=job.id).order_by(Invoice.invoice_date.desc()).first()
-    items = JobItems.query.filter_by(job_id=job_id).all()
-    customer = None
-    if job:
-        customer = db.session.query(Customer).get(job.customer_id)
-        
-    total_cost = db.session.query(sa.func.sum(JobItems.item_total)).filter(JobItems.job_id == job_id).scalar()
-    return render_template('view_job.html', title='Jobs',items=items, total_cost=total_cost, subtitle="View Job", job=job, customer=customer, invoice=invoice)
+    if job is None:
+        flash('Job not found!', 'error')
+        return redirect(url_for('view_all_jobs'))
+    # The customer, items and invoice are loaded by the template, and only
+    # when its cached fragment is out of date
+    return render_template('view_job.html', title='Jobs', subtitle="View Job", job=job)
 
 
 
 @app.route('/delete_job/<int:job_id>', methods=['POST'])
 @login_required
+@retry_on_lock
 def delete_job(job_id):
     job = db.session.query(Job).filter(Job.id == job_id).first()
     if job:
@@ -283,6 +433,7 @@ def delete_job(job_id):
 
 @app.route('/add_job_item/<int:job_id>', methods=['GET', 'POST'])
 @login_required
+@retry_on_lock
 def add_job_item(job_id):
     form = JobItemForm()
     if form.validate_on_submit():
@@ -293,14 +444,41 @@ def add_job_item(job_id):
             item_quantity=form.item_quantity.data,
             item_cost=form.item_cost.data
         )
-        db.session.add(job_item)           
+        db.session.add(job_item)
+        db.session.get(Job, job_id).update_total_cost()
         db.session.commit()
         flash('Job Item added successfully!')
         return redirect(url_for('edit_job', job_id=job_id))
     return render_template('add_job_item.html', form=form, title = 'Edit Job', job_id=job_id, subtitle="Add Item")
 
+@app.route('/add_job_items/<int:job_id>', methods=['GET', 'POST'])
+@login_required
+@retry_on_lock
+def add_job_items(job_id):
+    """Adds several item rows to a job in one transaction."""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        flash('Job not found!', 'error')
+        return redirect(url_for('view_all_jobs'))
+    form = JobItemBatchForm()
+    if form.validate_on_submit():
+        rows = [dict(job_id=job_id,
+                     item_name=row.item_name.data,
+                     item_description=row.item_description.data,
+                     item_quantity=row.item_quantity.data,
+                     item_cost=row.item_cost.data) for row in form.items]
+        db.session.execute(sa.insert(JobItems), rows)
+        job.update_total_cost()
+        db.session.commit()
+        flash('{} job items added successfully!'.format(len(rows)))
+        return redirect(url_for('edit_job', job_id=job_id))
+    while len(form.items) < form.items.min_entries:
+        form.items.append_entry()
+    return render_template('add_job_items.html', form=form, title = 'Edit Job', job_id=job_id, subtitle="Add Items")
+
 @app.route('/edit_job_item/<int:item_id>', methods=['GET', 'POST'])
 @login_required
+@retry_on_lock
 def edit_job_item(item_id):
     item = db.session.query(JobItems).get(item_id)
     if item is None:
@@ -308,20 +486,26 @@ def edit_job_item(item_id):
         return redirect(url_for('view_all_jobs'))
     form = JobItemForm(obj=item)
     if form.validate_on_submit():
-        form.populate_obj(item)
-        db.session.commit()
-        flash('Job Item updated successfully!')
-        return redirect(url_for('edit_job', job_id=item.job_id))
+        if form.version_id.data in (None, item.version_id):
+            populate_versioned(form, item)
+            if commit_versioned(lambda: item.job.update_total_cost()):
+                flash('Job Item updated successfully!')
+                return redirect(url_for('edit_job', job_id=item.job_id))
+        return edit_conflict('edit_job_item.html', form, item, title = 'Edit Job', item=item, job=item.job_id,
+                             subtitle="Edit Item", job_id=item.job_id)
     return render_template('edit_job_item.html', form=form, title = 'Edit Job', item=item, job=item.job_id, subtitle="Edit Item", job_id=item.job_id)
 
 
 @app.route('/delete_job_item/<int:item_id>', methods=['POST'])
 @login_required
+@retry_on_lock
 def delete_job_item(item_id):
     item = db.session.query(JobItems).get(item_id)
     if item:
         job_id = item.job_id
+        job = item.job
         db.session.delete(item)
+        job.update_total_cost()
         db.session.commit()
         flash('Item deleted successfully!')
     else:
@@ -329,15 +513,49 @@ def delete_job_item(item_id):
     return redirect(url_for('edit_job', job_id=job_id))
 
 
+@app.route('/export/<kind>.<fmt>', methods=['GET'])
+@login_required
+def export_rows(kind, fmt):
+    """Streams jobs, job items or invoices as CSV or XLSX, filtered like view_all_jobs."""
+    if kind not in export.EXPORTS or fmt not in export.FORMATS:
+        abort(404)
+    chunks = export.chunks(kind, fmt, request.args)
+    response = app.response_class(stream_with_context(chunks), mimetype=export.FORMATS[fmt])
+    response.headers['Content-Disposition'] = 'attachment; filename="{}"'.format(export.filename(kind, fmt))
+    return response
+
+
+@app.route('/import', methods=['GET', 'POST'])
+@login_required
+def import_csv():
+    """Imports customers or job history from an uploaded CSV, reporting failed rows."""
+    form = ImportForm()
+    report = None
+    if form.validate_on_submit():
+        stream = io.TextIOWrapper(form.file.data.stream, encoding='utf-8-sig', newline='')
+        report = importer.run(form.kind.data, stream)
+        if report.error:
+            flash('Import stopped: {}'.format(report.error), 'error')
+        else:
+            flash('{} rows imported, {} failed.'.format(report.imported, report.failed))
+    return render_template('import.html', form=form, report=report, columns=importer.COLUMNS,
+                           max_failures=importer.MAX_FAILURES, title='Import')
+
+
 # Invoice Routes
 
 @app.route('/view_all_invoices')
+@conditional(list_version(Invoice, Job, Customer))
 def view_all_invoices():
-    invoices = Invoice.query.all()
-    return render_template('view_all_invoices.html', title='View All Invoices', invoices=invoices)
+    query = (db.session.query(*INVOICE_LIST_COLUMNS).select_from(Invoice)
+             .outerjoin(Job, Job.id == Invoice.job_id).outerjoin(Customer, Customer.id == Job.customer_id))
+    invoices = paginate(query, Invoice.id, INVOICE_SORT_COLUMNS)
+    return render_page('view_all_invoices.html', invoices, title='View All Invoices', invoices=invoices,
+                           sort_columns=INVOICE_SORT_COLUMNS, bulk_form=bulk_status_form(QueryConfig.INVOICE_STATUS_LIST))
 
 
 @app.route('/add_invoice/<int:job_id>', methods=['GET', 'POST'])
+@retry_on_lock
 def add_invoice(job_id):
     job = Job.query.get(job_id)
     if job is None:
@@ -357,6 +575,7 @@ def add_invoice(job_id):
         )
         job.invoice_status = 'Issued'
         invoice.status = "Issued"
+        invoice.copy_job_items(job)
         db.session.add(invoice)
         db.session.commit()
         return redirect(url_for('view_all_invoices'))
@@ -367,13 +586,25 @@ def add_invoice(job_id):
 
 
 @app.route('/view_invoice/<int:invoice_id>')
+@conditional(invoice_version)
 def view_invoice(invoice_id):
     invoice = Invoice.query.get_or_404(invoice_id)
     return render_template('view_invoice.html', title='View Invoice', invoice=invoice)
 
 
+@app.route('/invoice_pdf/<int:invoice_id>')
+@login_required
+def invoice_pdf_file(invoice_id):
+    """The printable invoice, drawn only when its contents have changed."""
+    pdf = invoice_pdf.open_pdf(invoice_id)
+    if pdf is None:
+        abort(404)
+    return send_file(pdf, mimetype='application/pdf', download_name='invoice-{}.pdf'.format(invoice_id))
+
+
 
 @app.route('/edit_invoice/<int:invoice_id>', methods=['GET', 'POST'])
+@retry_on_lock
 def edit_invoice(invoice_id):
     
     invoice = Invoice.query.get_or_404(invoice_id)
@@ -381,14 +612,17 @@ def edit_invoice(invoice_id):
     form = InvoiceForm(obj=invoice)
     
     if form.validate_on_submit():
-        form.populate_obj(invoice)
+        if form.version_id.data not in (None, invoice.version_id):
+            return edit_conflict('edit_invoice.html', form, invoice, title='Edit Invoice', invoice=invoice, job=job)
+        populate_versioned(form, invoice)
         if job:
             if job.job_status != 'Complete':                
                 flash('Job must be completed before updating invoice status!', 'error')
                 return redirect(url_for('edit_invoice', invoice_id=invoice_id))
             job.invoice_status = form.status.data
             invoice.status = form.status.data
-        db.session.commit()
+        if not commit_versioned():
+            return edit_conflict('edit_invoice.html', form, invoice, title='Edit Invoice', invoice=invoice, job=job)
         flash('Invoice updated successfully!')
         return redirect(url_for('view_invoice', invoice_id=invoice_id))
     return render_template('edit_invoice.html', title='Edit Invoice', form=form, invoice=invoice, job=job)
@@ -396,6 +630,7 @@ def edit_invoice(invoice_id):
 
 @app.route('/delete_invoice/<int:invoice_id>', methods=['POST'])
 @login_required
+@retry_on_lock
 def delete_invoice(invoice_id):
     invoice = db.session.query(Invoice).filter(Invoice.id == invoice_id).first()
     job = Job.query.get(invoice.job_id)
@@ -0,0 +1,87 @@
+"""
+Bulk status change benchmark. Seeds a database, then times marking a month
+end's worth of jobs Complete and invoices of Complete jobs Paid through
+/bulk_job_status and /bulk_invoice_status, one request each, and a refused
+batch. For comparison it times the same number of changes made the old way,
+loading each record into the session and saving it. Prints the results as
+JSON.
+
+Run from the project folder:
+    python benchmarks/bulk_status.py [--jobs 100000] [--batch 500]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+WORK_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORK_DIR, 'bench.db')
+os.environ['FRAGMENT_CACHE_MAX_BYTES'] = '0'
+
+import sqlalchemy as sa
+
+from CBPlumbing import app, db
+from CBPlumbing.models import Job, Invoice
+from CBPlumbing.seed import seed
+
+
+def timed_post(client, url, data):
+    start = time.perf_counter()
+    response = client.post(url, data=data)
+    assert response.status_code == 302, response.status_code
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+def one_by_one(job_ids):
+    start = time.perf_counter()
+    for job_id in job_ids:
+        job = db.session.get(Job, job_id)
+        job.job_status = 'Complete'
+        db.session.commit()
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--jobs', type=int, default=100000)
+    parser.add_argument('--batch', type=int, default=500)
+    args = parser.parse_args()
+
+    app.config.update(LOGIN_DISABLED=True, WTF_CSRF_ENABLED=False)
+    report = {'jobs': args.jobs, 'batch': args.batch}
+    with app.app_context():
+        db.create_all()
+        seed(customers=max(args.jobs // 5, 1), jobs=args.jobs, items_per_job=2, invoices=args.jobs // 2)
+        open_jobs = db.session.scalars(
+            sa.select(Job.id).where(Job.job_status != 'Complete').order_by(Job.id).limit(args.batch * 2)).all()
+        batch, old_way = open_jobs[:args.batch], open_jobs[args.batch:]
+        invoices = db.session.scalars(
+            sa.select(Invoice.id).join(Job, Job.id == Invoice.job_id)
+            .where(Job.job_status == 'Complete', Invoice.status != 'Paid').order_by(Invoice.id).limit(args.batch)).all()
+        blocked = db.session.scalar(
+            sa.select(Invoice.job_id).where(Invoice.status != 'Cancelled', Invoice.job_id.notin_(batch)).limit(1))
+    client = app.test_client()
+
+    report['jobs_complete'] = {'ids': len(batch), 'ms': timed_post(
+        client, '/bulk_job_status', {'ids': batch, 'status': 'Complete'})}
+    report['invoices_paid'] = {'ids': len(invoices), 'ms': timed_post(
+        client, '/bulk_invoice_status', {'ids': invoices, 'status': 'Paid'})}
+    report['refused_cancel'] = {'ids': len(batch) + 1, 'ms': timed_post(
+        client, '/bulk_job_status', {'ids': batch + [blocked], 'status': 'Cancelled'})}
+    with app.app_context():
+        assert db.session.scalar(sa.select(sa.func.count()).where(
+            Job.id.in_(batch), Job.job_status == 'Complete')) == len(batch)
+        report['jobs_complete_one_by_one'] = {'ids': len(old_way), 'ms': one_by_one(old_way)}
+
+    print(json.dumps(report, indent=2))
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
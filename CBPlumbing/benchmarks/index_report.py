@@ -0,0 +1,101 @@
+"""
+Records EXPLAIN QUERY PLAN output for the list page queries and the write
+throughput of customer and job inserts/updates, once on a database migrated to
+BEFORE and once on one migrated to AFTER, and prints both as JSON.
+
+Run from the project folder:
+    python benchmarks/index_report.py [rows] [before revision] [after revision]
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+
+import sqlalchemy as sa
+from flask_migrate import upgrade
+
+from CBPlumbing import app, db
+
+MIGRATIONS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'env', 'migrations'))
+BEFORE = '7cef624f40d5'
+AFTER = 'head'
+
+QUERIES = {
+    'active customers by last name':
+        "SELECT id FROM customer WHERE customer_active = 1 AND (last_name, id) > ('M', 0) "
+        "ORDER BY last_name, id LIMIT 51",
+    'jobs by type and status':
+        "SELECT id FROM job WHERE job_type = 'Service' AND job_status = 'Open' ORDER BY id LIMIT 51",
+    'open jobs by planned date':
+        "SELECT id FROM job WHERE job_status = 'Open' AND (job_planned_date, id) > ('2024-06-01', 0) "
+        "ORDER BY job_planned_date, id LIMIT 51",
+    'completed jobs not invoiced':
+        "SELECT id FROM job WHERE invoice_status = 'None' AND job_status = 'Complete' ORDER BY id LIMIT 51",
+    'latest invoice for a job':
+        "SELECT id FROM invoice WHERE job_id = 42 ORDER BY invoice_date DESC LIMIT 1",
+    'jobs for a customer':
+        "SELECT id FROM job WHERE customer_id = 42",
+}
+
+
+def timed(connection, statement, rows):
+    start = time.perf_counter()
+    connection.execute(sa.text(statement), rows)
+    connection.commit()
+    return round(len(rows) / (time.perf_counter() - start))
+
+
+def measure(revision, rows):
+    db.engine.dispose()
+    if os.path.exists(DB_FILE):
+        os.remove(DB_FILE)
+    upgrade(directory=MIGRATIONS, revision=revision)
+
+    random.seed(0)
+    customers = [
+        {'first_name': random.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') + 'name', 'last_name': random.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') + 'son',
+         'email': 'c{}@example.com'.format(i), 'address': '{} High Street'.format(i), 'city': 'Leeds', 'county': 'West Yorkshire',
+         'postal_code': 'LS{} {}AB'.format(i % 30, i % 9), 'referal': 'Web', 'active': i % 10 != 0}
+        for i in range(rows)]
+    jobs = [
+        {'customer_id': i % rows + 1, 'job_type': random.choice(['Service', 'Install', 'Repair']),
+         'job_status': random.choice(['Open', 'In Progress', 'Complete', 'Cancelled']),
+         'invoice_status': random.choice(['None', 'Issued', 'Paid']),
+         'planned': datetime(2024, 1, 1) + timedelta(days=i % 365)}
+        for i in range(rows)]
+    updates = [{'id': i + 1, 'status': random.choice(['Open', 'Complete'])} for i in range(rows)]
+
+    with db.engine.connect() as connection:
+        throughput = {
+            'customer inserts/s': timed(connection,
+                "INSERT INTO customer (first_name, last_name, email, first_line_address, city, county, postal_code, referal, customer_active) "
+                "VALUES (:first_name, :last_name, :email, :address, :city, :county, :postal_code, :referal, :active)", customers),
+            'job inserts/s': timed(connection,
+                "INSERT INTO job (customer_id, job_type, job_status, invoice_status, job_planned_date) "
+                "VALUES (:customer_id, :job_type, :job_status, :invoice_status, :planned)", jobs),
+            'job status updates/s': timed(connection, "UPDATE job SET job_status = :status WHERE id = :id", updates),
+        }
+        connection.execute(sa.text('ANALYZE'))
+        plans = {}
+        for name, query in QUERIES.items():
+            plan = connection.execute(sa.text('EXPLAIN QUERY PLAN ' + query)).all()
+            plans[name] = [row[3] for row in plan]
+    return {'revision': revision, 'throughput': throughput, 'plans': plans}
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    before = sys.argv[2] if len(sys.argv) > 2 else BEFORE
+    after = sys.argv[3] if len(sys.argv) > 3 else AFTER
+    with app.app_context():
+        report = {'rows': rows, 'before': measure(before, rows), 'after': measure(after, rows)}
+    print(json.dumps(report, indent=2))
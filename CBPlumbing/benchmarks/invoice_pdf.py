@@ -0,0 +1,70 @@
+"""
+Invoice PDF batch benchmark. Seeds a database with invoices and times a cold
+batch run (everything drawn), a warm run (everything cached) and a run after
+one invoice changes, first in one process and then over a process pool.
+Prints the timings as JSON.
+
+Run from the project folder:
+    python benchmarks/invoice_pdf.py [--invoices 1000] [--items-per-job 6] [--processes 4]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+WORK_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORK_DIR, 'bench.db')
+os.environ['INVOICE_PDF_DIR'] = os.path.join(WORK_DIR, 'pdf')
+
+import sqlalchemy as sa
+
+from CBPlumbing import app, db, invoice_pdf
+from CBPlumbing.models import Invoice
+from CBPlumbing.seed import seed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--invoices', type=int, default=1000)
+    parser.add_argument('--items-per-job', type=int, default=6)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    report = {'invoices': args.invoices, 'items_per_job': args.items_per_job, 'cpus': os.cpu_count()}
+    with app.app_context():
+        db.create_all()
+        seed(customers=max(args.invoices // 5, 1), jobs=args.invoices, items_per_job=args.items_per_job,
+             invoices=args.invoices)
+        ids = invoice_pdf.invoice_ids()
+        status = db.session.scalar(sa.select(Invoice.status).where(Invoice.id == ids[0]))
+        for processes in sorted({1, args.processes}):
+            shutil.rmtree(app.config['INVOICE_PDF_DIR'], ignore_errors=True)
+            runs = {}
+            runs['cold'] = invoice_pdf.render_batch(ids, processes)[1]
+            paths, runs['warm'] = invoice_pdf.render_batch(ids, processes)
+            # Old enough for the file that replaces it to delete it
+            old = time.time() - invoice_pdf.REPLACED_MAX_AGE - 1
+            os.utime(paths[ids[0]], (old, old))
+            db.session.execute(sa.update(Invoice).where(Invoice.id == ids[0]).values(status='Changed'))
+            db.session.commit()
+            runs['one_changed'] = invoice_pdf.render_batch(ids, processes)[1]
+            folder = os.path.dirname(paths[ids[0]])
+            assert len(os.listdir(folder)) == 1, os.listdir(folder)
+            db.session.execute(sa.update(Invoice).where(Invoice.id == ids[0]).values(status=status))
+            db.session.commit()
+            report['processes_{}'.format(processes)] = runs
+        paths, _ = invoice_pdf.render_batch(ids[:1])
+        report['bytes_per_invoice'] = os.path.getsize(paths[ids[0]])
+
+    print(json.dumps(report, indent=2))
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+List page loading benchmark. Seeds a database, then loads a page of jobs and
+of invoices with their customer names three ways: ORM objects with the
+customer loaded lazily per row, ORM objects with joinedload, and the column
+projections the list views use. For each it reports the SQL statements issued
+and the peak Python memory allocated (tracemalloc) while building the page.
+It then requests each list route and reports the same for the whole response,
+with the fragment cache off. Prints the results as JSON.
+
+Run from the project folder:
+    python benchmarks/list_pages.py [--customers 2000] [--jobs 10000] [--invoices 5000] [--per-page 50 500]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+WORK_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORK_DIR, 'bench.db')
+os.environ['FRAGMENT_CACHE_MAX_BYTES'] = '0'
+
+import sqlalchemy as sa
+from sqlalchemy.orm import joinedload
+
+from CBPlumbing import app, db, views
+from CBPlumbing.models import Customer, Job, Invoice
+from CBPlumbing.seed import seed
+
+
+def _jobs_lazy(limit):
+    jobs = db.session.query(Job).order_by(Job.id).limit(limit).all()
+    return [(job.id, job.customer.first_name, job.customer.last_name) for job in jobs]
+
+
+def _jobs_joined(limit):
+    jobs = db.session.query(Job).options(joinedload(Job.customer)).order_by(Job.id).limit(limit).all()
+    return [(job.id, job.customer.first_name, job.customer.last_name) for job in jobs]
+
+
+def _jobs_projected(limit):
+    rows = (db.session.query(*views.JOB_LIST_COLUMNS).select_from(Job)
+            .outerjoin(Customer, Customer.id == Job.customer_id).order_by(Job.id).limit(limit).all())
+    return [(row.id, row.customer_first_name, row.customer_last_name) for row in rows]
+
+
+def _invoices_lazy(limit):
+    invoices = db.session.query(Invoice).order_by(Invoice.id).limit(limit).all()
+    return [(invoice.id, invoice.job.customer.first_name, invoice.job.customer.last_name) for invoice in invoices]
+
+
+def _invoices_joined(limit):
+    invoices = (db.session.query(Invoice).options(joinedload(Invoice.job).joinedload(Job.customer))
+                .order_by(Invoice.id).limit(limit).all())
+    return [(invoice.id, invoice.job.customer.first_name, invoice.job.customer.last_name) for invoice in invoices]
+
+
+def _invoices_projected(limit):
+    rows = (db.session.query(*views.INVOICE_LIST_COLUMNS).select_from(Invoice)
+            .outerjoin(Job, Job.id == Invoice.job_id).outerjoin(Customer, Customer.id == Job.customer_id)
+            .order_by(Invoice.id).limit(limit).all())
+    return [(row.id, row.customer_first_name, row.customer_last_name) for row in rows]
+
+
+STRATEGIES = {
+    'jobs': {'lazy': _jobs_lazy, 'joinedload': _jobs_joined, 'projection': _jobs_projected},
+    'invoices': {'lazy': _invoices_lazy, 'joinedload': _invoices_joined, 'projection': _invoices_projected},
+}
+ROUTES = {'customers': '/view_all_customers', 'jobs': '/view_all_jobs', 'invoices': '/view_all_invoices'}
+
+
+def measure(function):
+    """Statements, peak KiB and milliseconds for one call, starting from an empty session."""
+    db.session.expunge_all()
+    statements = []
+    listener = lambda *args: statements.append(1)
+    sa.event.listen(db.engine, 'before_cursor_execute', listener)
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        function()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        sa.event.remove(db.engine, 'before_cursor_execute', listener)
+    return {'queries': len(statements), 'peak_kib': round(peak / 1024.0, 1), 'ms': round(elapsed * 1000, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--customers', type=int, default=2000)
+    parser.add_argument('--jobs', type=int, default=10000)
+    parser.add_argument('--invoices', type=int, default=5000)
+    parser.add_argument('--per-page', type=int, nargs='+', default=[50, 500])
+    args = parser.parse_args()
+
+    app.config['LOGIN_DISABLED'] = True
+    report = {'customers': args.customers, 'jobs': args.jobs, 'invoices': args.invoices}
+    with app.app_context():
+        db.create_all()
+        seed(customers=args.customers, jobs=args.jobs, items_per_job=1, invoices=args.invoices)
+        client = app.test_client()
+        for per_page in args.per_page:
+            results = {}
+            for page, strategies in STRATEGIES.items():
+                results[page] = {name: measure(lambda: function(per_page)) for name, function in strategies.items()}
+            for page, url in ROUTES.items():
+                def request():
+                    assert client.get(url, query_string={'per_page': per_page}).status_code == 200
+                request()  # warm the template cache
+                results.setdefault(page, {})['route'] = measure(request)
+            report['per_page_{}'.format(per_page)] = results
+
+    print(json.dumps(report, indent=2))
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Streamed list page benchmark. Seeds a database with jobs and requests
+view_all_jobs with increasingly long pages, once rendered in one piece and
+once streamed, reporting the time to the first chunk of the body, the total
+time and the peak Python memory allocated (tracemalloc) for each. The
+fragment cache is off. It also checks that streamed pages shorter than the
+list, including exact multiples of LIST_STREAM_BATCH, link to the next page.
+Prints the results as JSON.
+
+Run from the project folder:
+    python benchmarks/list_streaming.py [--jobs 20000] [--rows 500 5000 20000]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+WORK_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORK_DIR, 'bench.db')
+os.environ['FRAGMENT_CACHE_MAX_BYTES'] = '0'
+
+from CBPlumbing import app, db
+from CBPlumbing.seed import seed
+
+
+def measure(client, rows):
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        response = client.get('/view_all_jobs', query_string={'per_page': rows}, buffered=False)
+        chunks = iter(response.response)
+        size = len(next(chunks))
+        first_byte = time.perf_counter() - start
+        for chunk in chunks:
+            size += len(chunk)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        response.close()
+    finally:
+        tracemalloc.stop()
+    return {'first_byte_ms': round(first_byte * 1000, 1), 'total_ms': round(elapsed * 1000, 1),
+            'peak_kib': round(peak / 1024.0, 1), 'bytes': size}
+
+
+def check_next_link(client, rows):
+    # The look-ahead row is read by the batch that finishes the page
+    response = client.get('/view_all_jobs', query_string={'per_page': rows})
+    assert b'after=' in response.data, 'no next link on a page of {} rows'.format(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--jobs', type=int, default=20000)
+    parser.add_argument('--rows', type=int, nargs='+', default=[500, 5000, 20000])
+    args = parser.parse_args()
+
+    app.config['LOGIN_DISABLED'] = True
+    app.config['LIST_STREAM_MAX_PAGE_SIZE'] = max(args.rows + [app.config['LIST_STREAM_MAX_PAGE_SIZE']])
+    streamed_from = app.config['LIST_MAX_PAGE_SIZE']
+    report = {'jobs': args.jobs, 'stream_batch': app.config['LIST_STREAM_BATCH']}
+    with app.app_context():
+        db.create_all()
+        seed(customers=max(args.jobs // 5, 1), jobs=args.jobs, items_per_job=1, invoices=0)
+    client = app.test_client()
+    measure(client, 10)  # compile the templates
+    for rows in args.rows:
+        results = {}
+        # Everything above LIST_MAX_PAGE_SIZE streams, so raise it to force a
+        # page into one piece
+        for mode, max_page_size in (('rendered', max(rows, streamed_from)), ('streamed', rows - 1)):
+            app.config['LIST_MAX_PAGE_SIZE'] = max_page_size
+            results[mode] = measure(client, rows)
+        app.config['LIST_MAX_PAGE_SIZE'] = streamed_from
+        report['rows_{}'.format(rows)] = results
+
+    app.config['LIST_MAX_PAGE_SIZE'] = 1
+    batch = app.config['LIST_STREAM_BATCH']
+    for rows in sorted(set(args.rows) | {batch, batch * 2}):
+        if rows < args.jobs:
+            check_next_link(client, rows)
+    app.config['LIST_MAX_PAGE_SIZE'] = streamed_from
+
+    print(json.dumps(report, indent=2))
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
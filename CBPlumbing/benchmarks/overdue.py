@@ -0,0 +1,101 @@
+"""
+Overdue sweep and aging report benchmark. Seeds a database with invoices
+spread over two years, then times mark_overdue() for a backlog of a year, for
+the day after, and for the same day again (nothing left to mark), and times
+the aging report from the due date rollup. For comparison it times marking
+one day's invoices the old way, loading each into the session and saving it,
+and the aging report summed from the invoice table. Prints the results, with
+the sweep's query plan, as JSON.
+
+Run from the project folder:
+    python benchmarks/overdue.py [--invoices 500000]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+WORK_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORK_DIR, 'bench.db')
+os.environ['FRAGMENT_CACHE_MAX_BYTES'] = '0'
+
+import sqlalchemy as sa
+
+from CBPlumbing import app, db, overdue, reports
+from CBPlumbing.models import Invoice, InvoiceDueRollup
+from CBPlumbing.seed import START_DATE, seed
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    db.session.commit()
+    return result, round((time.perf_counter() - start) * 1000, 1)
+
+
+def plan(statement):
+    compiled = statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    return [row[-1] for row in db.session.execute(sa.text('EXPLAIN QUERY PLAN ' + str(compiled)))]
+
+
+def mark_one_by_one(today):
+    cutoff = reports.start_of(today)
+    invoices = Invoice.query.filter(Invoice.status == 'Issued', Invoice.due_date < cutoff).all()
+    for invoice in invoices:
+        invoice.status = 'Overdue'
+        if invoice.job is not None:
+            invoice.job.invoice_status = 'Overdue'
+    return len(invoices)
+
+
+def aging_from_invoices(today):
+    cutoff = reports.start_of(today)
+    bands = [(Invoice.due_date >= cutoff, 'Not due')]
+    bands += [(Invoice.due_date >= cutoff - timedelta(days=days), label)
+              for label, days in reports.AGING_BANDS if days is not None]
+    band = sa.case(*bands, else_=reports.AGING_BANDS[-1][0])
+    return dict((label, (count, total)) for label, count, total in db.session.execute(
+        sa.select(band, sa.func.count(), sa.func.sum(Invoice.total_amount))
+        .where(Invoice.status.in_(reports.OUTSTANDING_STATUSES), Invoice.due_date.isnot(None))
+        .group_by(band)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--invoices', type=int, default=500000)
+    args = parser.parse_args()
+
+    report = {'invoices': args.invoices}
+    with app.app_context():
+        db.create_all()
+        seed(customers=max(args.invoices // 10, 1), jobs=args.invoices, items_per_job=1, invoices=args.invoices)
+        day = (START_DATE + timedelta(days=365)).date()
+        for name, today in (('backlog', day), ('next_day', day + timedelta(days=1)),
+                            ('same_day', day + timedelta(days=1))):
+            count, ms = timed(lambda: overdue.mark_overdue(today))
+            report[name] = {'marked': count, 'ms': ms}
+        count, ms = timed(lambda: mark_one_by_one(day + timedelta(days=2)))
+        report['next_day_one_by_one'] = {'marked': count, 'ms': ms}
+        aged, ms = timed(lambda: reports.aging(day + timedelta(days=2)))
+        report['aging'] = {'ms': ms, 'rollup_rows': db.session.query(InvoiceDueRollup).count(), 'bands': aged}
+        scanned, ms = timed(lambda: aging_from_invoices(day + timedelta(days=2)))
+        assert all(abs(scanned.get(label, (0, 0.0))[1] - total) < 0.01 for label, (count, total) in aged.items())
+        report['aging_from_invoices'] = {'ms': ms}
+
+        cutoff = reports.start_of(day)
+        report['sweep_plan'] = plan(sa.update(Invoice).where(Invoice.status == 'Issued', Invoice.due_date < cutoff)
+                                    .values(status='Overdue'))
+
+    print(json.dumps(report, indent=2))
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
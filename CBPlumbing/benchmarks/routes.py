@@ -0,0 +1,189 @@
+"""
+Route-level load benchmark. Seeds a database with synthetic data, logs an
+admin client in per thread and drives every route through the test client
+from several threads at once: the pages in views.py, exports, imports,
+reports, the sync API, bulk status changes, invoice PDFs, assets and the
+admin pages. Deletes, login, logout and register are left out. Prints latency percentiles and queries
+per request for each route, plus the peak RSS of the process, as JSON so runs
+can be saved and compared.
+
+Run from the project folder:
+    python benchmarks/routes.py [--jobs 20000] [--threads 4] [--requests 50] [--output report.json]
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+WORK_DIR = tempfile.mkdtemp()
+DB_FILE = os.path.join(WORK_DIR, 'bench.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+os.environ['INVOICE_PDF_DIR'] = os.path.join(WORK_DIR, 'pdf')
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from CBPlumbing import app, db
+from CBPlumbing.assets import asset_url
+from CBPlumbing.models import User
+from CBPlumbing.seed import seed
+
+USERNAME, PASSWORD = 'bench', 'bench'
+
+
+def routes(counts):
+    """
+    (name, method, url, request arguments) factories for each route, picking
+    random rows. The arguments are passed to the test client's open().
+    """
+    customer = lambda: random.randint(1, counts['customer'])
+    job = lambda: random.randint(1, counts['job'])
+    item = lambda: random.randint(1, counts['job_items'])
+    invoice = lambda: random.randint(1, max(counts['invoice'], 1))
+    item_values = {'item_name': 'Radiator valve', 'item_description': 'Bench', 'item_quantity': 2, 'item_cost': 12.5}
+    customer_values = {'first_name': 'Bench', 'last_name': 'Customer', 'phone': '0123', 'email': 'bench@example.com',
+                       'first_line_address': '1 High Street', 'city': 'Leeds', 'county': 'West Yorkshire',
+                       'postal_code': 'LS1 1AA'}
+    customer_csv = ','.join(customer_values) + '\n' + (','.join(customer_values.values()) + '\n') * 20
+    item_form = lambda: {'data': item_values}
+    items_form = lambda: {'data': {'items-{}-{}'.format(number, name): value
+                                   for number in range(5) for name, value in item_values.items()}}
+    customer_form = lambda: {'data': customer_values}
+    import_form = lambda: {'data': {'kind': 'customers', 'file': (io.BytesIO(customer_csv.encode()), 'bench.csv')}}
+    bulk_form = lambda ids, status: lambda: {'data': {'ids': [ids() for _ in range(10)], 'status': status}}
+    sync_upload = lambda: {'json': {'edits': [dict(item_values, job_id=job()) for _ in range(5)]}}
+    with app.test_request_context():
+        css = asset_url('site.css')
+    # Deletes are left out so every thread keeps finding the rows it asks for
+    return [
+        ('index', 'GET', lambda: '/index', None),
+        ('contact', 'GET', lambda: '/contact', None),
+        ('about', 'GET', lambda: '/about', None),
+        ('dash', 'GET', lambda: '/dash', None),
+        ('search', 'GET', lambda: '/search?q=' + random.choice(['smith', 'boiler', 'valve', 'LS1']), None),
+        ('search_customers', 'GET', lambda: '/search_customers?q=' + random.choice(['Sm', 'Jo', 'Tay', 'LS']), None),
+        ('view_all_customers', 'GET', lambda: '/view_all_customers?sort=last_name', None),
+        ('view_customer', 'GET', lambda: '/view_customer/{}'.format(customer()), None),
+        ('add_customer', 'POST', lambda: '/add_customer', customer_form),
+        ('edit_customer', 'GET', lambda: '/edit_customer/{}'.format(customer()), None),
+        ('view_all_jobs', 'GET', lambda: '/view_all_jobs?sort=job_planned_date', None),
+        ('view_job', 'GET', lambda: '/view_job/{}'.format(job()), None),
+        ('add_job', 'GET', lambda: '/add_job', None),
+        ('edit_job', 'GET', lambda: '/edit_job/{}'.format(job()), None),
+        ('add_job_item', 'POST', lambda: '/add_job_item/{}'.format(job()), item_form),
+        ('edit_job_item', 'GET', lambda: '/edit_job_item/{}'.format(item()), None),
+        ('view_all_invoices', 'GET', lambda: '/view_all_invoices?sort=due_date', None),
+        ('view_invoice', 'GET', lambda: '/view_invoice/{}'.format(invoice()), None),
+        ('edit_invoice', 'GET', lambda: '/edit_invoice/{}'.format(invoice()), None),
+        ('add_job_items', 'POST', lambda: '/add_job_items/{}'.format(job()), items_form),
+        ('add_invoice', 'GET', lambda: '/add_invoice/{}'.format(job()), None),
+        ('invoice_pdf', 'GET', lambda: '/invoice_pdf/{}'.format(invoice()), None),
+        ('export_jobs_csv', 'GET', lambda: '/export/jobs.csv?job_status=Open', None),
+        ('export_invoices_xlsx', 'GET', lambda: '/export/invoices.xlsx', None),
+        ('import_customers', 'POST', lambda: '/import', import_form),
+        ('reports', 'GET', lambda: '/reports', None),
+        ('bulk_job_status', 'POST', lambda: '/bulk_job_status', bulk_form(job, 'Complete')),
+        ('bulk_invoice_status', 'POST', lambda: '/bulk_invoice_status', bulk_form(invoice, 'Issued')),
+        ('sync_changes', 'GET', lambda: '/api/sync/changes?since={}'.format(random.randint(0, counts['job'])), None),
+        ('sync_job_items', 'POST', lambda: '/api/sync/job_items', sync_upload),
+        ('asset', 'GET', lambda: css, None),
+        ('sql_report', 'GET', lambda: '/admin/sql_report', None),
+        ('cache_report', 'GET', lambda: '/admin/cache_report', None),
+        ('task_status', 'GET', lambda: '/admin/tasks', None),
+    ]
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def client():
+    test_client = app.test_client()
+    test_client.post('/login', data={'username': USERNAME, 'password': PASSWORD})
+    return test_client
+
+
+def drive(route, requests, threads):
+    name, method, url, arguments = route
+    local = threading.local()
+
+    def one(_):
+        if not hasattr(local, 'client'):
+            local.client = client()
+        start = time.perf_counter()
+        response = local.client.open(url(), method=method, **(arguments() if arguments else {}))
+        # Streamed responses are only produced as they are read
+        response.get_data()
+        elapsed = time.perf_counter() - start
+        if response.status_code >= 400:
+            raise RuntimeError('{} returned {}'.format(name, response.status_code))
+        return elapsed, int(response.headers.get('X-Query-Count', 0))
+
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(one, range(requests)))
+    timings = sorted(result[0] for result in results)
+    return {
+        'p50_ms': round(percentile(timings, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 2),
+        'queries_per_request': round(sum(result[1] for result in results) / len(results), 2),
+    }
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--customers', type=int, default=5000)
+    parser.add_argument('--jobs', type=int, default=20000)
+    parser.add_argument('--items-per-job', type=int, default=4)
+    parser.add_argument('--invoices', type=int, default=10000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=50, help='requests per route')
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    random.seed(0)
+    with app.app_context():
+        db.create_all()
+        user = User(username=USERNAME, email='bench@example.com', is_admin=True)
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+        start = time.perf_counter()
+        counts = seed(args.customers, args.jobs, args.items_per_job, args.invoices)
+        seconds = time.perf_counter() - start
+
+    report = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'rows': counts,
+        'seed_seconds': round(seconds, 1),
+        'threads': args.threads,
+        'requests_per_route': args.requests,
+        'routes': {route[0]: drive(route, args.requests, args.threads) for route in routes(counts)},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output)
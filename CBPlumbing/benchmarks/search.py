@@ -0,0 +1,76 @@
+"""
+Times the global search against a database with a given number of indexed
+rows, split between customers, jobs and job items.
+
+Run from the project folder:  python benchmarks/search.py 1000000
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+
+import sqlalchemy as sa
+
+from CBPlumbing import app, db
+from CBPlumbing import search
+from CBPlumbing.models import Customer, Job, JobItems
+
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Susan']
+LAST_NAMES = ['Smith', 'Jones', 'Taylor', 'Brown', 'Williams', 'Wilson', 'Johnson', 'Davies', 'Robinson', 'Wright']
+WORDS = ['boiler', 'radiator', 'valve', 'leak', 'pump', 'flue', 'service', 'thermostat', 'cylinder', 'pressure',
+         'copper', 'pipe', 'fitting', 'drain', 'tap', 'shower', 'combi', 'filter', 'magnetic', 'sludge']
+# Part codes give the notes and descriptions a long tail of rarer words
+PART_CODES = ['GC{}'.format(n) for n in range(20000)]
+QUERIES = ['smith', 'boiler leak', 'therm', 'GC1234', 'GC77 valve', 'robinson wright', 'zzzz']
+BATCH = 50000
+
+
+def words(count):
+    return ' '.join(random.choice(WORDS) for _ in range(count)) + ' ' + random.choice(PART_CODES)
+
+
+def seed(rows):
+    random.seed(0)
+    db.drop_all()
+    db.create_all()
+    customers, jobs = rows // 10, rows // 5
+    items = rows - customers - jobs
+    for start in range(0, customers, BATCH):
+        db.session.execute(sa.insert(Customer), [
+            {'first_name': random.choice(FIRST_NAMES), 'last_name': random.choice(LAST_NAMES),
+             'city': 'Leeds', 'postal_code': 'LS{} {}AB'.format(i % 30, i % 9), 'customer_active': True}
+            for i in range(start, min(start + BATCH, customers))])
+    for start in range(0, jobs, BATCH):
+        db.session.execute(sa.insert(Job), [
+            {'customer_id': i % customers + 1, 'job_type': 'Service', 'job_notes': words(8)}
+            for i in range(start, min(start + BATCH, jobs))])
+    for start in range(0, items, BATCH):
+        db.session.execute(sa.insert(JobItems), [
+            {'job_id': i % jobs + 1, 'item_name': words(2), 'item_description': words(6),
+             'item_quantity': 1, 'item_cost': 10.0}
+            for i in range(start, min(start + BATCH, items))])
+    db.session.commit()
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with app.app_context():
+        start = time.perf_counter()
+        seed(rows)
+        print('seeded {} rows in {:.1f}s'.format(rows, time.perf_counter() - start))
+        print('{:>20} {:>12} {:>10}'.format('query', 'time (ms)', 'results'))
+        for term in QUERIES:
+            timings = []
+            for _ in range(5):
+                start = time.perf_counter()
+                results = search.search(term)
+                timings.append(time.perf_counter() - start)
+            count = sum(len(rows) for rows in results.values())
+            print('{:>20} {:>12.1f} {:>10}'.format(term, min(timings) * 1000, count))
@@ -0,0 +1,95 @@
+"""
+Device sync benchmark. Seeds a database, then times the change feed: a full
+download page by page from token 0, and a delta after a batch of jobs is
+edited elsewhere, reporting requests, bytes and milliseconds. It then uploads
+a batch of job item edits and times that. Prints the results as JSON.
+
+Run from the project folder:
+    python benchmarks/sync.py [--jobs 100000] [--edits 100] [--page 1000]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+WORK_DIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORK_DIR, 'bench.db')
+os.environ['FRAGMENT_CACHE_MAX_BYTES'] = '0'
+
+import sqlalchemy as sa
+
+from CBPlumbing import app, db
+from CBPlumbing.models import ChangeLog, Job, JobItems
+from CBPlumbing.seed import seed
+
+
+def pull(client, since, page):
+    """Follows the feed from since to the end: (token, requests, bytes, ms, slowest page ms)."""
+    requests = size = 0
+    slowest = 0.0
+    start = time.perf_counter()
+    while True:
+        page_start = time.perf_counter()
+        response = client.get('/api/sync/changes', query_string={'since': since, 'limit': page})
+        slowest = max(slowest, time.perf_counter() - page_start)
+        body = response.get_json()
+        requests += 1
+        size += len(response.data)
+        since = body['token']
+        if not body['more']:
+            break
+    return since, {'requests': requests, 'bytes': size, 'ms': round((time.perf_counter() - start) * 1000, 1),
+                   'slowest_page_ms': round(slowest * 1000, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--jobs', type=int, default=100000)
+    parser.add_argument('--edits', type=int, default=100)
+    parser.add_argument('--page', type=int, default=1000)
+    args = parser.parse_args()
+
+    app.config['LOGIN_DISABLED'] = True
+    app.config['SYNC_MAX_PAGE_SIZE'] = max(args.page, app.config['SYNC_MAX_PAGE_SIZE'])
+    report = {'jobs': args.jobs, 'page': args.page}
+    with app.app_context():
+        db.create_all()
+        seed(customers=max(args.jobs // 5, 1), jobs=args.jobs, items_per_job=2, invoices=args.jobs // 2)
+    client = app.test_client()
+
+    token, report['full'] = pull(client, 0, args.page)
+    with app.app_context():
+        db.session.execute(sa.update(Job).where(Job.id <= args.edits).values(job_notes='Edited offline'))
+        db.session.commit()
+        items = db.session.execute(
+            sa.select(JobItems.id, JobItems.job_id, ChangeLog.seq)
+            .join(ChangeLog, sa.and_(ChangeLog.kind == 'job_item', ChangeLog.ref_id == JobItems.id))
+            .order_by(JobItems.id).limit(args.edits)).all()
+    token, report['delta'] = pull(client, token, args.page)
+
+    edits = [{'id': item_id, 'seq': seq, 'item_name': 'Part', 'item_quantity': 2, 'item_cost': 9.5}
+             for item_id, job_id, seq in items]
+    edits += [{'job_id': job_id, 'item_name': 'Extra', 'item_quantity': 1, 'item_cost': 4.0}
+              for item_id, job_id, seq in items]
+    start = time.perf_counter()
+    response = client.post('/api/sync/job_items', json={'edits': edits})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    report['upload'] = {'edits': len(edits), 'ms': round((time.perf_counter() - start) * 1000, 1)}
+    start = time.perf_counter()
+    response = client.post('/api/sync/job_items', json={'edits': edits})
+    assert response.status_code == 409
+    report['upload_conflicting'] = {'conflicts': len(response.get_json()['conflicts']),
+                                    'ms': round((time.perf_counter() - start) * 1000, 1)}
+
+    print(json.dumps(report, indent=2))
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
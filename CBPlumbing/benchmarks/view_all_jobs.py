@@ -0,0 +1,67 @@
+"""
+Times the view_all_jobs page against databases with an increasing number of
+jobs and reports how many SQL statements each page load issues.
+
+Run from the project folder:  python benchmarks/view_all_jobs.py 100 1000 10000
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+
+import sqlalchemy as sa
+
+from CBPlumbing import app, db
+from CBPlumbing.models import Customer, Job, JobItems
+
+ITEMS_PER_JOB = 3
+
+
+def seed(job_count):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(sa.insert(Customer), [
+        {'id': 1, 'first_name': 'Bench', 'last_name': 'Customer', 'customer_active': True}])
+    db.session.execute(sa.insert(Job), [
+        {'id': i, 'customer_id': 1, 'job_type': 'Service', 'job_status': 'Open',
+         'invoice_status': 'None', 'job_planned_date': datetime(2024, 1, 1)}
+        for i in range(1, job_count + 1)])
+    db.session.execute(sa.insert(JobItems), [
+        {'job_id': i, 'item_name': 'Part', 'item_quantity': 2, 'item_cost': 10.0}
+        for i in range(1, job_count + 1) for _ in range(ITEMS_PER_JOB)])
+    db.session.execute(sa.update(Job).values(total_cost=2 * 10.0 * ITEMS_PER_JOB))
+    db.session.commit()
+
+
+def run(job_count, repeat=3):
+    seed(job_count)
+    statements = []
+    listener = lambda *args: statements.append(1)
+    sa.event.listen(db.engine, 'before_cursor_execute', listener)
+    client = app.test_client()
+    timings = []
+    for _ in range(repeat):
+        statements.clear()
+        start = time.perf_counter()
+        response = client.get('/view_all_jobs')
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200
+    sa.event.remove(db.engine, 'before_cursor_execute', listener)
+    return min(timings), len(statements)
+
+
+if __name__ == '__main__':
+    counts = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000]
+    app.config['LOGIN_DISABLED'] = True
+    with app.app_context():
+        print('{:>10} {:>12} {:>10}'.format('jobs', 'time (ms)', 'queries'))
+        for count in counts:
+            elapsed, queries = run(count)
+            print('{:>10} {:>12.1f} {:>10}'.format(count, elapsed * 1000, queries))
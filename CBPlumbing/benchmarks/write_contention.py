@@ -0,0 +1,129 @@
+"""
+Multi-process write contention benchmark. Several writer processes add job
+items (insert plus job total update, as add_job_item does) while a reader
+process keeps querying the job list. It runs once with the old rollback
+journal settings and once with the WAL engine profile, and reports commits
+per second, writes that failed with a lock error and reader latency.
+
+Run from the project folder:  python benchmarks/write_contention.py [writers] [transactions]
+"""
+
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+PROFILES = {
+    # What a bare sqlite:/// URI gave us before the engine profile existed
+    'rollback journal': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL',
+                         'SQLITE_CACHE_SIZE': '-2000', 'SQLITE_MMAP_SIZE': '0',
+                         'SQLITE_BUSY_TIMEOUT': '5000', 'SQLITE_LOCK_RETRIES': '0'},
+    'wal profile': {'SQLITE_JOURNAL_MODE': 'WAL', 'SQLITE_SYNCHRONOUS': 'NORMAL',
+                    'SQLITE_CACHE_SIZE': '-64000', 'SQLITE_MMAP_SIZE': '268435456',
+                    'SQLITE_BUSY_TIMEOUT': '5000', 'SQLITE_LOCK_RETRIES': '5'},
+}
+JOBS = 500
+
+
+def writer(transactions, results):
+    from sqlalchemy.exc import OperationalError
+
+    from CBPlumbing import app, db
+    from CBPlumbing.database import retry_on_lock
+    from CBPlumbing.models import Job, JobItems
+
+    @retry_on_lock
+    def add_item(job_id):
+        db.session.add(JobItems(job_id=job_id, item_name='Part', item_quantity=1, item_cost=5.0))
+        db.session.get(Job, job_id).update_total_cost()
+        db.session.commit()
+
+    committed = failed = 0
+    with app.app_context():
+        for _ in range(transactions):
+            try:
+                add_item(random.randint(1, JOBS))
+                committed += 1
+            except OperationalError:
+                db.session.rollback()
+                failed += 1
+    results.put(('writer', committed, failed))
+
+
+def reader(stop, results):
+    import sqlalchemy as sa
+
+    from CBPlumbing import app, db
+    from CBPlumbing.models import Job
+
+    latencies = []
+    with app.app_context():
+        while not stop.is_set():
+            start = time.perf_counter()
+            db.session.execute(sa.select(Job.id, Job.total_cost).order_by(Job.id).limit(50)).all()
+            db.session.rollback()
+            latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    results.put(('reader', len(latencies), latencies[-1] if latencies else 0))
+
+
+def run(profile, writers, transactions):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ.update(PROFILES[profile])
+    context = multiprocessing.get_context('spawn')
+
+    setup = context.Process(target=create_database)
+    setup.start()
+    setup.join()
+
+    results = context.Queue()
+    stop = context.Event()
+    read = context.Process(target=reader, args=(stop, results))
+    read.start()
+    start = time.perf_counter()
+    processes = [context.Process(target=writer, args=(transactions, results)) for _ in range(writers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    read.join()
+
+    committed = failed = reads = 0
+    worst_read = 0
+    for _ in range(writers + 1):
+        kind, first, second = results.get()
+        if kind == 'writer':
+            committed += first
+            failed += second
+        else:
+            reads, worst_read = first, second
+    return committed / elapsed, failed, reads / elapsed, worst_read
+
+
+def create_database():
+    import sqlalchemy as sa
+
+    from CBPlumbing import app, db
+    from CBPlumbing.models import Customer, Job
+
+    with app.app_context():
+        db.create_all()
+        db.session.execute(sa.insert(Customer), [{'id': 1, 'first_name': 'Bench', 'last_name': 'Customer'}])
+        db.session.execute(sa.insert(Job), [{'id': i, 'customer_id': 1} for i in range(1, JOBS + 1)])
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    transactions = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print('{} writers x {} transactions, 1 reader'.format(writers, transactions))
+    print('{:>18} {:>12} {:>10} {:>10} {:>16}'.format('profile', 'commits/s', 'failed', 'reads/s', 'worst read (ms)'))
+    for profile in PROFILES:
+        commits, failed, reads, worst = run(profile, writers, transactions)
+        print('{:>18} {:>12.0f} {:>10} {:>10.0f} {:>16.1f}'.format(profile, commits, failed, reads, worst * 1000))
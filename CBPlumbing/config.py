@@ -6,12 +6,69 @@ class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
+    LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE') or 50)
+    LIST_MAX_PAGE_SIZE = int(os.environ.get('LIST_MAX_PAGE_SIZE') or 500)
+    # Longer list pages, up to LIST_STREAM_MAX_PAGE_SIZE rows, are streamed
+    # a batch of rows at a time (pagination.py)
+    LIST_STREAM_MAX_PAGE_SIZE = int(os.environ.get('LIST_STREAM_MAX_PAGE_SIZE') or 20000)
+    LIST_STREAM_BATCH = int(os.environ.get('LIST_STREAM_BATCH') or 500)
+    LIST_PAGE_SIZE_CHOICES = [50, 500, 5000]
+    CUSTOMER_SEARCH_LIMIT = 10
+    CUSTOMER_SEARCH_MAX_LIMIT = 50
+    SEARCH_RESULTS_PER_TYPE = 20
+
+    # SQLite engine profile, applied to every new connection. WAL lets readers
+    # carry on while a worker writes; see CBPlumbing/database.py.
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -64000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 268435456))
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+    SQLITE_LOCK_RETRIES = int(os.environ.get('SQLITE_LOCK_RETRIES', 5))
+    SQLITE_CHECKPOINT_INTERVAL = int(os.environ.get('SQLITE_CHECKPOINT_INTERVAL', 300))
+
+    # Per-request query counting and timing; see CBPlumbing/instrumentation.py
+    SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', '1') == '1'
+    SQL_N_PLUS_ONE_THRESHOLD = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 5))
+
+    # Logged-in user cache; see CBPlumbing/user_cache.py. Set the version file
+    # to a path all workers can write when running more than one process.
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+    USER_CACHE_VERSION_FILE = os.environ.get('USER_CACHE_VERSION_FILE')
+
+    # Rendered template fragments; see CBPlumbing/caching.py. 0 turns it off.
+    # Keys come from the rows' versions in the database, so each worker
+    # process keeps its own cache without missing the others' writes.
+    FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+    # Background task workers; see CBPlumbing/tasks.py. A Running task older
+    # than the lease (seconds) is taken to have lost its worker.
+    TASK_WORKER_THREADS = int(os.environ.get('TASK_WORKER_THREADS', 4))
+    TASK_POLL_INTERVAL = float(os.environ.get('TASK_POLL_INTERVAL', 1.0))
+    TASK_LEASE = int(os.environ.get('TASK_LEASE', 600))
+    TASK_RETENTION_DAYS = int(os.environ.get('TASK_RETENTION_DAYS', 7))
+
+    # Printable invoice cache and batch pool size (0 is one process per CPU);
+    # see CBPlumbing/invoice_pdf.py
+    INVOICE_PDF_DIR = os.environ.get('INVOICE_PDF_DIR') or os.path.join(basedir, 'pdf_cache')
+    INVOICE_PDF_PROCESSES = int(os.environ.get('INVOICE_PDF_PROCESSES', 0))
+
+    # Seconds between the task workers' sweeps for Issued invoices past their
+    # due date; see CBPlumbing/overdue.py
+    OVERDUE_SWEEP_INTERVAL = int(os.environ.get('OVERDUE_SWEEP_INTERVAL', 3600))
+
+    # Offline device sync; see CBPlumbing/sync.py. Changes per feed page by
+    # default and at most, and job item edits accepted per upload.
+    SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', 1000))
+    SYNC_MAX_PAGE_SIZE = int(os.environ.get('SYNC_MAX_PAGE_SIZE', 5000))
+    SYNC_MAX_UPLOAD = int(os.environ.get('SYNC_MAX_UPLOAD', 500))
         
     
 
 class QueryConfig(object):
     JOB_STATUS_LIST = ['Open', 'In Progress', 'Complete', 'Cancelled']
-    INVOICE_STATUS_LIST = ['None', 'Issued', 'Paid', 'Cancelled']
+    INVOICE_STATUS_LIST = ['None', 'Issued', 'Overdue', 'Paid', 'Cancelled']
     CUSTOMER_STATUS_LIST = ['TRUE', 'FALSE']
     JOB_TYPE_LIST = ['Service', 'Warranty', 'Install', 'Repair', 'Other']
     JOB_PRIORITY_LIST = ['Low', 'Medium', 'High']
\ No newline at end of file
@@ -2,13 +2,18 @@
 This script runs the CBPlumbing application using a development server.
 """
 
+import json
+import random
+import time
 from os import environ
 
+import click
 import sqlalchemy as sa
 import sqlalchemy.orm as so
 
-from CBPlumbing import app, db
+from CBPlumbing import app, db, export, importer, invoice_pdf, overdue, reports, tasks
 from CBPlumbing.models import User
+from CBPlumbing.seed import seed
 
 if __name__ == '__main__':
     HOST = environ.get('SERVER_HOST', 'localhost')
@@ -21,4 +26,120 @@ if __name__ == '__main__':
 
 @app.shell_context_processor
 def make_shell_context():
-    return {'sa': sa, 'so': so, 'db': db, 'User': User}
\ No newline at end of file
+    return {'sa': sa, 'so': so, 'db': db, 'User': User}
+
+
+@app.cli.command('seed')
+@click.option('--customers', default=1000, show_default=True)
+@click.option('--jobs', default=5000, show_default=True)
+@click.option('--items-per-job', default=4, show_default=True)
+@click.option('--invoices', default=2000, show_default=True)
+@click.option('--random-seed', default=0, show_default=True, help='Makes runs repeatable.')
+def seed_command(customers, jobs, items_per_job, invoices, random_seed):
+    """Fills the database with synthetic customers, jobs and invoices."""
+    if invoices > jobs:
+        raise click.BadParameter('cannot be more than --jobs', param_hint='--invoices')
+    random.seed(random_seed)
+    start = time.perf_counter()
+    counts = seed(customers, jobs, items_per_job, invoices)
+    click.echo('Inserted {} in {:.1f}s'.format(
+        ', '.join('{} {}'.format(count, table) for table, count in counts.items()), time.perf_counter() - start))
+
+
+@app.cli.command('export')
+@click.argument('kind', type=click.Choice(sorted(export.EXPORTS)))
+@click.option('--format', 'fmt', type=click.Choice(sorted(export.FORMATS)), default='csv', show_default=True)
+@click.option('--output', type=click.File('wb'), default='-', help='File to write, stdout by default.')
+@click.option('--job-type')
+@click.option('--job-status')
+@click.option('--invoice-status')
+def export_command(kind, fmt, output, **filters):
+    """Writes jobs, job items or invoices as CSV or XLSX."""
+    for chunk in export.chunks(kind, fmt, filters):
+        output.write(chunk)
+
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(importer.IMPORTS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--report', type=click.File('w'), help='Writes the outcome of every row to this CSV file.')
+def import_command(kind, path, report):
+    """Imports customers or job history from a CSV file."""
+    with open(path, encoding='utf-8-sig', newline='') as source:
+        result = importer.run(kind, source, report)
+    click.echo('Imported {} rows, {} failed, in {:.1f}s ({:.0f} rows/s)'.format(
+        result.imported, result.failed, result.seconds, result.rows_per_second))
+    if report is None:
+        for line, message in result.failures:
+            click.echo('line {}: {}'.format(line, message), err=True)
+    if result.error:
+        raise click.ClickException(result.error)
+
+
+@app.cli.command('worker')
+@click.option('--threads', type=int, help='Defaults to TASK_WORKER_THREADS.')
+def worker_command(threads):
+    """Runs background tasks until interrupted."""
+    pool = tasks.WorkerPool(threads or app.config['TASK_WORKER_THREADS'], app.config['TASK_POLL_INTERVAL'])
+    click.echo('Worker {} running {} threads'.format(pool.name, pool.threads))
+    pool.run(app.config['TASK_LEASE'], app.config['TASK_RETENTION_DAYS'])
+
+
+@app.cli.command('enqueue')
+@click.argument('name')
+@click.argument('args', nargs=-1)
+@click.option('--at', 'run_at', type=click.DateTime(), help='UTC time to run at, straight away by default.')
+def enqueue_command(name, args, run_at):
+    """Queues a task. Arguments are read as JSON where they parse, else as text."""
+    def value(arg):
+        try:
+            return json.loads(arg)
+        except ValueError:
+            return arg
+    try:
+        task = tasks.enqueue(name, *[value(arg) for arg in args], run_at=run_at)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    db.session.commit()
+    click.echo('Queued task {} to run at {:%Y-%m-%d %H:%M:%S}'.format(task.id, task.run_at))
+
+
+@app.cli.command('invoice-pdfs')
+@click.option('--status', help='Only invoices with this status.')
+@click.option('--since', type=click.DateTime(), help='Only invoices dated on or after this.')
+@click.option('--processes', type=int, help='Defaults to INVOICE_PDF_PROCESSES.')
+def invoice_pdfs_command(status, since, processes):
+    """Brings the cached invoice PDFs up to date for a batch run."""
+    _, counts = invoice_pdf.render_batch(invoice_pdf.invoice_ids(status, since), processes)
+    click.echo('{rendered} rendered, {cached} already cached, in {seconds}s'.format(**counts))
+    click.echo('PDFs are in {}'.format(app.config['INVOICE_PDF_DIR']))
+
+
+@app.cli.command('rebuild-reports')
+def rebuild_reports_command():
+    """Recounts the report rollups from the jobs and invoices."""
+    start = time.perf_counter()
+    reports.rebuild(db.session.connection())
+    db.session.commit()
+    click.echo('Rebuilt the report rollups in {:.1f}s'.format(time.perf_counter() - start))
+
+
+@app.cli.command('mark-overdue')
+def mark_overdue_command():
+    """Marks Issued invoices past their due date Overdue."""
+    start = time.perf_counter()
+    count = overdue.mark_overdue()
+    db.session.commit()
+    click.echo('Marked {} invoices overdue in {:.1f}ms'.format(count, (time.perf_counter() - start) * 1000))
+
+
+@app.cli.command('make-admin')
+@click.argument('username')
+def make_admin(username):
+    """Gives a user access to the admin reports."""
+    user = db.session.scalar(sa.select(User).where(User.username == username))
+    if user is None:
+        raise click.ClickException('No user called {}'.format(username))
+    user.is_admin = True
+    db.session.commit()
+    click.echo('{} is now an admin'.format(username))